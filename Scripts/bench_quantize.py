@@ -0,0 +1,152 @@
+"""
+Benchmark de memória, latência e recall dos embeddings quantizados.
+
+Usa a coluna `embedding` do chunk store quando ela existe. Sem embeddings
+(nenhuma chamada à API é feita aqui), monta vetores substitutos do próprio
+corpus Cosmos: TF-IDF + SVD (LSA) projetados para 1536 dimensões e
+normalizados, como os do `text-embedding-ada-002`. `--replicate` multiplica o
+corpus com ruído para medir latência em escala.
+
+As consultas são vetores do corpus com ruído; o recall@k é medido contra a
+busca exata em float32.
+
+    python bench_quantize.py --replicate 50 --queries 200 -k 10 --rescore 100
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from quantize import ProductQuantizer, QuantizedIndex, ScalarQuantizer
+
+CORPUS_PATH = 'data/cosmos_data_for_weaviate.json'
+
+
+def _normalize(vectors):
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def corpus_vectors(store_path=None, corpus_path=CORPUS_PATH, dim=1536, seed=0):
+    if store_path:
+        from chunk_store import embedding_matrix, read_chunks, store_schema
+        schema = store_schema(store_path)
+        if schema is not None and 'embedding' in schema.names:
+            return np.asarray(embedding_matrix(read_chunks(store_path, columns=['embedding'])))
+
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from json_stream import iter_records
+    texts = [record['text'] for record in iter_records(corpus_path)]
+    tfidf = TfidfVectorizer(sublinear_tf=True).fit_transform(texts)
+    components = min(256, len(texts) - 1)
+    lsa = TruncatedSVD(n_components=components, random_state=seed).fit_transform(tfidf)
+    projection = np.random.default_rng(seed).standard_normal((components, dim))
+    return _normalize(lsa @ projection)
+
+
+def replicate(vectors, times, noise=0.05, seed=0):
+    if times <= 1:
+        return vectors
+    rng = np.random.default_rng(seed)
+    copies = [vectors] + [vectors + noise * rng.standard_normal(vectors.shape) / np.sqrt(vectors.shape[1])
+                          for _ in range(times - 1)]
+    return _normalize(np.concatenate(copies))
+
+
+def make_queries(vectors, count, noise=0.5, seed=1):
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), count, replace=len(vectors) < count)
+    base = vectors[rows]
+    return _normalize(base + noise * rng.standard_normal(base.shape) / np.sqrt(base.shape[1]))
+
+
+def exact_top(vectors, queries, k):
+    scores = queries @ vectors.T
+    return [set(np.argpartition(-row, k - 1)[:k]) for row in scores]
+
+
+def measure(name, index, queries, truth, k, rescore, build_seconds, full_bytes):
+    recall = 0.0
+    start = time.perf_counter()
+    for query, expected in zip(queries, truth):
+        ids, _ = index.search(query, k, rescore)
+        recall += len(expected.intersection(ids)) / float(k)
+    seconds = time.perf_counter() - start
+    return {
+        'method': name,
+        'bytes_per_vector': index.nbytes / float(len(index.codes)),
+        'memory_mb': index.nbytes / 2.0 ** 20,
+        'compression': full_bytes / float(index.nbytes),
+        'build_seconds': build_seconds,
+        'query_ms': seconds * 1000 / len(queries),
+        'recall': recall / len(queries),
+    }
+
+
+class _Exact:
+    """Busca exata em float32, com a interface de `QuantizedIndex`."""
+
+    def __init__(self, vectors):
+        self.codes = vectors
+        self.nbytes = vectors.nbytes
+
+    def search(self, query, k=10, rescore=0):
+        scores = self.codes @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])], None
+
+
+def run_benchmark(vectors, queries, k=10, rescore=100, pq_m=(96, 48)):
+    truth = exact_top(vectors, queries, k)
+    full_bytes = vectors.nbytes
+    report = [measure('float32', _Exact(vectors), queries, truth, k, 0, 0.0, full_bytes)]
+
+    quantizers = [('int8', ScalarQuantizer())] + [
+        ('pq-m%d' % m, ProductQuantizer(m=m)) for m in pq_m if vectors.shape[1] % m == 0]
+    for name, quantizer in quantizers:
+        start = time.perf_counter()
+        index = QuantizedIndex.build(quantizer, vectors)
+        build_seconds = time.perf_counter() - start
+        report.append(measure(name, index, queries, truth, k, 0, build_seconds, full_bytes))
+        if rescore:
+            report.append(measure('%s+rescore%d' % (name, rescore), index, queries, truth, k,
+                                  rescore, build_seconds, full_bytes))
+    return report
+
+
+def print_report(report, vectors, out=sys.stdout):
+    out.write('%d vectors x %d dims\n' % vectors.shape)
+    out.write('%-18s %9s %10s %7s %9s %9s %7s\n' % ('method', 'B/vector', 'memory MB', 'ratio',
+                                                    'build s', 'query ms', 'recall'))
+    for row in report:
+        out.write('%-18s %9.0f %10.2f %6.1fx %9.2f %9.3f %7.3f\n' % (
+            row['method'], row['bytes_per_vector'], row['memory_mb'], row['compression'],
+            row['build_seconds'], row['query_ms'], row['recall']))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark int8 and PQ embeddings.')
+    parser.add_argument('--store', default=None,
+                        help='Chunk store with an embedding column (default: LSA stand-in)')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--replicate', type=int, default=1)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--rescore', type=int, default=100)
+    parser.add_argument('--pq-m', type=int, action='append', default=None,
+                        help='PQ subspaces to try (default: 96 and 48)')
+    parser.add_argument('--json', help='Also write the report here')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    vectors = replicate(corpus_vectors(args.store, dim=args.dim), args.replicate)
+    queries = make_queries(vectors, args.queries)
+    report = run_benchmark(vectors, queries, args.k, args.rescore, args.pq_m or (96, 48))
+    print_report(report, vectors)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,140 @@
+'''
+Throughput benchmark for sessionmirror against two local fake XNAT servers
+(see fake_xnat.py). Each mode mirrors the same seeded source project into
+a fresh destination, checks every file's md5 and reports files/sec and
+MB/sec.
+
+    python bench_sessionmirror.py --sessions 4 --latency 0.02 \\
+        --bandwidth_mb 20 --parallel 8
+'''
+
+import contextlib
+import json
+import os
+import os.path as op
+import shutil
+import sys
+import tempfile
+import time
+
+from fake_xnat import FakeXnatServer, Store, seed
+import sessionmirror
+
+
+def modes(parallel):
+    '''(name, extra sessionmirror arguments) for every benchmarked mode'''
+    j = str(parallel)
+    return [
+        ('serial', []),
+        ('parallel-j%s' % j, ['-j', j]),
+        ('stream', ['--stream']),
+        ('stream-j%s' % j, ['--stream', '-j', j]),
+        ('sessions-%s-j%s' % (j, j), ['--sessions', j, '-j', j]),
+    ]
+
+
+def run_mode(src, extra, args, work_dir):
+    '''Mirror the source into an empty destination; returns one report row'''
+    bandwidth = args.bandwidth_mb * 1024 * 1024 if args.bandwidth_mb else None
+    dst_store = Store()
+    dst_store.create(('projects', 'DST'))
+    cache_dir = tempfile.mkdtemp(dir=work_dir)
+    with FakeXnatServer(latency=args.latency, bandwidth=bandwidth,
+                        store=dst_store) as dst:
+        argv = ['--h1', src.config(op.join(work_dir, 'src.json')),
+                '--h2', dst.config(op.join(work_dir, 'dst.json')),
+                '-p', 'DST', '--source_project', 'SRC',
+                '--cache_dir', cache_dir] + extra
+        mirror_args = sessionmirror.create_parser().parse_args(argv)
+        src.stats.clear()
+        start = time.time()
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(sys.stdout if args.verbose
+                                            else devnull):
+                status = sessionmirror.main(mirror_args)
+        seconds = time.time() - start
+        requests = src.stats.get('requests', 0) + dst.stats.get('requests', 0)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    checksums = dst_store.checksums()
+    nbytes = sum(len(data) for files in dst_store.files.values()
+                 for data in files.values())
+    return {
+        'status': status,
+        'verified': checksums == src.store.checksums(),
+        'files': len(checksums),
+        'mb': nbytes / 1024.0 / 1024.0,
+        'seconds': seconds,
+        'files_per_second': len(checksums) / seconds,
+        'mb_per_second': nbytes / 1024.0 / 1024.0 / seconds,
+        'requests': requests,
+    }
+
+
+def print_report(report, out=sys.stdout):
+    out.write('%-16s %6s %8s %8s %8s %8s %8s %s\n' % (
+        'mode', 'files', 'MB', 'seconds', 'files/s', 'MB/s', 'requests',
+        'check'))
+    for name, row in report.items():
+        out.write('%-16s %6d %8.1f %8.2f %8.1f %8.2f %8d %s\n' % (
+            name, row['files'], row['mb'], row['seconds'],
+            row['files_per_second'], row['mb_per_second'], row['requests'],
+            'ok' if row['verified'] and not row['status'] else 'FAILED'))
+
+
+def create_parser():
+    import argparse
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmark sessionmirror modes against fake XNATs.')
+    arg_parser.add_argument('--sessions', type=int, default=4)
+    arg_parser.add_argument('--scans', type=int, default=4,
+                            help='Scans per session (default: 4)')
+    arg_parser.add_argument('--files', type=int, default=8,
+                            help='DICOM files per scan (default: 8)')
+    arg_parser.add_argument('--file_kb', type=int, default=256)
+    arg_parser.add_argument(
+        '--latency', type=float, default=0.02,
+        help='Seconds added to every request on both servers')
+    arg_parser.add_argument(
+        '--bandwidth_mb', type=float, default=20.0,
+        help='MB/s per connection on both servers (0: unlimited)')
+    arg_parser.add_argument('--parallel', type=int, default=8,
+                            help='Workers for the parallel modes')
+    arg_parser.add_argument('--mode', action='append', default=None,
+                            help='Only run the named modes')
+    arg_parser.add_argument('--json', help='Also write the report here')
+    arg_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='Show the mirror output')
+    return arg_parser
+
+
+def main(args):
+    bandwidth = args.bandwidth_mb * 1024 * 1024 if args.bandwidth_mb else None
+    work_dir = tempfile.mkdtemp(prefix='bench_sessionmirror_')
+    report = {}
+    try:
+        with FakeXnatServer(latency=args.latency,
+                            bandwidth=bandwidth) as src:
+            nfiles, nbytes = seed(src.store, sessions=args.sessions,
+                                  scans=args.scans, files=args.files,
+                                  file_size=args.file_kb * 1024)
+            print('source: %d files, %.1f MB; latency %.3fs, %s MB/s'
+                  % (nfiles, nbytes / 1024.0 / 1024.0, args.latency,
+                     args.bandwidth_mb or 'unlimited'))
+            for name, extra in modes(args.parallel):
+                if args.mode and name not in args.mode:
+                    continue
+                report[name] = run_mode(src, extra, args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0 if all(row['verified'] and not row['status']
+                    for row in report.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(create_parser().parse_args()))
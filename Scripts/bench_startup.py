@@ -0,0 +1,116 @@
+"""
+Benchmark de inicialização da CLI `cosmos_rag.py`, com orçamento imposto.
+
+Cada caso (`--help` da CLI e de cada subcomando) roda várias vezes num
+processo novo; o custo reportado é a mediana menos a mediana de um
+`python -c pass`, ou seja, só o que a CLI acrescenta ao interpretador. O
+script também verifica que montar o parser não importa nenhuma biblioteca
+pesada, e sai com status 1 se algum caso estourar o orçamento.
+
+    python bench_startup.py --budget-ms 50 --runs 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CLI = os.path.join(HERE, 'cosmos_rag.py')
+
+_HEAVY_CHECK = (
+    'import json, sys; import cosmos_rag; cosmos_rag.create_parser(); '
+    'print(json.dumps([m for m in cosmos_rag.HEAVY_MODULES if m in sys.modules]))'
+)
+
+
+def cases():
+    """(nome, argv) de cada caso medido."""
+    sys.path.insert(0, HERE)
+    from cosmos_rag import create_parser
+    commands = create_parser()._subparsers._group_actions[0].choices
+    return [('--help', [CLI, '--help'])] + [
+        ('%s --help' % name, [CLI, name, '--help']) for name in commands]
+
+
+def time_run(argv, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + argv, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, cwd=HERE, check=True)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def heavy_imports():
+    output = subprocess.run([sys.executable, '-c', _HEAVY_CHECK], cwd=HERE,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def import_times(argv, top=10):
+    """Maiores tempos cumulativos de importação (`-X importtime`), em ms."""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime'] + argv, cwd=HERE,
+                            stdout=subprocess.DEVNULL, capture_output=False,
+                            stderr=subprocess.PIPE, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative) / 1000.0, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def run_benchmark(runs=15, budget_ms=50.0):
+    baseline = time_run(['-c', 'pass'], runs)
+    report = {'baseline_ms': baseline * 1000, 'budget_ms': budget_ms, 'cases': {}}
+    for name, argv in cases():
+        seconds = time_run(argv, runs)
+        overhead_ms = (seconds - baseline) * 1000
+        report['cases'][name] = {'median_ms': seconds * 1000,
+                                 'overhead_ms': overhead_ms,
+                                 'ok': overhead_ms <= budget_ms}
+    report['heavy_imports'] = heavy_imports()
+    report['ok'] = (not report['heavy_imports'] and
+                    all(case['ok'] for case in report['cases'].values()))
+    return report
+
+
+def print_report(report, out=sys.stdout):
+    out.write('python -c pass: %.1f ms, budget: +%.1f ms\n'
+              % (report['baseline_ms'], report['budget_ms']))
+    out.write('%-20s %10s %12s %s\n' % ('case', 'median ms', 'overhead ms', 'check'))
+    for name, case in report['cases'].items():
+        out.write('%-20s %10.1f %12.1f %s\n' % (name, case['median_ms'],
+                                                case['overhead_ms'],
+                                                'ok' if case['ok'] else 'OVER BUDGET'))
+    out.write('heavy imports at startup: %s\n'
+              % (', '.join(report['heavy_imports']) or 'none'))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark cosmos_rag.py startup.')
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--budget-ms', type=float, default=50.0,
+                        help='Allowed startup time above a bare interpreter')
+    parser.add_argument('--importtime', action='store_true',
+                        help='Also show the slowest imports of `cosmos_rag.py --help`')
+    parser.add_argument('--json', help='Also write the report here')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run_benchmark(args.runs, args.budget_ms)
+    print_report(report)
+    if args.importtime:
+        for ms, name in import_times([CLI, '--help']):
+            print('%8.1f ms  %s' % (ms, name))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(0 if report['ok'] else 1)
@@ -0,0 +1,124 @@
+"""
+Script para construir o índice página -> capítulo do livro Cosmos.
+
+O índice é montado uma única vez a partir do sumário e dos metadados de
+página de `cosmos_data_for_weaviate.json` e salvo em JSON ao lado dos dados.
+"""
+import json
+import os
+import re
+import unicodedata
+
+from json_stream import iter_records
+
+CHAPTER_INDEX_PATH = 'data/cosmos_chapter_index.json'
+
+_TOC_HEADING = 'Sumário'
+_TOC_ENTRY = re.compile(r'(?:^|\s)(\d{1,2})\.\s')
+_CHAPTER_NUMBER = re.compile(r'\b(\d{1,2})\b')
+
+
+def _normalize(text):
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def _common_prefix_words(a, b):
+    words = []
+    for x, y in zip(a.split(' '), b.split(' ')):
+        if _normalize(x) != _normalize(y):
+            break
+        words.append(x)
+    return ' '.join(words)
+
+
+def _page_texts(records):
+    pages = {}
+    for record in records:
+        pages.setdefault(record['metadata']['page'], record['text'])
+    return dict(sorted(pages.items()))
+
+
+def _toc_entries(toc_text):
+    matches = list(_TOC_ENTRY.finditer(toc_text))
+    entries = []
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(toc_text)
+        entries.append((int(match.group(1)), toc_text[match.end():end].strip()))
+    return entries
+
+
+def build_chapter_index(records):
+    pages = _page_texts(records)
+    toc_page = next((p for p, t in pages.items() if t.startswith(_TOC_HEADING)), None)
+    if toc_page is None:
+        raise ValueError('sumário não encontrado nos dados')
+
+    chapters = []
+    candidates = [p for p in pages if p > toc_page]
+    for number, toc_title in _toc_entries(pages[toc_page]):
+        prefix = '%d. ' % number
+        for page in candidates:
+            text = pages[page]
+            if not text.startswith(prefix):
+                continue
+            title = _common_prefix_words(toc_title, text[len(prefix):])
+            if title:
+                chapters.append({'number': number, 'title': title, 'start_page': page})
+                candidates = [p for p in candidates if p > page]
+                break
+
+    # O último capítulo termina quando a numeração recomeça (caderno de imagens)
+    last_page = max(pages)
+    for i, chapter in enumerate(chapters):
+        if i + 1 < len(chapters):
+            chapter['end_page'] = chapters[i + 1]['start_page'] - 1
+        else:
+            restart = next((p for p in pages if p > chapter['start_page']
+                            and pages[p].startswith('1. ')), last_page + 1)
+            chapter['end_page'] = restart - 1
+
+    page_to_chapter = {}
+    for chapter in chapters:
+        for page in range(chapter['start_page'], chapter['end_page'] + 1):
+            page_to_chapter[str(page)] = chapter['number']
+
+    return {'chapters': chapters, 'pages': page_to_chapter}
+
+
+def load_chapter_index(data_path='data/cosmos_data_for_weaviate.json',
+                       index_path=CHAPTER_INDEX_PATH):
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    index = build_chapter_index(iter_records(data_path))
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    return index
+
+
+def chapter_for_page(page, index):
+    return index['pages'].get(str(page))
+
+
+def resolve_chapter(classification, index):
+    """Mapeia a saída de `classify_query` para o número de um capítulo."""
+    normalized = _normalize(classification)
+    for chapter in index['chapters']:
+        if _normalize(chapter['title']) in normalized:
+            return chapter['number']
+
+    numbers = {chapter['number'] for chapter in index['chapters']}
+    for match in _CHAPTER_NUMBER.finditer(normalized):
+        if int(match.group(1)) in numbers:
+            return int(match.group(1))
+    return None
+
+
+if __name__ == "__main__":
+    index = load_chapter_index()
+    for chapter in index['chapters']:
+        print('%2d. %s (p. %d-%d)' % (chapter['number'], chapter['title'],
+                                      chapter['start_page'], chapter['end_page']))
@@ -0,0 +1,369 @@
+"""
+Script com o cliente da API de chat completions da OpenAI (biblioteca 1.x).
+
+Três modos de geração, todos contabilizados em `token_usage.py`:
+
+- `chat`: uma chamada síncrona (`generate_response`, `classify_query`);
+- `bulk_chat` / `bulk_jsonl`: muitos prompts em voo ao mesmo tempo, com um
+  limite de concorrência e um `RateLimiter` compartilhado (requisições e
+  tokens por minuto); a saída sai na ordem da entrada;
+- arquivos de lote (`submit_batch` / `collect_batch`): o JSONL de entrada vira
+  um job da Batch API, processado pela OpenAI em até 24 h, para avaliações e
+  backfills grandes que não precisam de resposta imediata.
+
+O JSONL de entrada tem um pedido por linha: `{"id": ..., "prompt": ...}`,
+`{"id": ..., "messages": [...]}` ou `{"id": ..., "query": ..., "passages":
+[...]}` (montado com `build_prompt`). A saída tem `id`, `answer`, `usage` e,
+se a chamada falhou, `error`.
+
+`COSMOS_RAG_OPENAI_BASE_URL` aponta o cliente para outro servidor, como o
+`openai_stub.py` local:
+
+    python openai_stub.py --port 8089 --delay 0.2 &
+    COSMOS_RAG_OPENAI_BASE_URL=http://127.0.0.1:8089/v1 \\
+        python chat_client.py bulk --input evals.jsonl --output answers.jsonl
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from functools import lru_cache
+
+from json_stream import JsonWriter, iter_records
+from rag_config import get_config
+from token_usage import get_ledger, usage_counts
+
+CHAT_ENDPOINT = '/v1/chat/completions'
+
+
+@lru_cache(maxsize=None)
+def client(api_key=None):
+    """Cliente compartilhado: mantém o pool de conexões entre as chamadas."""
+    import openai
+    config = get_config().openai
+    return openai.OpenAI(api_key=api_key or get_config().require_openai_key(),
+                         base_url=config.base_url, timeout=config.timeout)
+
+
+def async_client(api_key=None):
+    # Um por execução de `bulk_chat`: o cliente assíncrono fica preso ao seu loop
+    import openai
+    config = get_config().openai
+    return openai.AsyncOpenAI(api_key=api_key or get_config().require_openai_key(),
+                              base_url=config.base_url, timeout=config.timeout)
+
+
+def messages_for(request):
+    if isinstance(request, str):
+        return [{'role': 'user', 'content': request}]
+    if not isinstance(request, dict):
+        raise ValueError('pedido deve ser um texto ou um objeto: %r' % (request,))
+    if 'messages' in request:
+        return request['messages']
+    if 'prompt' in request:
+        return [{'role': 'user', 'content': request['prompt']}]
+    if 'query' in request:
+        from generate_response import build_prompt
+        return [{'role': 'user', 'content': build_prompt(request['query'],
+                                                         request.get('passages', []))}]
+    raise ValueError('pedido sem "prompt", "messages" ou "query": %r' % (request,))
+
+
+def _answer(response):
+    return (response.choices[0].message.content or '').strip()
+
+
+def _answer_text(body):
+    # O mesmo que `_answer`, para o corpo em JSON das respostas de um lote
+    return (body['choices'][0]['message']['content'] or '').strip()
+
+
+def chat(request, api_key=None, stage='chat', max_tokens=150, model=None, temperature=0):
+    """Uma chamada de chat; `request` é um prompt ou um pedido do formato JSONL."""
+    response = get_ledger().call(stage, model or get_config().openai.chat_model,
+                                 client(api_key).chat.completions.create,
+                                 messages=messages_for(request), max_tokens=max_tokens,
+                                 temperature=temperature)
+    return _answer(response)
+
+
+class RateLimiter:
+    """Token bucket assíncrono para requisições e tokens por minuto.
+
+    Compartilhado por todas as tarefas de um `bulk_chat`; quem não tem saldo
+    espera, na ordem de chegada, até o balde encher de novo.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        now = time.monotonic()
+        self.buckets = {name: [float(limit), float(limit), now]
+                        for name, limit in (('requests', requests_per_minute),
+                                            ('tokens', tokens_per_minute)) if limit}
+        self._lock = None
+
+    def _reserve(self, tokens):
+        now = time.monotonic()
+        wait = 0.0
+        needs = {'requests': 1.0, 'tokens': float(tokens)}
+        for name, bucket in self.buckets.items():
+            capacity, level, last = bucket
+            level = min(capacity, level + (now - last) * capacity / 60.0)
+            bucket[1:] = level, now
+            need = min(needs[name], capacity)
+            if level < need:
+                wait = max(wait, (need - level) * 60.0 / capacity)
+        if wait:
+            return wait
+        for name, bucket in self.buckets.items():
+            bucket[1] -= min(needs[name], bucket[0])
+        return 0.0
+
+    async def acquire(self, tokens=0):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                wait = self._reserve(tokens)
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+
+
+def _estimated_tokens(messages, max_tokens):
+    # ~4 caracteres por token; a saída conta pelo máximo pedido
+    return sum(len(message.get('content') or '') for message in messages) // 4 + max_tokens
+
+
+async def bulk_chat(requests, api_key=None, stage='bulk_chat', concurrency=None,
+                    limiter=None, max_tokens=150, model=None, temperature=0):
+    """Gera as respostas de `requests` em paralelo, devolvendo-as na ordem.
+
+    No máximo `concurrency` chamadas ficam em voo; os pedidos são lidos sob
+    demanda, então `requests` pode ser um iterável grande.
+    """
+    tunables = get_config().tunables
+    concurrency = concurrency or tunables.chat_concurrency
+    limiter = limiter or RateLimiter(tunables.chat_requests_per_minute,
+                                     tunables.chat_tokens_per_minute)
+    model = model or get_config().openai.chat_model
+    ledger = get_ledger()
+    api = async_client(api_key)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def generate(index, request):
+        request_id = _request_id(request, index)
+        async with semaphore:
+            try:
+                messages = messages_for(request)
+                await limiter.acquire(_estimated_tokens(messages, max_tokens))
+                ledger.check(stage)
+                start = time.perf_counter()
+                response = await api.chat.completions.create(
+                    model=model, messages=messages, max_tokens=max_tokens,
+                    temperature=temperature)
+            except Exception as e:
+                return {'id': request_id, 'answer': None, 'error': '%s: %s' % (type(e).__name__, e)}
+        prompt_tokens, completion_tokens = usage_counts(response)
+        ledger.record(stage, model, prompt_tokens, completion_tokens,
+                      time.perf_counter() - start, query_id=str(request_id))
+        return {'id': request_id, 'answer': _answer(response),
+                'usage': {'prompt_tokens': prompt_tokens,
+                          'completion_tokens': completion_tokens}}
+
+    pending = deque()
+    try:
+        for index, request in enumerate(requests):
+            pending.append(asyncio.ensure_future(generate(index, request)))
+            # Janela limitada: a memória não cresce com o tamanho da entrada
+            if len(pending) >= 2 * concurrency:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+        await api.close()
+
+
+def chat_many(requests, api_key=None, **options):
+    """Versão síncrona de `bulk_chat`, para listas que cabem na memória."""
+    async def collect():
+        return [result async for result in bulk_chat(requests, api_key, **options)]
+    return asyncio.run(collect())
+
+
+def bulk_jsonl(input_path, output_path, api_key=None, **options):
+    """Responde um JSONL de pedidos em paralelo; devolve (respostas, erros)."""
+    async def run():
+        errors = 0
+        with JsonWriter(output_path, lines=True) as writer:
+            async for result in bulk_chat(iter_records(input_path), api_key, **options):
+                writer.write(result)
+                errors += 'error' in result
+        return writer.count, errors
+    return asyncio.run(run())
+
+
+def _request_id(request, index):
+    return request.get('id', index) if isinstance(request, dict) else index
+
+
+def write_batch_file(input_path, batch_path, errors=None, max_tokens=150, model=None,
+                     temperature=0):
+    """Converte os pedidos para o formato de entrada da Batch API.
+
+    Pedidos inválidos ficam de fora do lote; como em `bulk_chat`, cada um
+    vira um registro com `error`, escrito em `errors` (um `JsonWriter`, por
+    exemplo). Devolve (pedidos no lote, pedidos inválidos).
+    """
+    model = model or get_config().openai.chat_model
+    invalid = 0
+
+    def lines():
+        nonlocal invalid
+        for index, request in enumerate(iter_records(input_path)):
+            request_id = _request_id(request, index)
+            try:
+                messages = messages_for(request)
+            except ValueError as e:
+                invalid += 1
+                if errors is not None:
+                    errors.write({'id': request_id, 'answer': None,
+                                  'error': '%s: %s' % (type(e).__name__, e)})
+                continue
+            yield {'custom_id': str(request_id), 'method': 'POST', 'url': CHAT_ENDPOINT,
+                   'body': {'model': model, 'messages': messages,
+                            'max_tokens': max_tokens, 'temperature': temperature}}
+    with JsonWriter(batch_path, lines=True) as writer:
+        count = writer.write_all(lines())
+    return count, invalid
+
+
+def submit_batch(input_path, api_key=None, batch_path=None, **options):
+    """Envia os pedidos como um job da Batch API e devolve (`Batch`, inválidos).
+
+    Os pedidos inválidos vão para `<batch_path>.errors.jsonl`.
+    """
+    batch_path = batch_path or input_path + '.batch.jsonl'
+    with JsonWriter(batch_path + '.errors.jsonl', lines=True) as errors:
+        count, invalid = write_batch_file(input_path, batch_path, errors, **options)
+    if not count:
+        raise ValueError('nenhum pedido válido em %s' % input_path)
+    api = client(api_key)
+    with open(batch_path, 'rb') as f:
+        uploaded = api.files.create(file=f, purpose='batch')
+    batch = api.batches.create(input_file_id=uploaded.id, endpoint=CHAT_ENDPOINT,
+                               completion_window='24h')
+    return batch, invalid
+
+
+def batch_status(batch_id, api_key=None):
+    return client(api_key).batches.retrieve(batch_id)
+
+
+def read_batch_output(lines, output_path, stage='batch_chat'):
+    """Converte linhas de saída (ou de erro) da Batch API para o formato de
+    `bulk_jsonl`; devolve (respostas, erros)."""
+    ledger = get_ledger()
+    errors = 0
+    with JsonWriter(output_path, lines=True) as writer:
+        for line in lines:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            body = (record.get('response') or {}).get('body') or {}
+            if record.get('error') or 'choices' not in body:
+                errors += 1
+                writer.write({'id': record['custom_id'], 'answer': None,
+                              'error': json.dumps(record.get('error') or body.get('error'))})
+                continue
+            prompt_tokens, completion_tokens = usage_counts(body)
+            # Custo pelos preços de tabela: a Batch API cobra menos
+            ledger.record(stage, body['model'], prompt_tokens, completion_tokens, 0.0,
+                          query_id=record['custom_id'])
+            writer.write({'id': record['custom_id'], 'answer': _answer_text(body),
+                          'usage': {'prompt_tokens': prompt_tokens,
+                                    'completion_tokens': completion_tokens}})
+    return writer.count, errors
+
+
+def collect_batch(batch_id, output_path, api_key=None, stage='batch_chat'):
+    """Baixa o resultado de um job concluído no formato de saída de `bulk_jsonl`."""
+    api = client(api_key)
+    batch = api.batches.retrieve(batch_id)
+    if batch.status != 'completed':
+        raise RuntimeError('lote %s ainda não concluído: %s' % (batch_id, batch.status))
+    lines = (line for file_id in filter(None, (batch.output_file_id, batch.error_file_id))
+             for line in api.files.content(file_id).text.splitlines())
+    return read_batch_output(lines, output_path, stage)
+
+
+def bulk_options(args):
+    tunables = get_config().tunables
+    return {'max_tokens': args.max_tokens, 'model': args.model,
+            'concurrency': args.concurrency,
+            'limiter': RateLimiter(args.rpm or tunables.chat_requests_per_minute,
+                                   args.tpm or tunables.chat_tokens_per_minute)}
+
+
+def run_command(args):
+    """`bulk`, `submit`, `status` e `collect`, compartilhados com `cosmos-rag`."""
+    if args.mode == 'bulk':
+        start = time.perf_counter()
+        count, errors = bulk_jsonl(args.input, args.output, **bulk_options(args))
+        print('%d answers (%d errors) in %.1f s saved to %s'
+              % (count, errors, time.perf_counter() - start, args.output))
+        return 1 if errors else 0
+    if args.mode == 'submit':
+        batch, invalid = submit_batch(args.input, max_tokens=args.max_tokens,
+                                      model=args.model)
+        print('%s %s' % (batch.id, batch.status))
+        if invalid:
+            print('%d invalid requests left out, see %s.batch.jsonl.errors.jsonl'
+                  % (invalid, args.input))
+    elif args.mode == 'status':
+        batch = batch_status(args.batch_id)
+        counts = batch.request_counts
+        print('%s %s %s/%s done, %s failed' % (batch.id, batch.status, counts.completed,
+                                               counts.total, counts.failed))
+    else:
+        count, errors = collect_batch(args.batch_id, args.output)
+        print('%d answers (%d errors) saved to %s' % (count, errors, args.output))
+    return 0
+
+
+def add_commands(commands):
+    bulk = commands.add_parser('bulk', help='Answer a JSONL of prompts concurrently')
+    bulk.add_argument('--input', required=True)
+    bulk.add_argument('--output', required=True)
+    bulk.add_argument('--max-tokens', type=int, default=150)
+    bulk.add_argument('--model', default=None, help='Default: openai chat_model')
+    bulk.add_argument('--concurrency', type=int, default=None,
+                      help='Requests in flight (default: COSMOS_RAG_CHAT_CONCURRENCY)')
+    bulk.add_argument('--rpm', type=int, default=None, help='Requests per minute')
+    bulk.add_argument('--tpm', type=int, default=None, help='Tokens per minute')
+
+    submit = commands.add_parser('submit', help='Submit a JSONL of prompts to the Batch API')
+    submit.add_argument('--input', required=True)
+    submit.add_argument('--max-tokens', type=int, default=150)
+    submit.add_argument('--model', default=None)
+
+    status = commands.add_parser('status', help='Show a Batch API job')
+    status.add_argument('batch_id')
+
+    collect = commands.add_parser('collect', help='Download a finished Batch API job')
+    collect.add_argument('batch_id')
+    collect.add_argument('--output', required=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Chat completions: bulk and batch-file modes.')
+    commands = parser.add_subparsers(dest='mode', metavar='mode')
+    commands.required = True
+    add_commands(commands)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    raise SystemExit(run_command(parse_args()))
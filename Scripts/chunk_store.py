@@ -0,0 +1,155 @@
+"""
+Script para armazenar os chunks do pipeline em formato colunar (Arrow).
+
+O armazenamento é um diretório com segmentos Arrow IPC (`part-00000.arrow`,
+...). Cada segmento é lido por memory map, sem cópia, e `append_chunks`
+acrescenta um novo segmento sem reescrever os anteriores.
+"""
+import glob
+import hashlib
+import os
+
+import pyarrow as pa
+
+from json_stream import batched, iter_records
+
+PAGE_STORE_PATH = 'data/cosmos_pages'
+CHUNK_STORE_PATH = 'data/cosmos_chunks'
+
+_SEGMENT_PATTERN = 'part-%05d.arrow'
+_BATCH_ROWS = 1024
+
+
+def chunk_schema(embedding_dim=None):
+    fields = [
+        pa.field('id', pa.string(), nullable=False),
+        pa.field('page_start', pa.int32()),
+        pa.field('page_end', pa.int32()),
+        pa.field('chunk_index', pa.int32()),
+        pa.field('text', pa.string()),
+        pa.field('hash', pa.string()),
+    ]
+    if embedding_dim:
+        fields.append(pa.field('embedding', pa.list_(pa.float32(), embedding_dim)))
+    return pa.schema(fields)
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def make_chunk(text, page_start, chunk_index=0, page_end=None, embedding=None):
+    chunk = {
+        'id': '%d-%d' % (page_start, chunk_index),
+        'page_start': page_start,
+        'page_end': page_end if page_end is not None else page_start,
+        'chunk_index': chunk_index,
+        'text': text,
+        'hash': text_hash(text),
+    }
+    if embedding is not None:
+        chunk['embedding'] = embedding
+    return chunk
+
+
+def _segments(store_path):
+    return sorted(glob.glob(os.path.join(store_path, 'part-*.arrow')))
+
+
+def _write_segment(path, chunks, schema):
+    # Escreve em lotes: iteráveis grandes nunca são materializados por inteiro
+    rows = 0
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            if isinstance(chunks, pa.Table):
+                table = chunks.select(schema.names).cast(schema)
+                writer.write_table(table)
+                return table.num_rows
+            for batch in batched(chunks, _BATCH_ROWS):
+                writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+                rows += len(batch)
+    return rows
+
+
+def _read_segment(path):
+    # memory_map + read_all não copia os buffers: as colunas apontam para o arquivo
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def store_schema(store_path):
+    segments = _segments(store_path)
+    if not segments:
+        return None
+    return pa.ipc.open_file(pa.memory_map(segments[0], 'r')).schema
+
+
+def write_chunks(store_path, chunks, embedding_dim=None):
+    """Substitui todo o conteúdo do armazenamento por `chunks`."""
+    os.makedirs(store_path, exist_ok=True)
+    for segment in _segments(store_path):
+        os.remove(segment)
+    return _write_segment(os.path.join(store_path, _SEGMENT_PATTERN % 0), chunks,
+                          chunk_schema(embedding_dim))
+
+
+def append_chunks(store_path, chunks):
+    """Acrescenta `chunks` como um novo segmento, sem tocar nos existentes."""
+    schema = store_schema(store_path)
+    if schema is None:
+        return write_chunks(store_path, chunks)
+    segment = os.path.join(store_path, _SEGMENT_PATTERN % len(_segments(store_path)))
+    return _write_segment(segment, chunks, schema)
+
+
+def read_chunks(store_path, columns=None):
+    """Lê o armazenamento por memory map, projetando apenas `columns`."""
+    tables = [_read_segment(path) for path in _segments(store_path)]
+    if not tables:
+        raise FileNotFoundError('chunk store vazio: %s' % store_path)
+    table = pa.concat_tables(tables)
+    if columns is not None:
+        table = table.select(columns)
+    return table
+
+
+def embedding_matrix(table):
+    """Devolve a coluna `embedding` como matriz numpy (n, dim) sem cópia."""
+    column = table.column('embedding').combine_chunks()
+    return column.flatten().to_numpy().reshape(len(column), column.type.list_size)
+
+
+def write_embeddings(store_path, embeddings):
+    """Reescreve o armazenamento com a coluna `embedding` preenchida."""
+    table = read_chunks(store_path)
+    if 'embedding' in table.column_names:
+        table = table.drop_columns(['embedding'])
+    dim = len(embeddings[0])
+    flat = pa.array([x for vector in embeddings for x in vector], pa.float32())
+    table = table.append_column('embedding', pa.FixedSizeListArray.from_arrays(flat, dim))
+    # Copia para a memória antes de apagar os segmentos mapeados
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    table = pa.ipc.open_stream(sink.getvalue()).read_all()
+    return write_chunks(store_path, table, embedding_dim=dim)
+
+
+def import_records(records):
+    """Converte registros no formato de `cosmos_data_for_weaviate.json`."""
+    for record in records:
+        metadata = record['metadata']
+        yield make_chunk(record['text'], metadata['page'], metadata.get('chunk_index', 0))
+
+
+def to_records(table):
+    """Converte de volta para o formato de registros com `metadata`."""
+    columns = table.select(['text', 'page_start', 'chunk_index']).to_pydict()
+    return [{'text': text, 'metadata': {'page': page, 'chunk_index': chunk_index}}
+            for text, page, chunk_index in zip(columns['text'], columns['page_start'],
+                                               columns['chunk_index'])]
+
+
+if __name__ == "__main__":
+    records = iter_records('data/cosmos_data_for_weaviate.json')
+    count = write_chunks(CHUNK_STORE_PATH, import_records(records))
+    print("%d chunks saved to %s" % (count, CHUNK_STORE_PATH))
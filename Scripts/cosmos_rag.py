@@ -0,0 +1,305 @@
+"""
+CLI única do pipeline: `cosmos-rag extract|chunk|dedup|embed|ingest|query|generate|evaluate|serve|usage`.
+
+O módulo só importa a biblioteca padrão. Cada subcomando importa o que
+precisa (PyMuPDF, pyarrow, openai, weaviate, sklearn) dentro da própria
+função, então `--help`, erros de argumento e subcomandos leves não pagam a
+importação das bibliotecas pesadas. `bench_startup.py` mede e impõe esse
+orçamento de inicialização.
+"""
+import argparse
+import json
+import os
+import sys
+
+PAGE_STORE_PATH = 'data/cosmos_pages'
+CHUNK_STORE_PATH = 'data/cosmos_chunks'
+SHARD_ROOT = 'data/shards'
+OCR_CACHE_PATH = 'data/ocr_cache'
+PROVENANCE_PATH = 'data/cosmos_dedup_provenance.jsonl'
+
+# Bibliotecas que nenhum caminho de inicialização deve importar
+HEAVY_MODULES = ('fitz', 'pandas', 'pyarrow', 'sklearn', 'openai', 'weaviate', 'numpy')
+
+
+def _config():
+    from rag_config import get_config
+    return get_config()
+
+
+def _api_key():
+    return _config().require_openai_key()
+
+
+def cmd_extract(args):
+    from extract_text import extract_text_from_pdf, save_text_to_csv, save_text_to_store
+    if args.layout:
+        from extract_text import extract_pages
+        text = extract_pages(args.pdf, args.workers, args.ocr_workers, ocr=not args.no_ocr,
+                             cache_dir=args.ocr_cache, language=args.ocr_language)
+    else:
+        text = extract_text_from_pdf(args.pdf)
+    if args.csv:
+        save_text_to_csv(text, args.csv)
+    count = save_text_to_store(text, args.pages)
+    print("%d pages saved to %s" % (count, args.pages))
+
+
+def cmd_chunk(args):
+    from preprocess_data import preprocess_store
+    count = preprocess_store(args.pages, args.store, args.chunk_size, args.chunk_overlap,
+                             normalize=not args.raw)
+    print("%d chunks saved to %s" % (count, args.store))
+
+
+def cmd_dedup(args):
+    options = {'threshold': args.threshold, 'workers': args.workers}
+    if args.input:
+        from dedup import dedup_json_file
+        count = dedup_json_file(args.input, args.output, args.provenance, **options)
+        print("%d records saved to %s" % (count, args.output))
+    else:
+        from dedup import dedup_store
+        count = dedup_store(args.store, args.provenance, **options)
+        print("%d chunks kept in %s" % (count, args.store))
+    print("duplicates recorded in %s" % args.provenance)
+
+
+def cmd_embed(args):
+    if args.input:
+        from generate_embeddings import embed_json_file
+        count = embed_json_file(args.input, args.output, _api_key(), args.batch_size)
+        print("%d records saved to %s" % (count, args.output))
+    else:
+        from generate_embeddings import embed_chunk_store
+        count = embed_chunk_store(_api_key(), args.store, args.batch_size)
+        print("%d chunks embedded in %s" % (count, args.store))
+        if args.quantize:
+            from quantize import quantize_store
+            index = quantize_store(args.store, args.quantize)
+            print("%s codes: %.1f MB" % (args.quantize, index.nbytes / 2.0 ** 20))
+
+
+def cmd_ingest(args):
+    if args.input:
+        from ingest_data import ingest_json_to_weaviate
+        count = ingest_json_to_weaviate(args.input, _api_key(),
+                                        args.url or _config().weaviate.host, args.batch_size)
+        print("%d records ingested" % count)
+    else:
+        from ingest_data import ingest_store_to_weaviate
+        ingest_store_to_weaviate(_api_key(), args.url or _config().weaviate.host,
+                                 args.store)
+
+
+def cmd_query(args):
+    from chapter_index import load_chapter_index, resolve_chapter
+    chapter_index = load_chapter_index()
+    chapter = args.chapter
+    if chapter is None and args.classify:
+        from classify_query import classify_query
+        chapter = resolve_chapter(classify_query(args.question, _api_key()),
+                                  chapter_index)
+
+    if args.tenant or args.document:
+        from shards import open_router
+        router = open_router(args.shards, args.backend, chapter_index)
+        try:
+            results = router.search(args.question, args.k, args.tenant, args.document,
+                                    chapter)
+        finally:
+            router.close()
+        passages = [result['text'] for result in results]
+    elif args.backend == 'local':
+        from chunk_store import read_chunks, to_records
+        from retrieve_text import build_partitions, retrieve_text
+        records = to_records(read_chunks(args.store, columns=['text', 'page_start',
+                                                              'chunk_index']))
+        results = retrieve_text(args.question, build_partitions(records, chapter_index),
+                                chapter=chapter, k=args.k)
+        passages = [result['text'] for result in results]
+    else:
+        from query_weaviate import query_weaviate
+        response = query_weaviate(args.question, args.url, chapter=chapter, limit=args.k)
+        class_name = _config().weaviate.class_name
+        passages = [item['content'] for item in response['data']['Get'][class_name]]
+
+    if args.answer:
+        from generate_response import build_prompt, generate_response
+        print(generate_response(build_prompt(args.question, passages), _api_key()))
+    else:
+        for passage in passages:
+            print(passage)
+            print()
+
+
+def cmd_generate(args):
+    from chat_client import run_command
+    if args.status or args.collect:
+        args.mode, args.batch_id = ('status', args.status) if args.status else ('collect', args.collect)
+    else:
+        args.mode = 'submit' if args.batch else 'bulk'
+    return run_command(args)
+
+
+def cmd_evaluate(args):
+    from evaluate_response import context_for_pages, evaluate_response
+    text = context_for_pages(args.pages, args.store)
+    evaluation = evaluate_response(args.question, args.response, text)
+    print(json.dumps({key: float(value) for key, value in evaluation.items()}, indent=2))
+
+
+def cmd_serve(args):
+    import asyncio
+    from query_service import QueryServer, RagService
+    service = RagService.load(args.store, shard_root=args.shards)
+    try:
+        asyncio.run(QueryServer(service, workers=args.workers).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+def cmd_usage(args):
+    from token_usage import USAGE_DB_PATH, history, parse_duration, print_history
+    by = [name.strip() for name in args.by.split(',')]
+    db_path = args.db or _config().tunables.usage_db or USAGE_DB_PATH
+    if not os.path.exists(db_path):
+        print("no token usage recorded yet (%s)" % db_path, file=sys.stderr)
+        return 1
+    print_history(history(db_path, args.since and parse_duration(args.since), by), by)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='cosmos-rag',
+                                     description='Cosmos RAG pipeline.')
+    parser.add_argument('--config-dir', default=None,
+                        help='Directory with openai_config.json and weaviate_config.json '
+                             '(default: COSMOS_RAG_CONFIG_DIR or ./config)')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    extract = commands.add_parser('extract', help='Extract PDF pages to the page store')
+    extract.add_argument('pdf')
+    extract.add_argument('--pages', default=PAGE_STORE_PATH)
+    extract.add_argument('--csv', help='Also save the pages as CSV')
+    extract.add_argument('--layout', action='store_true',
+                         help='Read text blocks in reading order and OCR image-only pages')
+    extract.add_argument('-j', '--workers', type=int, default=None)
+    extract.add_argument('--ocr-workers', type=int, default=None)
+    extract.add_argument('--no-ocr', action='store_true',
+                         help='With --layout, leave image-only pages empty')
+    extract.add_argument('--ocr-language', default='por', help='Tesseract language')
+    extract.add_argument('--ocr-cache', default=OCR_CACHE_PATH,
+                         help='OCR results cached by page hash')
+    extract.set_defaults(func=cmd_extract)
+
+    chunk = commands.add_parser('chunk', help='Split the page store into chunks')
+    chunk.add_argument('--pages', default=PAGE_STORE_PATH)
+    chunk.add_argument('--store', default=CHUNK_STORE_PATH)
+    chunk.add_argument('--chunk-size', type=int, default=None)
+    chunk.add_argument('--chunk-overlap', type=int, default=0)
+    chunk.add_argument('--raw', action='store_true',
+                       help='Skip normalization (headers, hyphenation, empty pages)')
+    chunk.set_defaults(func=cmd_chunk)
+
+    dedup = commands.add_parser('dedup', help='Drop near-duplicate chunks before embedding')
+    dedup.add_argument('--store', default=CHUNK_STORE_PATH)
+    dedup.add_argument('--input', help='JSON array or JSON Lines corpus instead of the store')
+    dedup.add_argument('--output', help='JSON Lines output for --input')
+    dedup.add_argument('--provenance', default=PROVENANCE_PATH,
+                       help='JSON Lines file recording every dropped duplicate')
+    dedup.add_argument('--threshold', type=float, default=None)
+    dedup.add_argument('-j', '--workers', type=int, default=1)
+    dedup.set_defaults(func=cmd_dedup)
+
+    embed = commands.add_parser('embed', help='Embed the chunk store (or a JSON corpus)')
+    embed.add_argument('--store', default=CHUNK_STORE_PATH)
+    embed.add_argument('--input', help='JSON array or JSON Lines corpus instead of the store')
+    embed.add_argument('--output', help='JSON Lines output for --input')
+    embed.add_argument('--batch-size', type=int, default=None)
+    embed.add_argument('--quantize', choices=('int8', 'pq'), default=None,
+                       help='Also store quantized codes of the store embeddings')
+    embed.set_defaults(func=cmd_embed)
+
+    ingest = commands.add_parser('ingest', help='Load the chunk store (or a JSON corpus) into Weaviate')
+    ingest.add_argument('--store', default=CHUNK_STORE_PATH)
+    ingest.add_argument('--input', help='JSON array or JSON Lines corpus instead of the store')
+    ingest.add_argument('--url', default=None, help='Default: weaviate_config.json host')
+    ingest.add_argument('--batch-size', type=int, default=None)
+    ingest.set_defaults(func=cmd_ingest)
+
+    query = commands.add_parser('query', help='Retrieve passages and optionally answer')
+    query.add_argument('question')
+    query.add_argument('--backend', choices=('local', 'weaviate'), default='local')
+    query.add_argument('--store', default=CHUNK_STORE_PATH)
+    query.add_argument('--url', default=None, help='Default: weaviate_config.json host')
+    query.add_argument('-k', type=int, default=3)
+    query.add_argument('--tenant', action='append', default=None,
+                       help='Search the shards of this tenant (repeatable)')
+    query.add_argument('--document', action='append', default=None,
+                       help='Search the shards of this document (repeatable)')
+    query.add_argument('--shards', default=SHARD_ROOT)
+    query.add_argument('--chapter', type=int, default=None)
+    query.add_argument('--classify', action='store_true',
+                       help='Pick the chapter with classify_query')
+    query.add_argument('--answer', action='store_true',
+                       help='Generate an answer from the passages')
+    query.set_defaults(func=cmd_query)
+
+    generate = commands.add_parser('generate',
+                                   help='Answer a JSONL of prompts (concurrently or via the Batch API)')
+    generate.add_argument('--input', help='JSONL with "prompt", "messages" or "query" per line')
+    generate.add_argument('--output', help='JSONL answers')
+    generate.add_argument('--batch', action='store_true',
+                          help='Submit --input to the Batch API instead of calling live')
+    generate.add_argument('--status', metavar='BATCH_ID', help='Show a Batch API job')
+    generate.add_argument('--collect', metavar='BATCH_ID',
+                          help='Download a finished Batch API job to --output')
+    generate.add_argument('--max-tokens', type=int, default=150)
+    generate.add_argument('--model', default=None, help='Default: openai chat_model')
+    generate.add_argument('--concurrency', type=int, default=None,
+                          help='Requests in flight (default: COSMOS_RAG_CHAT_CONCURRENCY)')
+    generate.add_argument('--rpm', type=int, default=None, help='Requests per minute')
+    generate.add_argument('--tpm', type=int, default=None, help='Tokens per minute')
+    generate.set_defaults(func=cmd_generate)
+
+    evaluate = commands.add_parser('evaluate', help='Score a response against book pages')
+    evaluate.add_argument('question')
+    evaluate.add_argument('response')
+    evaluate.add_argument('--pages', type=int, nargs='+', required=True)
+    evaluate.add_argument('--store', default=CHUNK_STORE_PATH)
+    evaluate.set_defaults(func=cmd_evaluate)
+
+    serve = commands.add_parser('serve', help='Run the HTTP query service')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8000)
+    serve.add_argument('--workers', type=int, default=None)
+    serve.add_argument('--store', default=None)
+    serve.add_argument('--shards', default=None)
+    serve.set_defaults(func=cmd_serve)
+
+    usage = commands.add_parser('usage', help='Report recorded token usage and cost')
+    usage.add_argument('--db', default=None, help='Default: COSMOS_RAG_USAGE_DB')
+    usage.add_argument('--since', default=None, help='e.g. 90m, 24h, 7d (default: all)')
+    usage.add_argument('--by', default='stage,model',
+                       help='Comma-separated: stage, model, hour, day')
+    usage.set_defaults(func=cmd_usage)
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    if args.command in ('dedup', 'embed') and args.input and not args.output:
+        create_parser().error('%s --input requires --output' % args.command)
+    if args.command == 'generate' and not args.status and not (
+            args.input and (args.output or args.batch) or args.collect and args.output):
+        create_parser().error('generate needs --input with --output (or --batch), '
+                              '--status, or --collect with --output')
+    if args.config_dir:
+        # Antes de qualquer get_config(), que guarda o resultado em cache
+        os.environ['COSMOS_RAG_CONFIG_DIR'] = args.config_dir
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
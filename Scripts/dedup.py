@@ -0,0 +1,231 @@
+"""
+Script para remover chunks quase duplicados antes do embedding (MinHash/LSH).
+
+Cada chunk vira um conjunto de shingles (n-gramas de palavras do texto
+normalizado) e uma assinatura MinHash; as assinaturas são divididas em bandas
+e indexadas por LSH, então cada chunk só é comparado com os candidatos que
+caem num mesmo balde. Um candidato com similaridade de Jaccard estimada acima
+do limiar faz do chunk uma duplicata do representativo já visto.
+
+O processamento é em streaming: os chunks mantidos saem na ordem de entrada
+assim que são vistos, e o estado guardado é só a assinatura e os baldes de
+cada representativo. As duplicatas não somem: cada uma é registrada num
+arquivo JSON Lines de proveniência (`id`, `duplicate_of`, `similarity`,
+página), de onde `load_provenance` reconstrói todas as fontes de cada chunk.
+
+    python dedup.py --input data/cosmos_data_for_weaviate.json \\
+        --output data/cosmos_dedup.jsonl --provenance data/cosmos_dedup_provenance.jsonl
+"""
+import argparse
+import hashlib
+import re
+import unicodedata
+import zlib
+from functools import partial
+
+import numpy as np
+
+from json_stream import JsonWriter, batched, iter_records
+from rag_config import get_config
+
+PROVENANCE_PATH = 'data/cosmos_dedup_provenance.jsonl'
+
+_PRIME = np.uint64((1 << 32) + 15)  # primo > 2^32, acima de qualquer crc32
+_COEFFICIENT_LIMIT = 1 << 32  # a, b, x < 2^32: a * x + b <= 2^64 - 2^32, sem estouro
+_WORD = re.compile(r'\w+')
+
+
+def normalize_text(text):
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ' '.join(_WORD.findall(''.join(c for c in text if not unicodedata.combining(c))))
+
+
+def shingles(text, size=5):
+    words = normalize_text(text).split(' ')
+    if len(words) <= size:
+        return {' '.join(words)}
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def permutations(num_perm=128, seed=1):
+    rng = np.random.default_rng(seed)
+    return (rng.integers(1, _COEFFICIENT_LIMIT, num_perm, dtype=np.uint64),
+            rng.integers(0, _COEFFICIENT_LIMIT, num_perm, dtype=np.uint64))
+
+
+def minhash(text, perms, shingle_size=5):
+    a, b = perms
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles(text, shingle_size)),
+                         dtype=np.uint64)
+    return ((a[:, None] * hashes[None, :] + b[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+def lsh_bands(num_perm, threshold):
+    """O maior limiar aproximado (1/b)^(1/r) <= threshold, favorecendo o recall.
+
+    Abaixo de 1/num_perm nenhuma divisão chega ao limiar; fica a de menor
+    limiar, uma linha por banda.
+    """
+    options = [(bands, num_perm // bands) for bands in range(1, num_perm + 1)
+               if num_perm % bands == 0]
+    below = [(b, r) for b, r in options if (1.0 / b) ** (1.0 / r) <= threshold]
+    if not below:
+        return num_perm, 1
+    return max(below, key=lambda option: (1.0 / option[0]) ** (1.0 / option[1]))
+
+
+def item_id(item):
+    if 'id' in item:
+        return item['id']
+    metadata = item.get('metadata', {})
+    return '%s-%s' % (metadata.get('page'), metadata.get('chunk_index', 0))
+
+
+def _page(item):
+    return item['page_start'] if 'page_start' in item else item.get('metadata', {}).get('page')
+
+
+def text_hash(text):
+    # Mesmo resumo da coluna `hash` do chunk store, sem importar o pyarrow
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def signature_batch(num_perm, seed, shingle_size, items):
+    perms = permutations(num_perm, seed)
+    return [(item, minhash(item['text'], perms, shingle_size)) for item in items]
+
+
+class Deduplicator:
+    """Índice LSH dos representativos vistos até agora."""
+
+    def __init__(self, threshold=0.8, num_perm=128, shingle_size=5, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = {}
+        self.exact = {}
+        self.stats = {'items': 0, 'kept': 0, 'exact': 0, 'near': 0}
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes()
+                for i in range(self.bands)]
+
+    def add(self, key, signature, digest):
+        """`None` se o item é novo; senão (id do representativo, similaridade)."""
+        self.stats['items'] += 1
+        if digest in self.exact:
+            self.stats['exact'] += 1
+            return self.exact[digest], 1.0
+
+        band_keys = self._band_keys(signature)
+        best = None
+        for band, band_key in zip(self.buckets, band_keys):
+            for candidate in band.get(band_key, ()):
+                similarity = float(np.mean(self.signatures[candidate] == signature))
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (candidate, similarity)
+        if best is not None:
+            self.stats['near'] += 1
+            return best
+
+        self.stats['kept'] += 1
+        self.exact[digest] = key
+        self.signatures[key] = signature
+        for band, band_key in zip(self.buckets, band_keys):
+            band.setdefault(band_key, []).append(key)
+        return None
+
+
+def dedup_items(items, provenance=None, threshold=None, num_perm=None, shingle_size=5,
+                workers=1, batch_size=256, dedup=None):
+    """Devolve, em streaming, os itens que não são duplicatas de um anterior.
+
+    `provenance` recebe um registro por duplicata (um `JsonWriter`, por
+    exemplo). Com `workers` > 1, as assinaturas são calculadas num pool de
+    processos; o índice LSH continua sequencial e a ordem é preservada.
+    """
+    if dedup is None:
+        tunables = get_config().tunables
+        dedup = Deduplicator(threshold or tunables.dedup_threshold,
+                             num_perm or tunables.dedup_num_perm, shingle_size)
+    signed = partial(signature_batch, dedup.num_perm, dedup.seed, dedup.shingle_size)
+    if workers > 1:
+        from stages import Pipeline, Stage
+        pairs = iter(Pipeline([Stage(signed, workers=workers, kind='process',
+                                     batch_size=batch_size, source=items)]))
+    else:
+        pairs = (pair for batch in batched(items, batch_size) for pair in signed(batch))
+
+    for item, signature in pairs:
+        key = item_id(item)
+        match = dedup.add(key, signature, item.get('hash') or text_hash(item['text']))
+        if match is None:
+            yield item
+        elif provenance is not None:
+            provenance.write({'id': key, 'duplicate_of': match[0],
+                              'similarity': round(match[1], 4), 'page': _page(item)})
+
+
+def load_provenance(path):
+    """{id do representativo: [registros das duplicatas]}."""
+    sources = {}
+    for record in iter_records(path):
+        sources.setdefault(record['duplicate_of'], []).append(record)
+    return sources
+
+
+def dedup_json_file(input_path, output_path, provenance_path, **options):
+    with JsonWriter(provenance_path, lines=True) as provenance:
+        with JsonWriter(output_path, lines=True) as writer:
+            return writer.write_all(dedup_items(iter_records(input_path), provenance,
+                                                **options))
+
+
+def dedup_store(store_path, provenance_path, output_path=None, **options):
+    """Deduplica um chunk store (no lugar, se `output_path` não for dado)."""
+    from chunk_store import read_chunks, write_chunks
+    table = read_chunks(store_path)
+    dim = (table.schema.field('embedding').type.list_size
+           if 'embedding' in table.column_names else None)
+    if output_path in (None, store_path):
+        # Copia as linhas antes de apagar os segmentos mapeados
+        output_path, chunks = store_path, table.to_pylist()
+    else:
+        chunks = (row for batch in table.to_batches() for row in batch.to_pylist())
+    with JsonWriter(provenance_path, lines=True) as provenance:
+        return write_chunks(output_path, dedup_items(chunks, provenance, **options),
+                            embedding_dim=dim)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Drop near-duplicate chunks (MinHash/LSH).')
+    parser.add_argument('--input', help='JSON array or JSON Lines corpus')
+    parser.add_argument('--output', help='JSON Lines output for --input')
+    parser.add_argument('--store', help='Chunk store to deduplicate in place')
+    parser.add_argument('--provenance', default=PROVENANCE_PATH,
+                        help='JSON Lines file recording every dropped duplicate')
+    parser.add_argument('--threshold', type=float, default=None,
+                        help='Estimated Jaccard similarity (default: COSMOS_RAG_DEDUP_THRESHOLD)')
+    parser.add_argument('--num-perm', type=int, default=None)
+    parser.add_argument('--shingle-size', type=int, default=5)
+    parser.add_argument('-j', '--workers', type=int, default=1)
+    args = parser.parse_args()
+    if bool(args.input) == bool(args.store) or (args.input and not args.output):
+        parser.error('use --input with --output, or --store')
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    options = {'threshold': args.threshold, 'num_perm': args.num_perm,
+               'shingle_size': args.shingle_size, 'workers': args.workers}
+    if args.store:
+        count = dedup_store(args.store, args.provenance, **options)
+    else:
+        count = dedup_json_file(args.input, args.output, args.provenance, **options)
+    sources = load_provenance(args.provenance)
+    print('%d chunks kept, %d duplicates of %d chunks recorded in %s'
+          % (count, sum(len(v) for v in sources.values()), len(sources), args.provenance))
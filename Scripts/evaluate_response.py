@@ -1,10 +1,11 @@
 """
 Script para avaliar respostas usando a API OpenAI.
 """
-import json
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import TfidfVectorizer
 
+from chunk_store import CHUNK_STORE_PATH, read_chunks
+
 def evaluate_response(question, response, text):
     vectorizer = TfidfVectorizer().fit_transform([question, response, text])
     vectors = vectorizer.toarray()
@@ -17,13 +18,17 @@ def evaluate_response(question, response, text):
         "semantic_similarity": cosine_sim[0][1]
     }
 
+def context_for_pages(pages, store_path=CHUNK_STORE_PATH):
+    table = read_chunks(store_path, columns=["page_start", "text"])
+    wanted = set(pages)
+    return " ".join(text for page, text in zip(table.column("page_start").to_pylist(),
+                                               table.column("text").to_pylist())
+                    if page in wanted)
+
 if __name__ == "__main__":
-    with open('config/openai_config.json', 'r', encoding='utf-8') as f:
-        config = json.load(f)
-    
     sample_question = "Qual é a opinião de Carl Sagan sobre a possibilidade de formas de vida baseadas em elementos diferentes do carbono e água?"
     sample_response = "Carl Sagan sugere que é possível que formas de vida possam existir baseadas em elementos diferentes, como o silício, dependendo das condições ambientais."
-    chapter_text = "Texto do capítulo relevante do livro Cosmos."
+    chapter_text = context_for_pages([39, 40])
     
     evaluation = evaluate_response(sample_question, sample_response, chapter_text)
     print(evaluation)
@@ -1,7 +1,16 @@
-import fitz  # PyMuPDF
-import pandas as pd
+import hashlib
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from chunk_store import PAGE_STORE_PATH, make_chunk, write_chunks
+from rag_config import get_config
+
+OCR_CACHE_PATH = "data/ocr_cache"
 
 def extract_text_from_pdf(pdf_path):
+    import fitz  # PyMuPDF
     doc = fitz.open(pdf_path)
     text = []
     for page_num in range(len(doc)):
@@ -9,13 +18,152 @@ def extract_text_from_pdf(pdf_path):
         text.append(page.get_text())
     return text
 
+_open_docs = {}
+
+def page_count(pdf_path):
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        return len(doc)
+
+def _document(pdf_path):
+    # Cada processo do pool mantém seu próprio documento aberto
+    if pdf_path not in _open_docs:
+        import fitz
+        _open_docs[pdf_path] = fitz.open(pdf_path)
+    return _open_docs[pdf_path]
+
+def reading_order(blocks, width):
+    # Blocos que cruzam o meio da página (títulos, texto em coluna única)
+    # separam seções; em cada seção vem a coluna da esquerda, depois a da
+    # direita, cada uma de cima para baixo
+    middle = width / 2
+    sections, current = [], []
+    for block in sorted(blocks, key=lambda block: (block[1], block[0])):
+        if block[0] < middle < block[2]:
+            sections.extend([current, [block]])
+            current = []
+        else:
+            current.append(block)
+    sections.append(current)
+    return [block for section in sections
+            for block in sorted(section, key=lambda block: (block[0] >= middle, block[1], block[0]))]
+
+def layout_text(page, textpage=None):
+    # get_text("blocks"): (x0, y0, x1, y1, texto, número, tipo); tipo 1 é imagem
+    blocks = [block for block in page.get_text("blocks", textpage=textpage) if block[6] == 0]
+    return "".join(block[4].rstrip("\n") + "\n" for block in reading_order(blocks, page.rect.width))
+
+def extract_page(pdf_path, page_num, layout=False):
+    page = _document(pdf_path).load_page(page_num)
+    return page_num + 1, layout_text(page) if layout else page.get_text()
+
+def page_hash(page, dpi, language):
+    # O conteúdo da página só referencia as imagens: os bytes delas entram no hash
+    digest = hashlib.blake2b(("ocr:%d:%s:" % (dpi, language)).encode("utf-8"), digest_size=16)
+    digest.update(page.read_contents())
+    for image in page.get_images(full=True):
+        digest.update(page.parent.xref_stream_raw(image[0]) or b"")
+    return digest.hexdigest()
+
+def extract_page_layout(pdf_path, page_num, dpi=300, language="por"):
+    # Devolve também o hash da página quando ela só tem imagem e precisa de OCR
+    page = _document(pdf_path).load_page(page_num)
+    text = layout_text(page)
+    if text.strip() or not page.get_images():
+        return page_num + 1, text, None
+    return page_num + 1, text, page_hash(page, dpi, language)
+
+def ocr_page(pdf_path, page_num, dpi=300, language="por"):
+    # OCR local pelo Tesseract, via PyMuPDF (precisa do executável tesseract)
+    page = _document(pdf_path).load_page(page_num)
+    return layout_text(page, page.get_textpage_ocr(dpi=dpi, language=language, full=True))
+
+def _cache_file(cache_dir, digest):
+    return os.path.join(cache_dir, digest + ".txt")
+
+def _read_cache(cache_dir, digest):
+    try:
+        with open(_cache_file(cache_dir, digest), "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _write_cache(cache_dir, digest, text):
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = _cache_file(cache_dir, digest) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, _cache_file(cache_dir, digest))
+
+def _ocr_text(future, page, fallback, cache_dir, digest):
+    # Uma página que falha no OCR (sem o executável tesseract, por exemplo)
+    # fica com o texto da extração, vazio, em vez de derrubar as outras
+    try:
+        text = future.result()
+    except Exception as e:
+        print("aviso: OCR da página %d falhou, página mantida sem texto: %s" % (page, e),
+              file=sys.stderr)
+        return fallback
+    _write_cache(cache_dir, digest, text)
+    return text
+
+def iter_pages(pdf_path, workers=None, ocr_workers=None, ocr=True,
+               cache_dir=OCR_CACHE_PATH, dpi=300, language="por"):
+    # Extração por blocos em ordem de leitura; páginas só com imagem vão para
+    # um pool de OCR separado assim que são detectadas, então as páginas
+    # digitais continuam saindo enquanto as escaneadas esperam o OCR.
+    # Devolve (página, texto) na ordem das páginas
+    tunables = get_config().tunables
+    ready = {}
+    pending = {}
+    next_page = 1
+    ocr_pool = None
+
+    def finished():
+        nonlocal next_page
+        while next_page in ready or (next_page in pending and pending[next_page][0].done()):
+            if next_page in pending:
+                ready[next_page] = _ocr_text(*pending.pop(next_page))
+            yield next_page, ready.pop(next_page)
+            next_page += 1
+
+    try:
+        with ProcessPoolExecutor(workers or tunables.extract_workers) as pool:
+            extract = partial(extract_page_layout, pdf_path, dpi=dpi, language=language)
+            for page, text, digest in pool.map(extract, range(page_count(pdf_path)),
+                                               chunksize=8):
+                cached = None if digest is None or not ocr else _read_cache(cache_dir, digest)
+                if digest is None or not ocr or cached is not None:
+                    ready[page] = text if cached is None else cached
+                else:
+                    if ocr_pool is None:
+                        ocr_pool = ProcessPoolExecutor(ocr_workers or tunables.ocr_workers)
+                    future = ocr_pool.submit(ocr_page, pdf_path, page - 1, dpi, language)
+                    pending[page] = future, page, text, cache_dir, digest
+                yield from finished()
+        for page in sorted(pending):
+            ready[page] = _ocr_text(*pending.pop(page))
+        yield from finished()
+    finally:
+        if ocr_pool is not None:
+            ocr_pool.shutdown(cancel_futures=True)
+
+def extract_pages(pdf_path, workers=None, ocr_workers=None, ocr=True,
+                  cache_dir=OCR_CACHE_PATH, dpi=300, language="por"):
+    return [text for _, text in iter_pages(pdf_path, workers, ocr_workers, ocr, cache_dir,
+                                           dpi, language)]
+
 def save_text_to_csv(text, output_csv):
+    import pandas as pd
     df = pd.DataFrame(text, columns=["content"])
     df.to_csv(output_csv, index=False)
 
+def save_text_to_store(text, store_path=PAGE_STORE_PATH):
+    # Uma linha por página; o chunking lê este armazenamento diretamente
+    return write_chunks(store_path, (make_chunk(content, page + 1) for page, content in enumerate(text)))
+
 if __name__ == "__main__":
     pdf_path = "caminho/para/seu/cosmos.pdf"
-    output_csv = "data/extracted_text.csv"
     text = extract_text_from_pdf(pdf_path)
-    save_text_to_csv(text, output_csv)
-    print("Text extraction and preprocessing completed successfully.")
\ No newline at end of file
+    save_text_to_store(text, PAGE_STORE_PATH)
+    print("Text extraction and preprocessing completed successfully.")
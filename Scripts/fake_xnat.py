@@ -0,0 +1,474 @@
+'''
+Local stand-in for the XNAT REST API, for testing and benchmarking
+sessionmirror without two live XNAT instances.
+
+Implements the endpoints the mirror uses through pyxnat: the experiment
+search listing, project/subject/session/scan/resource listings and
+creation (with xpath attributes on the query string), session xml, file
+GET and PUT/POST (inbody, plain or chunked), and resource zip GET/PUT
+(extract=true). Data lives in memory. Every request waits `latency`
+seconds and bodies are sent and read at `bandwidth` bytes per second per
+connection, to mimic a remote server.
+
+    python fake_xnat.py --port 8080 --latency 0.02 --bandwidth_mb 20 \\
+        --seed_sessions 4
+'''
+
+import csv
+import hashlib
+import io
+import os
+import threading
+import time
+import zipfile
+from xml.etree import ElementTree as ET
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qsl, quote, unquote, urlsplit
+except ImportError:
+    raise SystemExit('fake_xnat requires Python 3.7+')
+
+XNAT_NS = 'http://nrg.wustl.edu/xnat'
+XSI_NS = 'http://www.w3.org/2001/XMLSchema-instance'
+ET.register_namespace('xnat', XNAT_NS)
+ET.register_namespace('xsi', XSI_NS)
+
+IO_CHUNK = 64 * 1024
+
+# Levels of the REST hierarchy and the datatype used when none is given
+LEVELS = {
+    'projects': 'xnat:projectData',
+    'subjects': 'xnat:subjectData',
+    'experiments': 'xnat:mrSessionData',
+    'scans': 'xnat:mrScanData',
+    'assessors': 'xnat:mrAssessorData',
+    'resources': 'xnat:resourceCatalog',
+}
+
+
+class NotFound(Exception):
+    pass
+
+
+class Store(object):
+    '''
+    In-memory XNAT data. Objects are keyed by their path below /data as a
+    tuple, e.g. ('projects', 'P', 'subjects', 'S'); IDs and labels are the
+    same. Resource files are kept as {name: bytes}.
+    '''
+    def __init__(self):
+        self.objects = {}
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def create(self, path, datatype=None, fields=None):
+        with self.lock:
+            if len(path) > 2 and path[:-2] not in self.objects:
+                raise NotFound('/'.join(path[:-2]))
+            obj = self.objects.setdefault(
+                path, {'xsiType': datatype or LEVELS[path[-2]],
+                       'fields': {}, 'xml': None})
+            if datatype:
+                obj['xsiType'] = datatype
+            obj['fields'].update(fields or {})
+            if path[-2] == 'resources':
+                self.files.setdefault(path, {})
+            return obj
+
+    def get(self, path):
+        with self.lock:
+            if path not in self.objects:
+                raise NotFound('/'.join(path))
+            return self.objects[path]
+
+    def children(self, path, level):
+        with self.lock:
+            return sorted(
+                (key, obj) for key, obj in self.objects.items()
+                if len(key) == len(path) + 2 and key[:len(path)] == path
+                and key[-2] == level)
+
+    def put_file(self, res_path, name, data):
+        with self.lock:
+            if res_path not in self.files:
+                raise NotFound('/'.join(res_path))
+            self.files[res_path][name] = data
+
+    def res_files(self, res_path):
+        with self.lock:
+            if res_path not in self.files:
+                raise NotFound('/'.join(res_path))
+            return dict(self.files[res_path])
+
+    def file_count(self):
+        with self.lock:
+            return sum(len(files) for files in self.files.values())
+
+    def checksums(self):
+        '''{(resource path without project, name): md5} for comparisons'''
+        with self.lock:
+            return dict(((res_path[2:], name), hashlib.md5(data).hexdigest())
+                        for res_path, files in self.files.items()
+                        for name, data in files.items())
+
+
+def _session_xml(path, sess, scans):
+    '''Minimal session document, as returned by ?format=xml'''
+    root = ET.Element('{%s}MRSession' % XNAT_NS, {
+        'ID': path[-1], 'label': path[-1], 'project': path[1],
+        '{%s}type' % XSI_NS: sess['xsiType']})
+    ET.SubElement(root, '{%s}sharing' % XNAT_NS)
+    for name in ('date', 'fieldStrength'):
+        if name in sess['fields']:
+            ET.SubElement(root, '{%s}%s' % (XNAT_NS, name)).text = \
+                sess['fields'][name]
+    ET.SubElement(root, '{%s}subject_ID' % XNAT_NS).text = path[3]
+    scans_elem = ET.SubElement(root, '{%s}scans' % XNAT_NS)
+    for scan_path, scan in scans:
+        scan_elem = ET.SubElement(scans_elem, '{%s}scan' % XNAT_NS, {
+            'ID': scan_path[-1], 'type': scan['fields'].get('type', ''),
+            '{%s}type' % XSI_NS: scan['xsiType']})
+        params = ET.SubElement(scan_elem, '{%s}parameters' % XNAT_NS)
+        for name in ('tr', 'te'):
+            if name in scan['fields']:
+                ET.SubElement(params, '{%s}%s' % (XNAT_NS, name)).text = \
+                    scan['fields'][name]
+    return ET.tostring(root)
+
+
+def seed(store, project='SRC', sessions=2, scans=4, files=8,
+         file_size=256 * 1024, subjects=None):
+    '''
+    Fill store with a source project: each session has `scans` MR scans
+    with a DICOM resource of `files` files and a one-file SNAPSHOTS
+    resource. Returns the number of files and bytes created.
+    '''
+    store.create(('projects', project))
+    subjects = subjects or sessions
+    nfiles = nbytes = 0
+    for i in range(sessions):
+        subj = ('projects', project, 'subjects', 'SUBJ%03d' % (i % subjects))
+        store.create(subj)
+        sess = subj + ('experiments', 'SESS%03d' % i)
+        store.create(sess, 'xnat:mrSessionData',
+                     {'date': '2020-01-%02d' % (i % 28 + 1),
+                      'fieldStrength': '3.0'})
+        for j in range(1, scans + 1):
+            scan = sess + ('scans', str(j))
+            store.create(scan, 'xnat:mrScanData',
+                         {'type': 'T1', 'tr': '2.3', 'te': '2.98'})
+            dicom = scan + ('resources', 'DICOM')
+            store.create(dicom)
+            for k in range(files):
+                store.put_file(dicom, '%d-%d-%d.dcm' % (i, j, k),
+                               os.urandom(file_size))
+            snaps = scan + ('resources', 'SNAPSHOTS')
+            store.create(snaps)
+            store.put_file(snaps, 'snap.gif', os.urandom(4096))
+            nfiles += files + 1
+            nbytes += files * file_size + 4096
+    return nfiles, nbytes
+
+
+def _extracted_names(names):
+    '''
+    File names for the members of an uploaded zip: the part after /files/
+    for XNAT's own layout, otherwise without a folder common to all of
+    them (pyxnat re-zips resources under /<label>/).
+    '''
+    names = [name.lstrip('/') for name in names]
+    if all('/files/' in name for name in names):
+        return [name.split('/files/', 1)[1] for name in names]
+    roots = set(name.split('/', 1)[0] for name in names)
+    if len(roots) == 1 and all('/' in name for name in names):
+        return [name.split('/', 1)[1] for name in names]
+    return names
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this every small
+    # response waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    # Set on the server: store, latency, bandwidth, stats
+    @property
+    def store(self):
+        return self.server.store
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    def _count(self, key, value=1):
+        with self.server.stats_lock:
+            self.server.stats[key] = self.server.stats.get(key, 0) + value
+
+    def _throttle(self, nbytes):
+        if self.server.bandwidth:
+            time.sleep(float(nbytes) / self.server.bandwidth)
+
+    def _read_body(self):
+        '''Request body, plain or chunked, read at the configured bandwidth'''
+        data = io.BytesIO()
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunk = self.rfile.read(size)
+                self.rfile.readline()
+                self._throttle(len(chunk))
+                data.write(chunk)
+        else:
+            remaining = int(self.headers.get('Content-Length') or 0)
+            while remaining:
+                chunk = self.rfile.read(min(IO_CHUNK, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                self._throttle(len(chunk))
+                data.write(chunk)
+        self._count('bytes_in', data.tell())
+        return data.getvalue()
+
+    def _send(self, body, status=200, content_type='text/plain'):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        for start in range(0, len(body), IO_CHUNK):
+            chunk = body[start:start + IO_CHUNK]
+            self._throttle(len(chunk))
+            self.wfile.write(chunk)
+        self._count('bytes_out', len(body))
+
+    def _send_table(self, rows, columns):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([row.get(column, '') for column in columns])
+        self._send(out.getvalue(), content_type='text/csv')
+
+    def _dispatch(self):
+        time.sleep(self.server.latency)
+        self._count('requests')
+        self._count(self.command)
+        url = urlsplit(self.path)
+        query = dict(parse_qsl(url.query, keep_blank_values=True))
+        parts = [unquote(p) for p in url.path.split('/') if p]
+        if parts[:1] != ['data']:
+            raise NotFound(url.path)
+        parts = parts[1:]
+        try:
+            return self._route(parts, query)
+        except NotFound as e:
+            self._send('Not found: %s' % e, 404)
+
+    do_GET = do_PUT = do_POST = do_HEAD = _dispatch
+
+    def _route(self, parts, query):
+        method = self.command
+        if parts == ['JSESSION']:
+            return self._send('FAKE%08X' % id(self.server))
+        if parts == ['experiments']:
+            return self._search_experiments(query)
+        if 'files' in parts:
+            i = parts.index('files')
+            res_path = tuple(parts[:i])
+            name = '/'.join(parts[i + 1:])
+            if not name:
+                if query.get('format') == 'zip':
+                    return self._get_zip(res_path)
+                return self._list_files(res_path)
+            if method in ('PUT', 'POST'):
+                return self._put_file(res_path, name, query)
+            return self._get_file(res_path, name)
+        if len(parts) % 2:
+            return self._list(tuple(parts[:-1]), parts[-1])
+        path = tuple(parts)
+        if method in ('PUT', 'POST'):
+            self._read_body()
+            fields = dict((k, v) for k, v in query.items()
+                          if k not in ('xsiType', 'allowDataDeletion'))
+            self.store.create(path, query.get('xsiType'), fields)
+            return self._send(path[-1])
+        if query.get('format') == 'xml':
+            sess = self.store.get(path)
+            return self._send(_session_xml(
+                path, sess, self.store.children(path, 'scans')),
+                content_type='text/xml')
+        self.store.get(path)
+        return self._send(path[-1])
+
+    def _uri(self, path):
+        return '/data/' + '/'.join(quote(p) for p in path)
+
+    def _search_experiments(self, query):
+        rows = []
+        for path, obj in self.store.children((), 'projects'):
+            for subj, _ in self.store.children(path, 'subjects'):
+                for sess, sess_obj in self.store.children(subj,
+                                                          'experiments'):
+                    rows.append({
+                        'ID': sess[-1], 'label': sess[-1],
+                        'project': sess[1], 'subject_ID': subj[-1],
+                        'subject_label': subj[-1],
+                        'xsiType': sess_obj['xsiType'],
+                        'URI': self._uri(sess)})
+        for key in ('project', 'ID', 'label'):
+            if key in query:
+                rows = [row for row in rows if row[key] == query[key]]
+        self._send_table(rows, ['ID', 'project', 'label', 'subject_ID',
+                                'subject_label', 'xsiType', 'URI'])
+
+    def _list(self, parent, level):
+        if parent:
+            self.store.get(parent)
+        rows = []
+        for path, obj in self.store.children(parent, level):
+            row = {'ID': path[-1], 'label': path[-1],
+                   'xsiType': obj['xsiType'], 'URI': self._uri(path)}
+            row.update(obj['fields'])
+            if level == 'resources':
+                files = self.store.res_files(path)
+                row.update({
+                    'xnat_abstractresource_id': path[-1],
+                    'file_count': len(files),
+                    'file_size': sum(len(d) for d in files.values())})
+            rows.append(row)
+        columns = ['ID', 'label', 'xsiType', 'URI']
+        if level == 'resources':
+            columns += ['xnat_abstractresource_id', 'file_count',
+                        'file_size']
+        if level == 'scans':
+            columns += ['type']
+        self._send_table(rows, columns)
+
+    def _list_files(self, res_path):
+        rows = [{'URI': self._uri(res_path + ('files', name)),
+                 'Name': name, 'Size': len(data),
+                 'digest': hashlib.md5(data).hexdigest(),
+                 'file_format': '', 'file_content': '', 'file_tags': ''}
+                for name, data in sorted(
+                    self.store.res_files(res_path).items())]
+        self._send_table(rows, ['URI', 'Name', 'Size', 'digest',
+                                'file_tags', 'file_format', 'file_content'])
+
+    def _get_file(self, res_path, name):
+        files = self.store.res_files(res_path)
+        if name not in files:
+            raise NotFound(name)
+        self._count('files_out')
+        self._send(files[name], content_type='application/octet-stream')
+
+    def _get_zip(self, res_path):
+        # XNAT nests entries as <session>/scans/<id>/resources/<label>/files
+        root = '/'.join(res_path[res_path.index('experiments') + 1:]
+                        if 'experiments' in res_path else res_path[-2:])
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as zf:
+            for name, data in sorted(self.store.res_files(res_path).items()):
+                zf.writestr('%s/files/%s' % (root, name), data)
+        self._send(buf.getvalue(), content_type='application/zip')
+
+    def _put_file(self, res_path, name, query):
+        data = self._read_body()
+        if query.get('extract') == 'true' and name.endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(data)) as zf:
+                members = [info for info in zf.infolist()
+                           if not info.is_dir()]
+                names = _extracted_names([m.filename for m in members])
+                for info, member_name in zip(members, names):
+                    self.store.put_file(res_path, member_name,
+                                        zf.read(info))
+                    self._count('files_in')
+        else:
+            self.store.put_file(res_path, name, data)
+            self._count('files_in')
+        self._send('')
+
+
+class FakeXnatServer(ThreadingHTTPServer):
+    '''
+    Threaded fake XNAT. Use as a context manager to serve in a background
+    thread: `with FakeXnatServer(latency=0.01) as server: server.url`.
+    '''
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, port=0, latency=0.0, bandwidth=None, store=None,
+                 verbose=False):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.store = store or Store()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.verbose = verbose
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def config(self, path):
+        '''Write a pyxnat config file pointing at this server'''
+        import json
+        with open(path, 'w') as f:
+            json.dump({'server': self.url, 'user': 'admin',
+                       'password': 'admin'}, f)
+        return path
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+def create_parser():
+    import argparse
+    arg_parser = argparse.ArgumentParser(
+        description='Serve a fake XNAT REST API from memory.')
+    arg_parser.add_argument('--port', type=int, default=8080)
+    arg_parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='Seconds added to every request (default: 0)')
+    arg_parser.add_argument(
+        '--bandwidth_mb', type=float, default=None,
+        help='MB/s per connection for request and response bodies '
+             '(default: unlimited)')
+    arg_parser.add_argument(
+        '--seed_sessions', type=int, default=0,
+        help='Create a SRC project with this many sessions')
+    arg_parser.add_argument(
+        '--project', action='append', default=[],
+        help='Create an empty project, e.g. a mirror destination')
+    arg_parser.add_argument('-v', '--verbose', action='store_true')
+    return arg_parser
+
+
+if __name__ == '__main__':
+    args = create_parser().parse_args()
+    bandwidth = args.bandwidth_mb * 1024 * 1024 if args.bandwidth_mb else None
+    server = FakeXnatServer(args.port, args.latency, bandwidth,
+                            verbose=args.verbose)
+    if args.seed_sessions:
+        print('seeded %d files, %d bytes'
+              % seed(server.store, sessions=args.seed_sessions))
+    for project in args.project:
+        server.store.create(('projects', project))
+    print('fake XNAT listening on %s' % server.url)
+    server.serve_forever()
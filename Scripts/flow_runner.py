@@ -0,0 +1,271 @@
+"""
+Script para executar o fluxo de `langflow/flow.json` offline.
+
+Cada nó do fluxo vira um `Stage` do projeto (ver `stages.py`), ligado ao
+próximo por uma fila limitada. Assim o embedding do lote N roda enquanto o
+lote N-1 é ingerido, e o tempo total se aproxima do estágio mais lento em vez
+da soma de todos. O parâmetro `workers` de um nó controla o paralelismo dele.
+"""
+import argparse
+import json
+import queue
+import re
+import sys
+import threading
+import time
+from functools import partial
+
+from json_stream import iter_records
+from rag_config import get_config
+from stages import QUEUE_SIZE, Stage, StageRunner, raise_first_error
+
+FLOW_PATH = 'langflow/flow.json'
+
+
+def load_flow(path=FLOW_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        flow = json.load(f)
+    nodes = {node['id']: node for node in flow['nodes']}
+    edges = [(node['id'], output['target'])
+             for node in flow['nodes'] for output in node.get('outputs', [])]
+    return nodes, edges
+
+
+def topological_order(nodes, edges):
+    indegree = {node_id: 0 for node_id in nodes}
+    for _, target in edges:
+        indegree[target] += 1
+    ready = [node_id for node_id, degree in indegree.items() if degree == 0]
+    order = []
+    while ready:
+        node_id = ready.pop(0)
+        order.append(node_id)
+        for source, target in edges:
+            if source == node_id:
+                indegree[target] -= 1
+                if indegree[target] == 0:
+                    ready.append(target)
+    if len(order) != len(nodes):
+        raise ValueError('o fluxo contém um ciclo')
+    return order
+
+
+def _api_key(params):
+    key = params.get('api_key', '')
+    if not key or key.startswith('your-'):
+        key = get_config().require_openai_key()
+    return key
+
+
+# Estágios: cada fábrica recebe os parâmetros do nó e o contexto da execução
+# e devolve um `Stage`.
+
+def _record_page(records):
+    for record in records:
+        yield record['metadata']['page'], record['text']
+
+
+def file_stage(params, context):
+    path = params['path']
+    if path.endswith('.pdf'):
+        workers = params.get('workers', get_config().tunables.extract_workers)
+        if params.get('layout'):
+            # Ordem de leitura e OCR das páginas só com imagem: `iter_pages`
+            # tem os próprios pools de extração e de OCR
+            from extract_text import iter_pages
+            return Stage(lambda _: iter_pages(path, workers, params.get('ocr_workers'),
+                                              ocr=params.get('ocr', True)),
+                         source=(), name='iter_pages')
+        # Parsing de PDF é CPU: páginas distribuídas num pool de processos
+        from extract_text import extract_page, page_count
+        return Stage(partial(extract_page, path), workers=workers, kind='process',
+                     source=range(page_count(path)))
+    return Stage(_record_page, source=iter_records(path))
+
+
+def normalize_stage(params, context):
+    from normalize_text import normalize_pages
+
+    def run(pages):
+        # Cabeçalhos são detectados entre páginas: o estágio espera todas
+        yield from normalize_pages(pages, params.get('edge_lines', 2),
+                                   params.get('min_pages', 3))
+    return Stage(run)
+
+
+def split_text_stage(params, context):
+    from preprocess_data import chunk_pages
+
+    def run(pages):
+        return chunk_pages(pages, params.get('chunk_size'), params.get('chunk_overlap', 0))
+    return Stage(run)
+
+
+def dedup_stage(params, context):
+    from dedup import PROVENANCE_PATH, dedup_items
+    from json_stream import JsonWriter
+
+    def run(chunks):
+        with JsonWriter(params.get('provenance', PROVENANCE_PATH), lines=True) as provenance:
+            yield from dedup_items(chunks, provenance, params.get('threshold'),
+                                   params.get('num_perm'))
+    return Stage(run)
+
+
+def embeddings_stage(params, context):
+    from generate_embeddings import embed_batch
+    # Chamadas de API são I/O: vários lotes em voo num pool de threads
+    return Stage(partial(embed_batch, api_key=_api_key(params)),
+                 workers=params.get('workers', get_config().tunables.embed_workers),
+                 kind='thread',
+                 batch_size=context['batch_size'])
+
+
+def _weaviate_class(params):
+    # `index_name` do Langflow vira um nome de classe válido no Weaviate
+    # (`langflow-cosmos` -> `Langflow_cosmos`); sem ele, vale a configuração
+    name = re.sub(r'[^0-9A-Za-z_]', '_', params.get('index_name') or '')
+    if not name:
+        return get_config().weaviate.class_name
+    return name[0].upper() + name[1:]
+
+
+def weaviate_stage(params, context):
+    from chapter_index import load_chapter_index
+    from ingest_data import chunk_properties, class_obj
+    from query_weaviate import query_weaviate, weaviate_client
+    schema = dict(class_obj(), **{'class': _weaviate_class(params)})
+    # Sem chave (ou com o marcador do exemplo), vale a da configuração
+    api_key = params.get('api_key') or None
+    if api_key and api_key.startswith('your-'):
+        api_key = None
+
+    def run(chunks):
+        # O mesmo cliente, com a mesma chave e timeout, grava e consulta
+        client = weaviate_client(params.get('url'), api_key)
+        if not client.schema.exists(schema['class']):
+            client.schema.create_class(schema)
+        client.batch.configure(batch_size=context['batch_size'])
+        chapter_index = load_chapter_index()
+        with client.batch as batch:
+            for chunk in chunks:
+                properties = chunk_properties(chunk['text'], chunk['page_start'],
+                                              chunk['chunk_index'], chapter_index)
+                batch.add_data_object(properties, schema['class'],
+                                      vector=chunk.get('embedding'))
+
+        if context['query']:
+            response = query_weaviate(context['query'], client=client,
+                                      class_name=schema['class'])
+            yield response['data']['Get'][schema['class']]
+    return Stage(run)
+
+
+def model_stage(params, context):
+    from generate_response import build_prompt, generate_response
+    api_key = _api_key(params)
+
+    def run(results):
+        for result in results:
+            prompt = build_prompt(context['query'], [item['content'] for item in result])
+            yield generate_response(prompt, api_key)
+    return Stage(run)
+
+
+def output_stage(params, context):
+    def run(items):
+        for item in items:
+            print(item)
+            yield item
+    return Stage(run)
+
+
+NODE_STAGES = {
+    'File': file_stage,
+    'Normalize': normalize_stage,
+    'SplitText': split_text_stage,
+    'Dedup': dedup_stage,
+    'OpenAIEmbeddings': embeddings_stage,
+    'Weaviate': weaviate_stage,
+    'OpenAIModel': model_stage,
+    'Output': output_stage,
+}
+
+
+def _parse_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def run_flow(path=FLOW_PATH, overrides=None, query=None, batch_size=100,
+             queue_size=QUEUE_SIZE):
+    nodes, edges = load_flow(path)
+    for key, value in (overrides or {}).items():
+        node_id, param = key.split('.', 1)
+        nodes[node_id]['params'][param] = value
+
+    context = {'query': query, 'batch_size': batch_size}
+    order = topological_order(nodes, edges)
+    inboxes = {node_id: queue.Queue(maxsize=queue_size) for node_id in order
+               if any(target == node_id for _, target in edges)}
+    cancel = threading.Event()
+
+    runners = []
+    for node_id in order:
+        node = nodes[node_id]
+        if node['type'] not in NODE_STAGES:
+            raise ValueError('tipo de nó não suportado: %s' % node['type'])
+        stage = NODE_STAGES[node['type']](node.get('params', {}), context)
+        outboxes = [inboxes[target] for source, target in edges if source == node_id]
+        runners.append(StageRunner(stage, inboxes.get(node_id), outboxes, cancel,
+                                   name=node_id))
+
+    start = time.perf_counter()
+    for runner in runners:
+        runner.start()
+    for runner in runners:
+        runner.join()
+    elapsed = time.perf_counter() - start
+    raise_first_error(runners)
+
+    return {
+        'seconds': elapsed,
+        'nodes': {runner.name: runner.stats() for runner in runners},
+    }
+
+
+def print_report(report, out=sys.stdout):
+    out.write('%-18s %8s %8s %9s %10s\n' % ('node', 'in', 'out', 'seconds', 'items/s'))
+    for node_id, stats in report['nodes'].items():
+        out.write('%-18s %8d %8d %9.2f %10.1f\n' % (
+            node_id, stats['items_in'], stats['items_out'], stats['seconds'],
+            stats['items_per_second']))
+    out.write('total: %.2f s\n' % report['seconds'])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run langflow/flow.json offline.')
+    parser.add_argument('--flow', default=FLOW_PATH)
+    parser.add_argument('--set', dest='overrides', action='append', default=[],
+                        metavar='NODE.PARAM=VALUE',
+                        help='Override a node parameter, e.g. '
+                             'FileInput.path=data/cosmos_data_for_weaviate.json')
+    parser.add_argument('--query', help='Question to answer after ingestion')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='Default: COSMOS_RAG_EMBED_BATCH_SIZE (100)')
+    parser.add_argument('--queue-size', type=int, default=None,
+                        help='Default: COSMOS_RAG_QUEUE_SIZE (%d)' % QUEUE_SIZE)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    overrides = {key: _parse_value(value)
+                 for key, value in (item.split('=', 1) for item in args.overrides)}
+    tunables = get_config().tunables
+    report = run_flow(args.flow, overrides, args.query,
+                      args.batch_size or tunables.embed_batch_size,
+                      args.queue_size or tunables.queue_size)
+    print_report(report)
@@ -1,21 +1,52 @@
 """
 Script para gerar embeddings usando a API OpenAI.
 """
-import json
-import openai
+from chat_client import client
+from chunk_store import CHUNK_STORE_PATH, read_chunks, write_embeddings
+from json_stream import JsonWriter, batched, iter_records
+from rag_config import get_config
+from token_usage import get_ledger
 
 def generate_embeddings(text, api_key):
-    openai.api_key = api_key
-    response = openai.embeddings.create(
-        model="text-embedding-ada-002",
+    response = get_ledger().call(
+        "generate_embeddings", get_config().openai.embedding_model, client(api_key).embeddings.create,
+        timeout=get_config().openai.timeout,
         input=[text]  # Lista com o texto
     )
-    return response['data'][0]['embedding']
+    return response.data[0].embedding
+
+def embed_chunk_store(api_key, store_path=CHUNK_STORE_PATH, batch_size=None):
+    batch_size = batch_size or get_config().tunables.embed_batch_size
+    texts = read_chunks(store_path, columns=["text"]).column("text").to_pylist()
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        response = get_ledger().call(
+            "generate_embeddings", get_config().openai.embedding_model, client(api_key).embeddings.create,
+            timeout=get_config().openai.timeout,
+            input=texts[start:start + batch_size]
+        )
+        embeddings.extend(item.embedding for item in response.data)
+    return write_embeddings(store_path, embeddings)
+
+def embed_batch(records, api_key):
+    response = get_ledger().call(
+        "generate_embeddings", get_config().openai.embedding_model, client(api_key).embeddings.create,
+        timeout=get_config().openai.timeout,
+        input=[record["text"] for record in records]
+    )
+    return [dict(record, embedding=item.embedding) for record, item in zip(records, response.data)]
+
+def embed_records(records, api_key, batch_size=None):
+    # Consome e devolve registros em lotes, sem materializar o corpus
+    batch_size = batch_size or get_config().tunables.embed_batch_size
+    for batch in batched(records, batch_size):
+        yield from embed_batch(batch, api_key)
+
+def embed_json_file(input_path, output_path, api_key, batch_size=None):
+    with JsonWriter(output_path, lines=True) as writer:
+        return writer.write_all(embed_records(iter_records(input_path), api_key, batch_size))
 
 if __name__ == "__main__":
-    with open('config/openai_config.json', 'r', encoding='utf-8') as f:
-        config = json.load(f)
-    
     text = "Carl Sagan discute a possibilidade de vida baseada em elementos diferentes do carbono e da água."
-    embeddings = generate_embeddings(text, config['api_key'])
+    embeddings = generate_embeddings(text, get_config().require_openai_key())
     print(embeddings)
@@ -1,18 +1,13 @@
-import openai
-import json
+from chat_client import chat
+from rag_config import get_config
+
+def build_prompt(query, passages):
+    return 'Contexto:\n%s\n\nPergunta: %s' % ('\n\n'.join(passages), query)
 
 def generate_response(prompt, api_key):
-    openai.api_key = api_key
-    response = openai.Completion.create(
-        engine="text-davinci-003",
-        prompt=prompt,
-        max_tokens=150
-    )
-    return response.choices[0].text.strip()
+    return chat(prompt, api_key, stage="generate_response", max_tokens=150)
 
 if __name__ == "__main__":
-    with open('config/openai_config.json') as f:
-        config = json.load(f)
     prompt = "Explain the possibility of life forms based on elements other than carbon and water."
-    response = generate_response(prompt, config['api_key'])
+    response = generate_response(prompt, get_config().require_openai_key())
     print(response)
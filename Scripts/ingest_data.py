@@ -1,33 +1,96 @@
 import weaviate
 import json
-import pandas as pd
+
+from chapter_index import chapter_for_page, load_chapter_index
+from chunk_store import CHUNK_STORE_PATH, embedding_matrix, read_chunks, store_schema
+from json_stream import iter_records
+from rag_config import get_config
+
+CLASS_OBJ = {
+    "class": "CosmosChapter",
+    "description": "Chapters from the book Cosmos",
+    "properties": [
+        {"name": "title", "dataType": ["string"]},
+        {"name": "content", "dataType": ["text"]},
+        {"name": "metadata", "dataType": ["string"]},
+        {"name": "chapter", "dataType": ["int"]}
+    ]
+}
+
+def class_obj():
+    # O nome da classe vem da configuração; o schema é o mesmo
+    return dict(CLASS_OBJ, **{"class": get_config().weaviate.class_name})
+
+def chunk_properties(text, page, chunk_index, chapter_index):
+    chapter = chapter_for_page(page, chapter_index)
+    return {
+        "title": f"Chapter {chapter}",
+        "content": text,
+        "metadata": json.dumps({"page": page, "chunk_index": chunk_index, "chapter": chapter}),
+        "chapter": chapter if chapter is not None else 0
+    }
 
 def ingest_data_to_weaviate(data_path, api_key, weaviate_url):
     client = weaviate.Client(weaviate_url, api_key=api_key)
     
     # Cria um schema no Weaviate se não existir
-    class_obj = {
-        "class": "CosmosChapter",
-        "description": "Chapters from the book Cosmos",
-        "properties": [
-            {"name": "title", "dataType": ["string"]},
-            {"name": "content", "dataType": ["text"]},
-            {"name": "metadata", "dataType": ["string"]}
-        ]
-    }
-    client.schema.create_class(class_obj)
+    client.schema.create_class(class_obj())
     
+    class_name = get_config().weaviate.class_name
+
     # Carrega os dados extraídos
+    import pandas as pd
     df = pd.read_csv(data_path)
+    chapter_index = load_chapter_index()
     for index, row in df.iterrows():
+        page = index + 1
+        chapter = chapter_for_page(page, chapter_index)
         properties = {
             "title": f"Chapter {index + 1}",
             "content": row["content"],
-            "metadata": json.dumps({"chapter": index + 1})
+            "metadata": json.dumps({"page": page, "chapter": chapter}),
+            "chapter": chapter if chapter is not None else 0
         }
-        client.data_object.create(properties, "CosmosChapter")
+        client.data_object.create(properties, class_name)
+
+def ingest_store_to_weaviate(api_key, weaviate_url, store_path=CHUNK_STORE_PATH):
+    client = weaviate.Client(weaviate_url, api_key=api_key)
+    class_name = get_config().weaviate.class_name
+    client.schema.create_class(class_obj())
+
+    # Lê só as colunas necessárias, direto do memory map
+    columns = ["page_start", "chunk_index", "text"]
+    if "embedding" in store_schema(store_path).names:
+        columns.append("embedding")
+    table = read_chunks(store_path, columns=columns)
+    vectors = embedding_matrix(table) if "embedding" in table.column_names else None
+    chapter_index = load_chapter_index()
+    pages = table.column("page_start").to_pylist()
+    chunk_indexes = table.column("chunk_index").to_pylist()
+    for i, content in enumerate(table.column("text").to_pylist()):
+        properties = chunk_properties(content, pages[i], chunk_indexes[i], chapter_index)
+        vector = vectors[i] if vectors is not None else None
+        client.data_object.create(properties, class_name, vector=vector)
+
+def ingest_json_to_weaviate(json_path, api_key, weaviate_url, batch_size=None):
+    config = get_config()
+    class_name = config.weaviate.class_name
+    client = weaviate.Client(weaviate_url, api_key=api_key)
+    client.schema.create_class(class_obj())
+    client.batch.configure(batch_size=batch_size or config.tunables.ingest_batch_size)
+
+    # Registros fluem do disco para os lotes do Weaviate um a um
+    chapter_index = load_chapter_index()
+    count = 0
+    with client.batch as batch:
+        for record in iter_records(json_path):
+            metadata = record["metadata"]
+            properties = chunk_properties(record["text"], metadata["page"],
+                                          metadata.get("chunk_index", 0), chapter_index)
+            batch.add_data_object(properties, class_name, vector=record.get("embedding"))
+            count += 1
+    return count
 
 if __name__ == "__main__":
-    with open('config/openai_config.json') as f:
-        config = json.load(f)
-    ingest_data_to_weaviate('data/extracted_text.csv', config['api_key'], 'http://localhost:8080')
+    config = get_config()
+    ingest_store_to_weaviate(config.require_openai_key(), config.weaviate.host)
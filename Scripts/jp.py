@@ -1,14 +1,91 @@
 #!C:\MeusProjetos\Competicao_Langflow\Scripts\python.exe
 
+import io
 import sys
 import json
 import argparse
+from functools import lru_cache, partial
 from pprint import pformat
 
 import jmespath
 from jmespath import exceptions
 
 
+@lru_cache(maxsize=32)
+def compiled(expression):
+    """Parse an expression once per process."""
+    return jmespath.compile(expression)
+
+
+def search_batch(expression, skip_null, decoded, records):
+    """Apply the expression to a batch of records (raw JSON Lines unless
+    decoded) and return the results as JSON Lines text."""
+    parsed = compiled(expression)
+    out = []
+    for record in records:
+        if not decoded:
+            record = json.loads(record)
+        result = parsed.search(record)
+        if result is None and skip_null:
+            continue
+        out.append(json.dumps(result, ensure_ascii=False))
+        out.append('\n')
+    return ''.join(out)
+
+
+def _is_array(raw):
+    """Whether a buffered binary stream holds one top-level JSON array."""
+    return raw.peek(1 << 16).lstrip()[:1] == b'['
+
+
+def _line_batches(f, size):
+    batch = []
+    for line in f:
+        if line.strip():
+            batch.append(line)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def search_lines(expression, raw, out, jobs=1, batch_size=1000,
+                 skip_null=False):
+    """
+    Stream records from a binary input (JSON Lines, or a top-level array
+    read record by record) and write one result per line to out. The
+    expression is compiled once per process; with jobs > 1, batches are
+    searched on a process pool, in order, with a bounded number in flight.
+    """
+    from json_stream import batched, iter_file_records
+
+    decoded = _is_array(raw)
+    text = io.TextIOWrapper(raw, encoding='utf-8')
+    if decoded:
+        batches = batched(iter_file_records(text), batch_size)
+    else:
+        batches = _line_batches(text, batch_size)
+    search = partial(search_batch, expression, skip_null, decoded)
+
+    compiled(expression)  # Report syntax errors before reading any input
+    if jobs > 1:
+        from stages import Pipeline, Stage
+        results = Pipeline([Stage(search, workers=jobs, kind='process',
+                                  source=batches)])
+    else:
+        results = map(search, batches)
+    try:
+        for chunk in results:
+            out.write(chunk)
+            out.flush()
+    except RuntimeError as e:
+        # A failed pipeline stage wraps the worker's error
+        if e.__cause__ is not None:
+            raise e.__cause__
+        raise
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('expression')
@@ -18,6 +95,17 @@ def main():
                               'read from stdin.'))
     parser.add_argument('--ast', action='store_true',
                         help=('Pretty print the AST, do not search the data.'))
+    parser.add_argument('--lines', action='store_true',
+                        help=('Apply the expression to each JSON Lines '
+                              'record (or each element of a top-level '
+                              'array) as a stream, one result per line.'))
+    parser.add_argument('--skip-null', action='store_true',
+                        help=('With --lines, do not print null results.'))
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help=('With --lines, processes searching batches '
+                              'of records in parallel.'))
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help=('With --lines, records per batch.'))
     args = parser.parse_args()
     expression = args.expression
     if args.ast:
@@ -26,13 +114,22 @@ def main():
         sys.stdout.write(pformat(expression.parsed))
         sys.stdout.write('\n')
         return 0
-    if args.filename:
-        with open(args.filename, 'r') as f:
-            data = json.load(f)
-    else:
-        data = sys.stdin.read()
-        data = json.loads(data)
     try:
+        if args.lines:
+            if args.filename:
+                with open(args.filename, 'rb') as raw:
+                    search_lines(expression, raw, sys.stdout, args.jobs,
+                                 args.batch_size, args.skip_null)
+            else:
+                search_lines(expression, sys.stdin.buffer, sys.stdout,
+                             args.jobs, args.batch_size, args.skip_null)
+            return 0
+        if args.filename:
+            with open(args.filename, 'r') as f:
+                data = json.load(f)
+        else:
+            data = sys.stdin.read()
+            data = json.loads(data)
         sys.stdout.write(json.dumps(
             jmespath.search(expression, data), indent=4, ensure_ascii=False))
         sys.stdout.write('\n')
@@ -45,9 +142,12 @@ def main():
     except exceptions.UnknownFunctionError as e:
         sys.stderr.write("unknown-function: %s\n" % e)
         return 1
-    except exceptions.ParseError as e:
+    except (exceptions.ParseError, exceptions.EmptyExpressionError) as e:
         sys.stderr.write("syntax-error: %s\n" % e)
         return 1
+    except json.JSONDecodeError as e:
+        sys.stderr.write("invalid-json: %s\n" % e)
+        return 1
 
 
 if __name__ == '__main__':
@@ -0,0 +1,153 @@
+"""
+Script para ler e escrever corpora JSON em streaming.
+
+Lê registros de um array JSON de nível superior (como
+`cosmos_data_for_weaviate.json`) ou de JSON Lines sem carregar o arquivo
+inteiro, e escreve no mesmo formato registro a registro.
+"""
+import json
+from itertools import islice
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = ' \t\r\n'
+_NUMBER_CHARS = '0123456789+-.eE'
+# Um erro a até tantos caracteres do fim do buffer pode ser só um valor
+# cortado no meio (`tru`, `\\u00`, `-1.5e`)
+_TRUNCATED_TAIL = 16
+
+
+def _truncated(error, data):
+    """Se o erro pode vir de um registro cortado pelo fim do buffer.
+
+    Um registro malformado no meio do buffer não é corrigido lendo mais, e
+    ler mais traria o resto do arquivo para a memória.
+    """
+    return (error.pos >= len(data) - _TRUNCATED_TAIL
+            or error.msg.startswith('Unterminated string'))
+
+
+class _Buffer:
+    def __init__(self, f, read_size):
+        self.f = f
+        self.read_size = read_size
+        self.data = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        chunk = self.f.read(self.read_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Descarta o que já foi consumido para manter a memória limitada
+        self.data = self.data[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def skip(self, chars=_WHITESPACE):
+        while True:
+            while self.pos < len(self.data) and self.data[self.pos] in chars:
+                self.pos += 1
+            if self.pos < len(self.data) or not self.fill():
+                return self.data[self.pos] if self.pos < len(self.data) else ''
+
+    def decode(self):
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.data, self.pos)
+            except json.JSONDecodeError as e:
+                if not _truncated(e, self.data) or not self.fill():
+                    raise
+                continue
+            # Um número no fim do buffer pode estar truncado
+            if (isinstance(value, (int, float)) and not self.eof
+                    and not self.data[end:].strip(_NUMBER_CHARS) and self.fill()):
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_array(buf):
+    buf.pos += 1
+    if buf.skip() == ']':
+        return
+    while True:
+        buf.skip()
+        yield buf.decode()
+        sep = buf.skip()
+        if sep not in (',', ']'):
+            raise json.JSONDecodeError('esperado "," ou "]" no array JSON, encontrado %r' % sep,
+                                       buf.data, buf.pos)
+        buf.pos += 1
+        if sep == ']':
+            return
+
+
+def _iter_lines(buf):
+    while buf.skip():
+        yield buf.decode()
+
+
+def iter_file_records(f, read_size=1 << 16):
+    """Itera os registros de um arquivo já aberto (por exemplo stdin)."""
+    buf = _Buffer(f, read_size)
+    if buf.skip() == '[':
+        yield from _iter_array(buf)
+    else:
+        yield from _iter_lines(buf)
+
+
+def iter_records(path, read_size=1 << 16):
+    """Itera os registros de um array JSON ou de um arquivo JSON Lines."""
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from iter_file_records(f, read_size)
+
+
+def batched(records, size):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+class JsonWriter:
+    """Escreve registros um a um, como array JSON ou JSON Lines."""
+
+    def __init__(self, path, lines=False):
+        self.path = path
+        self.lines = lines
+        self.count = 0
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.path, 'w', encoding='utf-8')
+        if not self.lines:
+            self.f.write('[')
+        return self
+
+    def write(self, record):
+        if self.lines:
+            self.f.write(json.dumps(record))
+            self.f.write('\n')
+        else:
+            if self.count:
+                self.f.write(', ')
+            self.f.write(json.dumps(record))
+        self.count += 1
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+        return self.count
+
+    def __exit__(self, *exc):
+        if not self.lines:
+            self.f.write(']')
+        self.f.close()
+
+
+def write_records(path, records, lines=False):
+    with JsonWriter(path, lines=lines) as writer:
+        return writer.write_all(records)
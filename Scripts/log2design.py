@@ -4,46 +4,100 @@
 # Python 2/3 compatibile, depends on Pandas and Numpy/Scipy
 
 from __future__ import print_function
-from pandas import concat, read_csv
-from argparse import ArgumentParser, FileType
-from numpy import empty
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import cpu_count
+from pandas import Categorical, Index, concat, factorize, read_csv
+from argparse import ArgumentParser
+from numpy import arange, asarray, empty, isnan, repeat
+from scipy.io import savemat
 
 
 def main(args):
-    runs_df = load_onsets(args.onsets_files, args)
+    runs_df = load_onsets(args.onsets_files, args, jobs=args.jobs)
+    if args.spm:
+        paths = write_spm(runs_df, args.out, args.pmod_name, args.conditions,
+                          jobs=args.jobs)
+        print("Saved SPM onsets for %d runs to %s*.mat" % (len(paths),
+                                                          args.out))
+        return
     print("Saving designfile (%d rows) to %s" % (runs_df.shape[0], args.out))
-    runs_df.to_csv(args.out, index=False)
-
-
-def load_onsets(onsets_files, args):
-    """Read onsets file and add metadata from their filenames.
-    Return one concatenated pandas dataframe with all trials as rows."""
-    runs = []
-    for i, fid in enumerate(onsets_files):
-        run = read_csv(fid)
-
-        # If any column arguments were given, convert to a lyman-like design
-        # with explicitly named columns. Else, just concatenate and add 'run'.
-        if (args.onset_col or args.duration_col or args.condition_col or
-                args.pmods_col):
-            run = rename_columns(args, run)
-            condition_col = 'condition'
-            # Remove blanks
-            run = run[run[condition_col].notnull()]
+    write_design(runs_df, args.out, args.format)
+
+
+def _renames_columns(args):
+    return bool(args.onset_col or args.duration_col or args.condition_col or
+                args.pmods_col)
+
+
+def read_run(args, fid):
+    """Read one onsets file, keeping only the columns the design uses."""
+    usecols = None
+    if _renames_columns(args):
+        wanted = set([args.onset_col, args.condition_col, args.run_col,
+                      args.duration_col] + list(args.pmods_col))
+        if not args.drop_cols:
+            wanted.update(['run', 'onset', 'duration', 'condition'])
+        usecols = wanted.__contains__
+    return read_csv(fid, usecols=usecols)
+
+
+def load_onsets(onsets_files, args, jobs=1):
+    """Read onsets files (on a process pool with jobs > 1) and add metadata
+    from their filenames. Return one concatenated pandas dataframe with all
+    trials as rows. Columns are renamed and filtered once, on the whole
+    design, rather than per file."""
+    read = partial(read_run, args)
+    if jobs > 1 and len(onsets_files) > 1:
+        chunksize = max(1, len(onsets_files) // (4 * jobs))
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            runs = list(pool.map(read, onsets_files, chunksize=chunksize))
+    else:
+        runs = [read(fid) for fid in onsets_files]
+
+    lengths = [len(run) for run in runs]
+    run_index = repeat(arange(len(runs)), lengths)
+    has_run = repeat([(args.run_col or 'run') in run.columns
+                      for run in runs], lengths)
+    runs_df = concat(runs, ignore_index=True)
+
+    # If any column arguments were given, convert to a lyman-like design
+    # with explicitly named columns. Else, just concatenate and add 'run'.
+    if _renames_columns(args):
+        runs_df = rename_columns(args, runs_df)
+        # Remove blanks
+        keep = runs_df['condition'].notnull().to_numpy()
+        runs_df = runs_df[keep].reset_index(drop=True)
+        run_index, has_run = run_index[keep], has_run[keep]
+
+    # Add fn and run to designfile
+    codes, names = factorize(Index([getattr(fid, 'name', fid)
+                                    for fid in onsets_files]))
+    runs_df['filename'] = Categorical.from_codes(codes[run_index], names)
+    if 'run' in runs_df.columns:
+        # Files without the column leave NaNs (and a float dtype) behind
+        runs_df['run'] = runs_df['run'].mask(~has_run, run_index + 1)
+        if not has_run.all():
+            runs_df['run'] = runs_df['run'].convert_dtypes()
+    else:
+        runs_df['run'] = run_index + 1
 
-        # Add fn and run to designfile
-        run['filename'] = fid.name
-        if 'run' not in run.columns:
-            run['run'] = i + 1
+    # Drop any columns that are entirely empty (for vanity)
+    runs_df = runs_df.dropna(axis=1, how='all')
 
-        # Drop any columns thar are entirely empty (for vanity)
-        for col_name, col in run.iteritems():
-            if col.isnull().all():
-                del(run[col_name])
+    if 'condition' in runs_df.columns:
+        runs_df['condition'] = runs_df['condition'].astype('category')
+    return runs_df
 
-        runs.append(run)
 
-    return concat(runs, ignore_index=True)
+def write_design(runs_df, out, fmt=None, chunksize=100000):
+    """Write the design file as CSV or Parquet (by fmt or out's extension),
+    in chunks so large studies are not formatted in one piece."""
+    fmt = fmt or ('parquet' if str(out).endswith('.parquet') else 'csv')
+    if fmt == 'parquet':
+        runs_df.to_parquet(out, index=False)
+    else:
+        runs_df.to_csv(out, index=False, chunksize=chunksize)
 
 
 def rename_columns(args, run):
@@ -51,9 +105,7 @@ def rename_columns(args, run):
 
     # Cleanup any columns that might exist if we don't want them
     if args.drop_cols:
-        for col in cols:
-            if col in run.columns:
-                run.drop(col, axis=1, inplace=True)
+        run = run.drop(columns=[col for col in cols if col in run.columns])
 
     columns = {}
 
@@ -66,23 +118,25 @@ def rename_columns(args, run):
     if args.duration_col:
         columns[args.duration_col] = 'duration'
     else:
-        run['duration'] = 0
+        run = run.assign(duration=0)
 
     if len(args.pmods_col):
         for pmod in args.pmods_col:
             columns[pmod] = 'pmod-' + pmod
             cols.append('pmod-' + pmod)
 
-    run.rename(columns=columns, inplace=True)
+    run = run.rename(columns=columns)
 
-    return run[cols]
+    # Without --run-col, 'run' is added from the file order afterwards
+    return run[[col for col in cols if col in run.columns]]
 
 
-def onsets_for(cond, run_df):
+def onsets_for(cond, run_df, pmod_name='pmod'):
     """
     Inputs:
       * Condition Label to grab onsets, durations & amplitudes for.
       * Pandas Dataframe for current run containing onsets values as columns.
+      * Name to give the amplitude parametric modulator.
 
     Outputs:
       * Returns a dictionary of extracted values for onsets, durations, etc.
@@ -106,7 +160,7 @@ def onsets_for(cond, run_df):
         if ('amplitude' in cond_df.columns and
                 cond_df['amplitude'].notnull().any()):
             pmods = [dict(
-                name=args.pmod_name,
+                name=pmod_name,
                 poly=1,
                 param=cond_df['amplitude'].tolist(),
             )]
@@ -181,14 +235,109 @@ def _lists_to_scipy(onsets_list):
     return scipy_onsets
 
 
+def spm_onsets(runs_df, pmod_name='pmod', conditions=None):
+    """
+    Build the SPM multiple-conditions structure of every run in one pass:
+    the design is grouped by (run, condition) once and each condition's
+    onsets, durations and parametric modulators are sliced from whole-column
+    arrays. 'amplitude' becomes a pmod named pmod_name and every 'pmod-X'
+    column a pmod named X. Conditions with no onsets are left out, as in
+    onsets_for.
+
+    Outputs:
+      * Dict of {run: dict of scipy arrays} for scipy.io.savemat
+    """
+    columns = runs_df.columns
+    onsets = runs_df['onset'].to_numpy(dtype=float)
+    durations = runs_df['duration'].to_numpy(dtype=float) \
+        if 'duration' in columns else None
+    pmod_cols = [(pmod_name, 'amplitude')] + [
+        (col[len('pmod-'):], col) for col in columns
+        if col.startswith('pmod-')]
+    params = [(name, runs_df[col].to_numpy(dtype=float))
+              for name, col in pmod_cols if col in columns]
+
+    groups = runs_df.groupby(['run', 'condition'], observed=True).indices
+    by_run = {}
+    for (run, cond), rows in sorted(groups.items()):
+        by_run.setdefault(run, {})[cond] = rows
+
+    pmoddt = [('name', 'O'), ('poly', 'O'), ('param', 'O')]
+    structs = {}
+    for run, conds in by_run.items():
+        order = [cond for cond in (conditions or conds)
+                 if cond in conds and not isnan(onsets[conds[cond]]).all()]
+        conditions_n = len(order)
+        names = empty((conditions_n,), dtype='object')
+        run_durations = empty((conditions_n,), dtype='object')
+        run_onsets = empty((conditions_n,), dtype='object')
+        pmods = empty((conditions_n,), dtype=pmoddt)
+        has_pmods = False
+
+        for i, cond in enumerate(order):
+            rows = conds[cond]
+            names[i] = cond
+            run_onsets[i] = onsets[rows]
+            if durations is not None and not isnan(durations[rows]).all():
+                run_durations[i] = durations[rows]
+            else:
+                run_durations[i] = asarray([0.0])
+
+            cond_params = [(name, values[rows]) for name, values in params
+                           if not isnan(values[rows]).all()]
+            if cond_params:
+                has_pmods = True
+                pmod_names = empty((len(cond_params),), dtype='object')
+                pmod_param = empty((len(cond_params),), dtype='object')
+                pmod_poly = empty((len(cond_params),), dtype='object')
+                for pmod_i, (name, values) in enumerate(cond_params):
+                    pmod_names[pmod_i] = name
+                    pmod_param[pmod_i] = values
+                    pmod_poly[pmod_i] = 1.0
+                pmods[i]['name'] = pmod_names
+                pmods[i]['poly'] = pmod_poly
+                pmods[i]['param'] = pmod_param
+            else:
+                pmods[i]['name'], pmods[i]['poly'], pmods[i]['param'] = \
+                    [], [], []
+
+        structs[run] = dict(names=names, durations=run_durations,
+                            onsets=run_onsets)
+        if has_pmods:
+            structs[run]['pmod'] = pmods
+    return structs
+
+
+def write_spm(runs_df, out, pmod_name='pmod', conditions=None, jobs=1):
+    """Write one SPM onsets file, <out><run>.mat, per run. Return paths."""
+    structs = spm_onsets(runs_df, pmod_name, conditions)
+    paths = ['%s%s.mat' % (out, run) for run in structs]
+    if jobs > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(savemat, paths, structs.values(),
+                          chunksize=max(1, len(paths) // (4 * jobs))))
+    else:
+        for path, struct in zip(paths, structs.values()):
+            savemat(path, struct)
+    return paths
+
+
 def parse_args():
     parser = ArgumentParser()
-    parser.add_argument('onsets_files', type=FileType('r'),
+    parser.add_argument('onsets_files',
                         help='List of FSL EV onsets to convert', nargs='+')
     parser.add_argument('--out',   '-o', default='onsets_',
                         help='Output filename.')
-    parser.add_argument('--verbose',      '-v', action="count",
+    parser.add_argument('--format', choices=['csv', 'parquet'],
+                        help='Output format (default: from --out extension, '
+                             'else csv)')
+    parser.add_argument('--jobs', '-j', type=int, default=cpu_count() or 1,
+                        help='Onsets files read in parallel')
+    parser.add_argument('--verbose',      '-v', action="count", default=0,
                         help="increase output verbosity")
+    parser.add_argument('--spm', action='store_true',
+                        help='Write SPM multiple-conditions files, '
+                             '<out><run>.mat, instead of a design file')
     parser.add_argument('--pmod-name', default='pmod',
                         help='Name to use when writing FSL Amplitude as SPM '
                              'parametric modulator')
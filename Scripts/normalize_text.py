@@ -0,0 +1,136 @@
+"""
+Script para limpar o texto das páginas entre a extração e o chunking.
+
+As regras são compiladas uma vez (expressões regulares e uma tabela de
+`str.translate`) e aplicadas a todas as páginas de uma vez com as operações
+de string do pandas:
+
+- caracteres invisíveis, ligaduras e espaços especiais são trocados pela
+  tabela de tradução;
+- cabeçalhos e rodapés são as linhas das bordas da página (números trocados
+  por `#`) que se repetem em várias páginas, como números de página e títulos
+  correntes, e são removidos;
+- quebras de linha com hífen são desfeitas: `for-\\nmação` vira `formação` se
+  a palavra sem hífen aparece no corpus e a forma com hífen não; senão o
+  hífen fica (`arrependeu-\\nse`, `vice-\\nversa`);
+- os espaços são colapsados e as páginas que ficam vazias são descartadas.
+
+    python normalize_text.py --csv data/cosmos_text.csv --output data/cosmos_text_clean.csv
+"""
+import argparse
+import math
+import re
+
+_TRANSLATION = str.maketrans({
+    '­': '',     # hífen opcional
+    '​': '',     # espaço de largura zero
+    '﻿': '',
+    ' ': ' ',
+    ' ': ' ',
+    ' ': ' ',
+    '\t': ' ',
+    '\r': '\n',
+    '\f': '\n',
+    'ﬀ': 'ff',
+    'ﬁ': 'fi',
+    'ﬂ': 'fl',
+    'ﬃ': 'ffi',
+    'ﬄ': 'ffl',
+})
+_LINE_HYPHEN = re.compile(r'(\w+)-[ ]*\n[ ]*(\w+)')
+_INLINE_HYPHEN = re.compile(r'\w+-\w+')
+_WORD = re.compile(r'\w+')
+_DIGITS = re.compile(r'\d+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _edge_lines(lines, edge_lines):
+    """Máscara das `edge_lines` primeiras e últimas linhas não vazias de cada página."""
+    from_start = lines.groupby(level=0).cumcount().to_numpy()
+    from_end = lines.iloc[::-1].groupby(level=0).cumcount().to_numpy()[::-1]
+    return (from_start < edge_lines) | (from_end < edge_lines)
+
+
+def strip_headers(texts, edge_lines=2, min_pages=3, min_ratio=0.01):
+    """Remove as linhas de borda que se repetem em pelo menos `min_pages` páginas
+    (ou `min_ratio` delas)."""
+    import pandas as pd
+
+    lines = texts.str.split('\n').explode().str.strip()
+    lines = lines[lines.fillna('') != '']
+    if lines.empty:
+        return texts
+    keys = lines.str.replace(_DIGITS, '#', regex=True).str.lower()
+    edge = _edge_lines(lines, edge_lines)
+
+    pages = pd.DataFrame({'page': lines.index[edge], 'key': keys[edge].to_numpy()})
+    frequency = pages.drop_duplicates()['key'].value_counts()
+    repeated = frequency.index[frequency >= max(min_pages, math.ceil(min_ratio * len(texts)))]
+
+    kept = lines[~(edge & keys.isin(repeated).to_numpy())]
+    return kept.groupby(level=0).agg('\n'.join).reindex(texts.index, fill_value='')
+
+
+def dehyphenate(texts):
+    """Desfaz as quebras de linha com hífen usando o vocabulário das próprias páginas."""
+    lowered = texts.str.lower()
+    words = set(lowered.str.findall(_WORD).explode().dropna())
+    hyphenated = set(lowered.str.findall(_INLINE_HYPHEN).explode().dropna())
+
+    def join(match):
+        head, tail = match.groups()
+        joined = head + tail
+        if joined.lower() in words and (head + '-' + tail).lower() not in hyphenated:
+            return joined
+        return head + '-' + tail
+    return texts.str.replace(_LINE_HYPHEN, join, regex=True)
+
+
+def normalize_pages(pages, edge_lines=2, min_pages=3, min_ratio=0.01):
+    """Limpa `(página, texto)` e devolve a lista sem as páginas vazias.
+
+    A detecção de cabeçalhos compara todas as páginas entre si, então a
+    entrada é lida inteira (um livro tem centenas de páginas, não milhões).
+    """
+    import pandas as pd
+
+    pages = list(pages)
+    if not pages:
+        return []
+    numbers, contents = zip(*pages)
+    texts = pd.Series(contents, dtype=object).fillna('').str.translate(_TRANSLATION)
+    texts = strip_headers(texts, edge_lines, min_pages, min_ratio)
+    texts = dehyphenate(texts)
+    texts = texts.str.replace(_WHITESPACE, ' ', regex=True).str.strip()
+    return [(page, text) for page, text in zip(numbers, texts) if text]
+
+
+def parse_args():
+    from chunk_store import PAGE_STORE_PATH
+    parser = argparse.ArgumentParser(description='Normalize extracted page text.')
+    parser.add_argument('--pages', default=PAGE_STORE_PATH, help='Page store to read')
+    parser.add_argument('--csv', help='Read a page,text CSV instead of the page store')
+    parser.add_argument('--output', required=True, help='Cleaned page,text CSV')
+    parser.add_argument('--min-pages', type=int, default=3,
+                        help='Edge lines repeated on this many pages are dropped')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import pandas as pd
+
+    args = parse_args()
+    if args.csv:
+        frame = pd.read_csv(args.csv)
+        pages = list(zip(frame['page'], frame['text']))
+    else:
+        from chunk_store import read_chunks
+        table = read_chunks(args.pages, columns=['page_start', 'text'])
+        pages = list(zip(table.column('page_start').to_pylist(),
+                         table.column('text').to_pylist()))
+    cleaned = normalize_pages(pages, min_pages=args.min_pages)
+    pd.DataFrame(cleaned, columns=['page', 'text']).to_csv(args.output, index=False)
+    before = sum(len(text) for _, text in pages if isinstance(text, str))
+    after = sum(len(text) for _, text in cleaned)
+    print('%d of %d pages kept, %d -> %d characters, saved to %s'
+          % (len(cleaned), len(pages), before, after, args.output))
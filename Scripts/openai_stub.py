@@ -0,0 +1,116 @@
+"""
+Servidor local que imita as rotas da OpenAI usadas pelo pipeline.
+
+Responde `POST /v1/chat/completions` (ecoa o início da última mensagem) e
+`POST /v1/embeddings` (vetores determinísticos derivados do texto), com
+`usage` preenchido e uma latência artificial opcional. Serve para testar e
+medir `chat_client.py`, `generate_embeddings.py` e o `query_service.py` sem
+chave nem custo:
+
+    python openai_stub.py --port 8089 --delay 0.2
+    COSMOS_RAG_OPENAI_BASE_URL=http://127.0.0.1:8089/v1 COSMOS_RAG_OPENAI_API_KEY=stub ...
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _tokens(text):
+    return max(1, len(text) // 4)
+
+
+def chat_response(body):
+    messages = body.get('messages') or []
+    prompt = ' '.join(message.get('content') or '' for message in messages)
+    words = (messages[-1].get('content') or '').split() if messages else []
+    answer = 'stub: ' + ' '.join(words[:body.get('max_tokens') or 16])
+    return {
+        'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': int(time.time()),
+        'model': body.get('model', 'stub'),
+        'choices': [{'index': 0, 'finish_reason': 'stop',
+                     'message': {'role': 'assistant', 'content': answer}}],
+        'usage': {'prompt_tokens': _tokens(prompt), 'completion_tokens': _tokens(answer),
+                  'total_tokens': _tokens(prompt) + _tokens(answer)},
+    }
+
+
+def embedding_response(body, dim):
+    texts = body.get('input') or []
+    if isinstance(texts, str):
+        texts = [texts]
+    data = []
+    for index, text in enumerate(texts):
+        seed = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+        rng = random.Random(seed)
+        vector = [rng.gauss(0, 1) for _ in range(dim)]
+        norm = sum(x * x for x in vector) ** 0.5
+        data.append({'object': 'embedding', 'index': index,
+                     'embedding': [x / norm for x in vector]})
+    tokens = sum(_tokens(text) for text in texts)
+    return {'object': 'list', 'data': data, 'model': body.get('model', 'stub'),
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    delay = 0.0
+    dim = 1536
+    requests = 0
+    _count_lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        with StubHandler._count_lock:
+            StubHandler.requests += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.path.endswith('/chat/completions'):
+            self._send(200, chat_response(body))
+        elif self.path.endswith('/embeddings'):
+            self._send(200, embedding_response(body, self.dim))
+        else:
+            self._send(404, {'error': {'message': 'rota desconhecida: %s' % self.path,
+                                       'type': 'invalid_request_error'}})
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(host='127.0.0.1', port=0, delay=0.0, dim=1536):
+    """Sobe o stub numa thread; devolve o servidor e a `base_url`."""
+    handler = type('Handler', (StubHandler,), {'delay': delay, 'dim': dim})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://%s:%d/v1' % server.server_address[:2]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Local stand-in for the OpenAI API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds per request')
+    parser.add_argument('--dim', type=int, default=1536, help='Embedding dimension')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server, base_url = start_stub(args.host, args.port, args.delay, args.dim)
+    print('OpenAI stub on %s' % base_url)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,37 @@
+"""
+Script para dividir as páginas extraídas em chunks.
+"""
+import re
+
+from chunk_store import CHUNK_STORE_PATH, PAGE_STORE_PATH, make_chunk, read_chunks, write_chunks
+
+_WHITESPACE = re.compile(r'\s+')
+
+def split_text(text, chunk_size=None, chunk_overlap=0):
+    if not chunk_size or len(text) <= chunk_size:
+        return [text]
+    step = chunk_size - chunk_overlap
+    return [text[i:i + chunk_size] for i in range(0, len(text) - chunk_overlap, step)]
+
+def chunk_pages(pages, chunk_size=None, chunk_overlap=0):
+    # Por padrão um chunk por página, como em cosmos_text_chunks.csv
+    for page, content in pages:
+        text = _WHITESPACE.sub(' ', content or '').strip()
+        if not text:
+            continue
+        for chunk_index, chunk in enumerate(split_text(text, chunk_size, chunk_overlap)):
+            yield make_chunk(chunk, page, chunk_index)
+
+def preprocess_store(page_store=PAGE_STORE_PATH, chunk_store=CHUNK_STORE_PATH,
+                     chunk_size=None, chunk_overlap=0, normalize=True):
+    pages = read_chunks(page_store, columns=["page_start", "text"])
+    rows = zip(pages.column("page_start").to_pylist(), pages.column("text").to_pylist())
+    if normalize:
+        # Sem cabeçalhos, hifenização nem páginas vazias (ver normalize_text.py)
+        from normalize_text import normalize_pages
+        rows = normalize_pages(rows)
+    return write_chunks(chunk_store, chunk_pages(rows, chunk_size, chunk_overlap))
+
+if __name__ == "__main__":
+    count = preprocess_store()
+    print("%d chunks saved to %s" % (count, CHUNK_STORE_PATH))
@@ -0,0 +1,240 @@
+"""
+Script para quantizar os embeddings do chunk store.
+
+Dois quantizadores, com a mesma interface (`fit`, `encode`, `decode`,
+`scores`):
+
+- `ScalarQuantizer` (int8): cada dimensão é mapeada para 0..255 pelo seu
+  mínimo e máximo; 1 byte por dimensão (1536 B por vetor em vez de 6 KB).
+- `ProductQuantizer` (PQ): o vetor é cortado em `m` subespaços e cada um é
+  trocado pelo índice do centróide mais próximo (k-means com 256 centróides);
+  `m` bytes por vetor.
+
+A busca é assimétrica (ADC): a consulta fica em float32 e o produto interno é
+calculado direto sobre os códigos, via tabelas por subespaço, sem
+descompactar a base. Opcionalmente os `rescore` melhores candidatos são
+reordenados com os vetores float32 originais, lidos por memory map do chunk
+store, então só essas linhas saem do disco.
+
+Os códigos ficam em `<store>/quantized-<tipo>/codes.npy` (lidos por memory
+map) e os parâmetros em `model.npz`.
+"""
+import argparse
+import os
+
+import numpy as np
+
+_BLOCK_ROWS = 2048
+
+
+class ScalarQuantizer:
+    kind = 'int8'
+
+    def __init__(self, low=None, scale=None):
+        self.low = low
+        self.scale = scale
+
+    def fit(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.low = vectors.min(axis=0)
+        self.scale = np.maximum(vectors.max(axis=0) - self.low, 1e-12) / np.float32(255)
+        return self
+
+    def encode(self, vectors):
+        codes = np.empty(np.shape(vectors), dtype=np.uint8)
+        for start in range(0, len(codes), _BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + _BLOCK_ROWS], dtype=np.float32)
+            codes[start:start + _BLOCK_ROWS] = np.clip(
+                np.rint((block - self.low) / self.scale), 0, 255)
+        return codes
+
+    def decode(self, codes):
+        return codes.astype(np.float32) * self.scale + self.low
+
+    def scan_layout(self, codes):
+        return codes
+
+    def scores(self, query, codes):
+        # q . (c * scale + low) = (q * scale) . c + q . low
+        weights = (np.asarray(query, dtype=np.float32) * self.scale).astype(np.float32)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _BLOCK_ROWS):
+            block = codes[start:start + _BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ weights
+        return scores + np.float32(query @ self.low)
+
+    @property
+    def nbytes(self):
+        return self.low.nbytes + self.scale.nbytes
+
+    def state(self):
+        return {'low': self.low, 'scale': self.scale}
+
+
+class ProductQuantizer:
+    kind = 'pq'
+
+    def __init__(self, m=96, bits=8, iterations=25, sample=50000, seed=0,
+                 codebooks=None):
+        self.m = m
+        self.bits = bits
+        self.iterations = iterations
+        self.sample = sample
+        self.seed = seed
+        self.codebooks = codebooks
+        if codebooks is not None:
+            self.m = len(codebooks)
+
+    def fit(self, vectors):
+        from sklearn.cluster import KMeans
+
+        n, dim = np.shape(vectors)
+        if dim % self.m:
+            raise ValueError('a dimensão %d não é divisível por m=%d' % (dim, self.m))
+        sub = dim // self.m
+        clusters = min(2 ** self.bits, n)
+        rng = np.random.default_rng(self.seed)
+        rows = np.sort(rng.choice(n, min(n, self.sample), replace=False))
+        training = np.asarray(vectors[rows], dtype=np.float32)
+
+        self.codebooks = np.empty((self.m, clusters, sub), dtype=np.float32)
+        for j in range(self.m):
+            kmeans = KMeans(n_clusters=clusters, n_init=1, max_iter=self.iterations,
+                            random_state=self.seed)
+            self.codebooks[j] = kmeans.fit(training[:, j * sub:(j + 1) * sub]).cluster_centers_
+        return self
+
+    def encode(self, vectors):
+        m, _, sub = self.codebooks.shape
+        norms = np.einsum('jks,jks->jk', self.codebooks, self.codebooks)
+        codes = np.empty((len(vectors), m), dtype=np.uint8)
+        for start in range(0, len(codes), _BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + _BLOCK_ROWS], dtype=np.float32)
+            for j in range(m):
+                # argmin |x - c|^2 = argmin |c|^2 - 2 x.c
+                distances = norms[j] - 2 * (block[:, j * sub:(j + 1) * sub] @ self.codebooks[j].T)
+                codes[start:start + len(block), j] = distances.argmin(axis=1)
+        return codes
+
+    def decode(self, codes):
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def scan_layout(self, codes):
+        # Um subespaço por linha: cada consulta percorre memória contígua
+        return np.ascontiguousarray(np.transpose(codes))
+
+    def scores(self, query, codes):
+        """`codes` no formato de `scan_layout`, (m, n)."""
+        m, _, sub = self.codebooks.shape
+        # Tabela (m, 256) com o produto interno da consulta com cada centróide
+        table = np.einsum('jks,js->jk', self.codebooks,
+                          np.asarray(query, dtype=np.float32).reshape(m, sub))
+        scores = np.zeros(codes.shape[1], dtype=np.float32)
+        for j in range(m):
+            scores += table[j].take(codes[j])
+        return scores
+
+    @property
+    def nbytes(self):
+        return self.codebooks.nbytes
+
+    def state(self):
+        return {'codebooks': self.codebooks}
+
+
+QUANTIZERS = {'int8': ScalarQuantizer, 'pq': ProductQuantizer}
+
+
+class QuantizedIndex:
+    """Códigos quantizados e, opcionalmente, os vetores originais para re-scoring."""
+
+    def __init__(self, quantizer, codes, vectors=None):
+        self.quantizer = quantizer
+        self.codes = codes
+        self.vectors = vectors
+        self._scan = quantizer.scan_layout(codes)
+
+    @classmethod
+    def build(cls, quantizer, vectors):
+        quantizer.fit(vectors)
+        return cls(quantizer, quantizer.encode(vectors), vectors)
+
+    def search(self, query, k=10, rescore=0):
+        """Os `k` ids de maior produto interno e seus scores.
+
+        Com `rescore` > 0 e vetores disponíveis, os `rescore` melhores
+        candidatos da busca ADC são reordenados com os vetores float32.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        scores = self.quantizer.scores(query, self._scan)
+        exact = rescore and self.vectors is not None
+        candidates = min(len(scores), max(k, rescore if exact else k))
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        if exact:
+            top = np.sort(top)  # leitura sequencial das linhas do memory map
+            scores = np.asarray(self.vectors[top], dtype=np.float32) @ query
+        else:
+            scores = scores[top]
+        order = np.argsort(-scores)[:k]
+        return top[order], scores[order]
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.quantizer.nbytes
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'codes.npy'), self.codes)
+        np.savez(os.path.join(path, 'model.npz'), kind=self.quantizer.kind,
+                 **self.quantizer.state())
+
+    @classmethod
+    def load(cls, path, vectors=None):
+        with np.load(os.path.join(path, 'model.npz')) as model:
+            state = {key: model[key] for key in model.files if key != 'kind'}
+            quantizer = QUANTIZERS[str(model['kind'])](**state)
+        codes = np.load(os.path.join(path, 'codes.npy'), mmap_mode='r')
+        if vectors is not None and len(vectors) != len(codes):
+            raise ValueError('códigos desatualizados: %d vetores, %d códigos (%s)'
+                             % (len(vectors), len(codes), path))
+        return cls(quantizer, codes, vectors)
+
+
+def quantized_path(store_path, kind):
+    return os.path.join(store_path, 'quantized-%s' % kind)
+
+
+def _store_vectors(store_path):
+    from chunk_store import embedding_matrix, read_chunks
+    return embedding_matrix(read_chunks(store_path, columns=['embedding']))
+
+
+def quantize_store(store_path, kind='int8', **options):
+    """Quantiza a coluna `embedding` do chunk store e salva ao lado dela."""
+    index = QuantizedIndex.build(QUANTIZERS[kind](**options), _store_vectors(store_path))
+    index.save(quantized_path(store_path, kind))
+    return index
+
+
+def load_store_index(store_path, kind='int8', rescore=True):
+    """Carrega os códigos; com `rescore`, também os vetores (memory map, sem cópia)."""
+    vectors = _store_vectors(store_path) if rescore else None
+    return QuantizedIndex.load(quantized_path(store_path, kind), vectors)
+
+
+def parse_args():
+    from chunk_store import CHUNK_STORE_PATH
+    parser = argparse.ArgumentParser(description='Quantize the chunk store embeddings.')
+    parser.add_argument('--store', default=CHUNK_STORE_PATH)
+    parser.add_argument('--kind', choices=sorted(QUANTIZERS), default='int8')
+    parser.add_argument('--m', type=int, default=96, help='PQ subspaces (bytes per vector)')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    options = {'m': args.m} if args.kind == 'pq' else {}
+    index = quantize_store(args.store, args.kind, **options)
+    print('%d vectors quantized (%s): %.1f MB -> %.1f MB, saved to %s'
+          % (len(index.codes), args.kind, index.vectors.nbytes / 2 ** 20,
+             index.nbytes / 2 ** 20, quantized_path(args.store, args.kind)))
@@ -0,0 +1,398 @@
+"""
+Serviço HTTP local para o pipeline RAG.
+
+Configuração, clientes (OpenAI, Weaviate), o índice de capítulos e o índice
+TF-IDF local são carregados uma única vez, na subida do processo; cada
+requisição paga só o trabalho real. As conexões são atendidas por um loop
+asyncio (HTTP/1.1 com keep-alive) e as chamadas bloqueantes rodam num pool de
+threads, de modo que várias requisições ficam em voo ao mesmo tempo.
+
+Endpoints (corpo e resposta em JSON):
+
+    POST /query     {"query": ..., "k": 3, "chapter": null, "classify": false,
+                     "backend": "local"|"weaviate"}
+    POST /retrieve  {"query": ..., "k": 3, "chapter": null, "backend": ...}
+                    (com --shards: "tenants": [...], "documents": [...])
+    POST /embed     {"texts": [...]}  (ou {"text": ...})
+    GET  /health
+    GET  /metrics   (latências por rota e, em "tokens", o uso de tokens por
+                    estágio e modelo; ver token_usage.py)
+"""
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.client import responses
+
+from rag_config import get_config
+from token_usage import BudgetExceeded, get_ledger, query_scope
+
+MAX_BODY = 1 << 20
+MAX_K = 100
+_LATENCY_WINDOW = 1024
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Metrics:
+    """Contadores e latências por rota. Só é atualizado no loop asyncio."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.in_flight = 0
+        self.routes = {}
+
+    def record(self, route, seconds, error=False):
+        stats = self.routes.setdefault(route, {
+            'requests': 0, 'errors': 0, 'seconds': 0.0,
+            'latencies': deque(maxlen=_LATENCY_WINDOW)})
+        stats['requests'] += 1
+        stats['errors'] += int(error)
+        stats['seconds'] += seconds
+        stats['latencies'].append(seconds)
+
+    def snapshot(self):
+        routes = {}
+        for route, stats in self.routes.items():
+            latencies = sorted(stats['latencies'])
+            routes[route] = {
+                'requests': stats['requests'],
+                'errors': stats['errors'],
+                'mean_seconds': stats['seconds'] / stats['requests'],
+                'p50_seconds': latencies[len(latencies) // 2],
+                'p95_seconds': latencies[min(len(latencies) - 1,
+                                             int(len(latencies) * 0.95))],
+            }
+        return {'uptime_seconds': time.time() - self.started,
+                'in_flight': self.in_flight, 'routes': routes}
+
+
+def _weaviate_passage(item):
+    metadata = item.get('metadata')
+    if isinstance(metadata, str):
+        metadata = json.loads(metadata)
+    return {'text': item['content'], 'metadata': metadata,
+            'chapter': item.get('chapter')}
+
+
+class RagService:
+    """Recursos do pipeline, carregados uma vez e compartilhados pelas threads."""
+
+    def __init__(self, api_key, weaviate_url, chapter_index, local_index=None,
+                 cache_size=0, router=None):
+        self.api_key = api_key
+        self.weaviate_url = weaviate_url
+        self.chapter_index = chapter_index
+        self.local_index = local_index
+        self.router = router
+        self._weaviate = None
+        self._weaviate_lock = threading.Lock()
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, store_path=None, config=None, shard_root=None, shard_backend='local'):
+        from chapter_index import load_chapter_index
+        from chat_client import client
+
+        config = config or get_config()
+        api_key = config.require_openai_key()
+        # O cliente compartilhado mantém o pool de conexões entre chamadas
+        client(api_key)
+        chapter_index = load_chapter_index()
+
+        local_index = None
+        if store_path:
+            from chunk_store import read_chunks, to_records
+            from retrieve_text import build_partitions
+            records = to_records(read_chunks(
+                store_path, columns=['text', 'page_start', 'chunk_index']))
+            local_index = build_partitions(records, chapter_index)
+        router = None
+        if shard_root:
+            from shards import open_router
+            router = open_router(shard_root, shard_backend)
+        return cls(api_key, config.weaviate.host, chapter_index, local_index,
+                   config.tunables.retrieval_cache_size, router)
+
+    def weaviate(self):
+        # Criado na primeira consulta: o serviço sobe mesmo com o Weaviate fora
+        with self._weaviate_lock:
+            if self._weaviate is None:
+                from query_weaviate import weaviate_client
+                self._weaviate = weaviate_client(self.weaviate_url)
+            return self._weaviate
+
+    def health(self):
+        return {'status': 'ok',
+                'local_index': self.local_index is not None,
+                'shards': len(self.router.shards()) if self.router else 0,
+                'weaviate_connected': self._weaviate is not None,
+                'chapters': len(self.chapter_index['chapters'])}
+
+    def _chapter(self, body, query):
+        if body.get('chapter') is not None:
+            return _integer(body, 'chapter', minimum=0)
+        if body.get('classify'):
+            from chapter_index import resolve_chapter
+            from classify_query import classify_query
+            return resolve_chapter(classify_query(query, self.api_key),
+                                   self.chapter_index)
+        return None
+
+    def _cached(self, key, compute):
+        # LRU das passagens recuperadas: consultas repetidas não tocam o índice
+        if not self.cache_size:
+            return compute()
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        value = compute()
+        with self._cache_lock:
+            self._cache[key] = value
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return value
+
+    def retrieve(self, body):
+        with query_scope():
+            return self._retrieve(body)
+
+    def _retrieve(self, body):
+        query = _required(body, 'query')
+        k = _integer(body, 'k', 3, minimum=1, maximum=MAX_K)
+        chapter = self._chapter(body, query)
+        tenants = tuple(body.get('tenants') or ())
+        documents = tuple(body.get('documents') or ())
+        backend = body.get('backend') or (
+            'shards' if self.router and (tenants or documents) else
+            'local' if self.local_index else 'weaviate')
+        passages = self._cached(
+            (query, k, chapter, backend, tenants, documents),
+            lambda: self._passages(query, k, chapter, backend, tenants, documents))
+        return {'query': query, 'chapter': chapter, 'backend': backend,
+                'passages': passages}
+
+    def _passages(self, query, k, chapter, backend, tenants=(), documents=()):
+        if backend == 'shards':
+            if self.router is None:
+                raise HttpError(400, 'shards não carregados (use --shards)')
+            return self.router.search(query, k, tenants, documents, chapter)
+        if backend == 'local':
+            if self.local_index is None:
+                raise HttpError(400, 'índice local não carregado (use --store)')
+            from retrieve_text import retrieve_text
+            return retrieve_text(query, self.local_index, chapter=chapter, k=k)
+        if backend == 'weaviate':
+            from query_weaviate import query_weaviate
+            response = query_weaviate(query, self.weaviate_url, chapter=chapter,
+                                      client=self.weaviate(), limit=k)
+            class_name = get_config().weaviate.class_name
+            return [_weaviate_passage(item) for item in response['data']['Get'][class_name]]
+        raise HttpError(400, 'backend desconhecido: %s' % backend)
+
+    def query(self, body):
+        from generate_response import build_prompt, generate_response
+        # Classificação e resposta contam para o custo da mesma consulta
+        with query_scope():
+            result = self._retrieve(body)
+            prompt = build_prompt(result['query'],
+                                  [passage['text'] for passage in result['passages']])
+            result['answer'] = generate_response(prompt, self.api_key)
+        return result
+
+    def embed(self, body):
+        from generate_embeddings import embed_batch
+        texts = body.get('texts')
+        if texts is None:
+            texts = [_required(body, 'text')]
+        if not isinstance(texts, list) or not texts:
+            raise HttpError(400, '"texts" deve ser uma lista não vazia')
+        records = embed_batch([{'text': text} for text in texts], self.api_key)
+        return {'embeddings': [record['embedding'] for record in records]}
+
+
+def _required(body, key):
+    if not body.get(key):
+        raise HttpError(400, 'campo obrigatório ausente: %s' % key)
+    return body[key]
+
+
+def _integer(body, key, default=None, minimum=None, maximum=None):
+    value = body.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise HttpError(400, '"%s" deve ser um inteiro' % key)
+    try:
+        value = int(value)
+    except ValueError:
+        raise HttpError(400, '"%s" deve ser um inteiro' % key)
+    if minimum is not None and value < minimum:
+        raise HttpError(400, '"%s" deve ser no mínimo %d' % (key, minimum))
+    if maximum is not None and value > maximum:
+        raise HttpError(400, '"%s" deve ser no máximo %d' % (key, maximum))
+    return value
+
+
+class QueryServer:
+    """Servidor HTTP/1.1 mínimo sobre `asyncio.start_server`."""
+
+    def __init__(self, service, workers=None, timeout=None):
+        tunables = get_config().tunables
+        workers = workers or tunables.service_workers
+        self.timeout = timeout or tunables.request_timeout
+        self.service = service
+        self.metrics = Metrics()
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='rag')
+        self.routes = {
+            ('POST', '/query'): service.query,
+            ('POST', '/retrieve'): service.retrieve,
+            ('POST', '/embed'): service.embed,
+            ('GET', '/health'): lambda body: service.health(),
+            ('GET', '/metrics'): lambda body: dict(self.metrics.snapshot(),
+                                                   tokens=get_ledger().snapshot()),
+        }
+
+    async def dispatch(self, method, path, body):
+        handler = self.routes.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in self.routes):
+                raise HttpError(405, 'método não permitido: %s' % method)
+            raise HttpError(404, 'rota desconhecida: %s' % path)
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError as e:
+            raise HttpError(400, 'JSON inválido: %s' % e)
+        if not isinstance(payload, dict):
+            raise HttpError(400, 'o corpo deve ser um objeto JSON')
+        if method == 'GET':
+            return handler(payload)
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self.executor, handler, payload), self.timeout)
+        except asyncio.TimeoutError:
+            raise HttpError(504, 'tempo esgotado após %g s' % self.timeout)
+
+    async def respond(self, method, path, body):
+        start = time.perf_counter()
+        self.metrics.in_flight += 1
+        status = 200
+        try:
+            payload = await self.dispatch(method, path, body)
+        except HttpError as e:
+            status, payload = e.status, {'error': str(e)}
+        except BudgetExceeded as e:
+            status, payload = 429, {'error': str(e)}
+        except Exception as e:
+            status, payload = 500, {'error': '%s: %s' % (type(e).__name__, e)}
+        finally:
+            self.metrics.in_flight -= 1
+        if (method, path) in self.routes:
+            self.metrics.record(path, time.perf_counter() - start, status >= 400)
+        return status, payload
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._write(writer, 400, {'error': 'requisição inválida'}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = (version == 'HTTP/1.1' and
+                              headers.get('connection', '').lower() != 'close')
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # Sem um tamanho válido não dá para achar o fim do corpo
+                    await self._write(writer, 400, {'error': 'content-length inválido'}, False)
+                    break
+                if length > MAX_BODY:
+                    await self._write(writer, 413, {'error': 'corpo grande demais'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await self.respond(method, target.split('?', 1)[0], body)
+                await self._write(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _write(self, writer, status, payload, keep_alive):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write(('HTTP/1.1 %d %s\r\n'
+                      'Content-Type: application/json; charset=utf-8\r\n'
+                      'Content-Length: %d\r\n'
+                      'Connection: %s\r\n\r\n'
+                      % (status, responses.get(status, ''), len(data),
+                         'keep-alive' if keep_alive else 'close')).encode('latin-1'))
+        writer.write(data)
+        await writer.drain()
+
+    async def serve(self, host='127.0.0.1', port=8000, ready=None):
+        server = await asyncio.start_server(self.handle, host, port)
+        if ready is not None:
+            ready(server.sockets[0].getsockname()[:2])
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve the RAG pipeline over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Threads for blocking work (API calls, retrieval); '
+                             'default: COSMOS_RAG_SERVICE_WORKERS (8)')
+    parser.add_argument('--store', default=None,
+                        help='Chunk store for the local TF-IDF retriever, '
+                             'e.g. data/cosmos_chunks')
+    parser.add_argument('--shards', default=None,
+                        help='Shard root (see shards.py) for tenant queries')
+    parser.add_argument('--shard-backend', choices=('local', 'weaviate'), default='local')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    start = time.perf_counter()
+    service = RagService.load(args.store, shard_root=args.shards,
+                              shard_backend=args.shard_backend)
+    server = QueryServer(service, workers=args.workers)
+
+    def ready(address):
+        print('loaded in %.2f s, listening on http://%s:%d'
+              % ((time.perf_counter() - start,) + tuple(address)), file=sys.stderr)
+    try:
+        asyncio.run(server.serve(args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
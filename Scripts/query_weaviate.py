@@ -1,19 +1,44 @@
 import weaviate
-import json
 
-def query_weaviate(query, weaviate_url):
-    client = weaviate.Client(
-        url=weaviate_url,
-        auth_client_secret=weaviate.AuthApiKey(api_key="YOUR_API_KEY")  # Ajuste conforme necessário
+from rag_config import get_config
+
+def chapter_filter(chapter):
+    return {"path": ["chapter"], "operator": "Equal", "valueInt": chapter}
+
+def weaviate_client(weaviate_url=None, api_key=None):
+    config = get_config().weaviate
+    api_key = api_key or config.api_key
+    auth = weaviate.AuthApiKey(api_key=api_key) if api_key else None
+    return weaviate.Client(
+        url=weaviate_url or config.host,
+        auth_client_secret=auth,
+        timeout_config=(config.timeout, config.timeout)
     )
+
+def query_weaviate(query, weaviate_url=None, chapter=None, client=None, limit=None,
+                   class_name=None, with_distance=False):
+    # Um cliente já aberto pode ser reaproveitado entre consultas
+    if client is None:
+        client = weaviate_client(weaviate_url)
     
     # Query Weaviate
-    response = client.query.get("CosmosChapter", ["title", "content", "metadata"]).with_near_text({"concepts": [query]}).do()
+    class_name = class_name or get_config().weaviate.class_name
+    request = client.query.get(class_name, ["title", "content", "metadata", "chapter"]).with_near_text({"concepts": [query]})
+    if with_distance:
+        request = request.with_additional(["distance"])
+    if limit is not None:
+        request = request.with_limit(limit)
+    if chapter is not None:
+        # Restringe a busca à partição do capítulo no próprio Weaviate
+        request = request.with_where(chapter_filter(chapter))
+    response = request.do()
     return response
 
 if __name__ == "__main__":
-    with open('config/openai_config.json') as f:
-        config = json.load(f)
+    from chapter_index import load_chapter_index, resolve_chapter
+    from classify_query import classify_query
+
     query = "Qual é a opinião de Carl Sagan sobre a possibilidade de formas de vida baseadas em elementos diferentes do carbono e água?"
-    response = query_weaviate(query, 'http://localhost:8080')
+    chapter = resolve_chapter(classify_query(query, get_config().require_openai_key()), load_chapter_index())
+    response = query_weaviate(query, chapter=chapter)
     print(response)
@@ -0,0 +1,214 @@
+"""
+Script com a configuração do pipeline, carregada e validada uma vez por
+processo.
+
+Lê `config/openai_config.json` e `config/weaviate_config.json`, aplica as
+variáveis de ambiente `COSMOS_RAG_*` por cima e guarda o resultado em cache.
+Os parâmetros de desempenho (tamanhos de lote, de pool e de cache, timeouts)
+ficam em `Tunables` e só vêm do ambiente, para que cada implantação ajuste a
+vazão sem editar código:
+
+    COSMOS_RAG_CONFIG_DIR=/etc/cosmos      diretório dos dois JSON
+    COSMOS_RAG_OPENAI_API_KEY=sk-...       (ou OPENAI_API_KEY)
+    COSMOS_RAG_WEAVIATE_HOST=http://weaviate:8080
+    COSMOS_RAG_EMBED_BATCH_SIZE=500
+    COSMOS_RAG_SERVICE_WORKERS=32
+"""
+import json
+import os
+import typing
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import Optional
+
+ENV_PREFIX = 'COSMOS_RAG_'
+CONFIG_DIR = 'config'
+OPENAI_CONFIG_FILE = 'openai_config.json'
+WEAVIATE_CONFIG_FILE = 'weaviate_config.json'
+
+# Valores de exemplo dos arquivos versionados contam como "não configurado"
+_PLACEHOLDER_PREFIX = 'your-'
+
+
+class ConfigError(ValueError):
+    """Configuração ausente ou inválida."""
+
+
+@dataclass(frozen=True)
+class OpenAIConfig:
+    api_key: Optional[str] = None
+    embedding_model: str = 'text-embedding-ada-002'
+    chat_model: str = 'gpt-4o-mini'
+    # Outro servidor compatível, como o openai_stub.py local
+    base_url: Optional[str] = None
+    timeout: float = 60.0
+
+
+@dataclass(frozen=True)
+class WeaviateConfig:
+    host: str = 'http://localhost:8080'
+    api_key: Optional[str] = None
+    class_name: str = 'CosmosChapter'
+    # Campos do nó Weaviate do Langflow (langflow/flow.json)
+    index_name: str = 'langflow-cosmos'
+    text_field: str = 'text'
+    metadata_field: str = 'metadata'
+    timeout: float = 30.0
+
+
+@dataclass(frozen=True)
+class Tunables:
+    embed_batch_size: int = 100
+    ingest_batch_size: int = 100
+    extract_workers: int = 4
+    ocr_workers: int = 2
+    embed_workers: int = 4
+    service_workers: int = 8
+    queue_size: int = 64
+    retrieval_cache_size: int = 256
+    request_timeout: float = 120.0
+    shard_max_chunks: int = 20000
+    shard_workers: int = 8
+    shard_cache_size: int = 16
+    dedup_threshold: float = 0.8
+    dedup_num_perm: int = 128
+    # Contabilidade de tokens (token_usage.py); vazio desliga o SQLite
+    usage_db: Optional[str] = 'data/token_usage.sqlite'
+    token_budgets: Optional[str] = None
+    chat_concurrency: int = 16
+    chat_requests_per_minute: int = 3000
+    chat_tokens_per_minute: int = 1000000
+
+
+@dataclass(frozen=True)
+class Config:
+    openai: OpenAIConfig
+    weaviate: WeaviateConfig
+    tunables: Tunables
+    config_dir: str
+
+    def require_openai_key(self):
+        if not self.openai.api_key:
+            raise ConfigError('chave da OpenAI ausente: defina api_key em %s ou '
+                              '%sOPENAI_API_KEY' % (os.path.join(self.config_dir,
+                                                                 OPENAI_CONFIG_FILE),
+                                                    ENV_PREFIX))
+        return self.openai.api_key
+
+
+def _coerce(name, value, kind, field=None):
+    # `name` é o rótulo das mensagens (variável de ambiente ou seção.campo);
+    # `field` é o nome do campo do dataclass, em minúsculas
+    optional = typing.get_origin(kind) is typing.Union
+    if optional:
+        kind = typing.get_args(kind)[0]
+        if value is None or value == '':
+            return None
+    if kind is str:
+        if not isinstance(value, str):
+            raise ConfigError('%s: esperado texto, recebido %r' % (name, value))
+        if value.startswith(_PLACEHOLDER_PREFIX):
+            if optional:
+                return None
+            raise ConfigError('%s: valor de exemplo %r' % (name, value))
+        return value
+    try:
+        if isinstance(value, bool) or (kind is int and isinstance(value, float)):
+            raise ValueError(value)
+        value = kind(value)
+    except (TypeError, ValueError):
+        raise ConfigError('%s: esperado %s, recebido %r' % (name, kind.__name__, value))
+    if value <= 0 and not (field or name).endswith('cache_size'):
+        raise ConfigError('%s: deve ser positivo, recebido %r' % (name, value))
+    if value < 0:
+        raise ConfigError('%s: não pode ser negativo, recebido %r' % (name, value))
+    return value
+
+
+def _section(cls, section, values, env, env_section=True):
+    """Monta uma seção a partir do JSON e das variáveis de ambiente."""
+    known = {f.name: f for f in fields(cls)}
+    unknown = sorted(set(values) - set(known))
+    if unknown:
+        raise ConfigError('%s: campos desconhecidos: %s' % (section, ', '.join(unknown)))
+    kwargs = {}
+    for name, f in known.items():
+        variable = ENV_PREFIX + ('%s_%s' % (section, name) if env_section else name).upper()
+        if variable in env:
+            kwargs[name] = _coerce(variable, env[variable], f.type, name)
+        elif name in values:
+            kwargs[name] = _coerce('%s.%s' % (section, name), values[name], f.type, name)
+    return cls(**kwargs)
+
+
+def _read(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            values = json.load(f)
+    except ValueError as e:
+        raise ConfigError('%s: JSON inválido: %s' % (path, e))
+    if not isinstance(values, dict):
+        raise ConfigError('%s: esperado um objeto JSON' % path)
+    return values
+
+
+def config_dir(env=None):
+    """`COSMOS_RAG_CONFIG_DIR`, senão `config/` do diretório atual ou do projeto."""
+    env = os.environ if env is None else env
+    if ENV_PREFIX + 'CONFIG_DIR' in env:
+        return env[ENV_PREFIX + 'CONFIG_DIR']
+    if os.path.isdir(CONFIG_DIR):
+        return CONFIG_DIR
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        CONFIG_DIR)
+
+
+def load_config(directory=None, env=None):
+    """Lê e valida a configuração, sem cache."""
+    env = os.environ if env is None else env
+    directory = directory or config_dir(env)
+
+    openai_values = _read(os.path.join(directory, OPENAI_CONFIG_FILE))
+    if ENV_PREFIX + 'OPENAI_API_KEY' not in env and 'OPENAI_API_KEY' in env:
+        openai_values = dict(openai_values, api_key=env['OPENAI_API_KEY'])
+    weaviate_values = _read(os.path.join(directory, WEAVIATE_CONFIG_FILE))
+
+    weaviate = _section(WeaviateConfig, 'weaviate', weaviate_values, env)
+    if not weaviate.host.startswith(('http://', 'https://')):
+        raise ConfigError('weaviate.host: esperado uma URL http(s), recebido %r'
+                          % weaviate.host)
+    tunables = _section(Tunables, 'tunables', {}, env, env_section=False)
+    if tunables.dedup_threshold > 1:
+        raise ConfigError('%sDEDUP_THRESHOLD: esperado um valor até 1, recebido %r'
+                          % (ENV_PREFIX, tunables.dedup_threshold))
+    return Config(openai=_section(OpenAIConfig, 'openai', openai_values, env),
+                  weaviate=weaviate,
+                  tunables=tunables,
+                  config_dir=directory)
+
+
+@lru_cache(maxsize=None)
+def _cached_config(directory):
+    return load_config(directory)
+
+
+def get_config():
+    """A configuração do processo, lida na primeira chamada."""
+    return _cached_config(config_dir())
+
+
+def reload_config():
+    _cached_config.cache_clear()
+    return get_config()
+
+
+if __name__ == "__main__":
+    config = get_config()
+    for section in ('openai', 'weaviate', 'tunables'):
+        for f in fields(getattr(config, section)):
+            value = getattr(getattr(config, section), f.name)
+            if f.name == 'api_key' and value:
+                value = value[:5] + '...'
+            print('%s.%s = %r' % (section, f.name, value))
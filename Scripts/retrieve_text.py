@@ -0,0 +1,41 @@
+"""
+Script para recuperar trechos localmente, com um sub-índice por capítulo.
+"""
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import linear_kernel
+
+from chapter_index import chapter_for_page, load_chapter_index
+from chunk_store import CHUNK_STORE_PATH, read_chunks, to_records
+
+def build_partitions(records, chapter_index):
+    # Um único vocabulário para o livro todo, mas linhas separadas por capítulo
+    vectorizer = TfidfVectorizer()
+    matrix = vectorizer.fit_transform([r['text'] for r in records])
+
+    rows = {}
+    for i, record in enumerate(records):
+        chapter = chapter_for_page(record['metadata']['page'], chapter_index)
+        rows.setdefault(chapter, []).append(i)
+
+    partitions = {
+        chapter: (matrix[ids], [records[i] for i in ids])
+        for chapter, ids in rows.items()
+    }
+    return vectorizer, matrix, records, partitions
+
+def retrieve_text(query, index, chapter=None, k=3):
+    vectorizer, matrix, records, partitions = index
+    if chapter is not None and chapter in partitions:
+        matrix, records = partitions[chapter]
+
+    scores = linear_kernel(vectorizer.transform([query]), matrix)[0]
+    top = scores.argsort()[::-1][:k]
+    return [dict(records[i], score=float(scores[i])) for i in top]
+
+if __name__ == "__main__":
+    records = to_records(read_chunks(CHUNK_STORE_PATH, columns=['text', 'page_start', 'chunk_index']))
+    index = build_partitions(records, load_chapter_index())
+
+    query = "Qual é a opinião de Carl Sagan sobre a possibilidade de formas de vida baseadas em elementos diferentes do carbono e água?"
+    for result in retrieve_text(query, index, chapter=2):
+        print(result['metadata'], round(result['score'], 3), result['text'][:80])
@@ -33,9 +33,23 @@ def cmp(a, b):
 from builtins import zip
 from builtins import str
 
+import hashlib
+import json
 import os
 import os.path as op
 import sys
+import tempfile
+import threading
+import time
+from concurrent import futures
+
+try:
+    import queue
+    from urllib.parse import quote, urlencode, urlparse
+except ImportError:
+    import Queue as queue
+    from urllib import quote, urlencode
+    from urlparse import urlparse
 
 from xml.etree import cElementTree as ET
 import pyxnat
@@ -261,6 +275,39 @@ PROC_ATTRS = [
 ]
 
 
+ATTRS_BY_TYPE = {
+    'xnat:projectData': PROJ_ATTRS,
+    'xnat:subjectData': SUBJ_ATTRS,
+    'xnat:mrSessionData': MR_EXP_ATTRS,
+    'xnat:petSessionData': PET_EXP_ATTRS,
+    'xnat:ctSessionData': CT_EXP_ATTRS,
+    'xnat:mrScanData': MR_SCAN_ATTRS,
+    'xnat:petScanData': PET_SCAN_ATTRS,
+    'xnat:ctScanData': CT_SCAN_ATTRS,
+    'xnat:scScanData': SC_SCAN_ATTRS,
+    'proc:genProcData': PROC_ATTRS,
+    'xnat:otherDicomScanData': OTHER_DICOM_SCAN_ATTRS,
+}
+
+NAMESPACES = {
+    'xnat': 'http://nrg.wustl.edu/xnat',
+    'proc': 'http://nrg.wustl.edu/proc',
+    'prov': 'http://www.nbirn.net/prov',
+    'fs': 'http://nrg.wustl.edu/fs',
+}
+for _prefix, _uri in NAMESPACES.items():
+    ET.register_namespace(_prefix, _uri)
+
+XSI_TYPE = '{http://www.w3.org/2001/XMLSchema-instance}type'
+XNAT_SCAN = '{http://nrg.wustl.edu/xnat}scan'
+XNAT_SCANS = '{http://nrg.wustl.edu/xnat}scans'
+
+# Children of the root that must not be uploaded with the object itself
+STRIPPED_TAGS = frozenset('{http://nrg.wustl.edu/xnat}' + tag for tag in [
+    'sharing', 'out', 'imageSession_ID', 'subject_ID', 'image_session_ID',
+    'scans', 'assessors', 'resources', 'experiments'])
+
+
 def copy_attrs(src_obj, dest_obj, attr_list):
     """ Copies list of attributes form source to destination"""
     src_attrs = src_obj.attrs.mget(attr_list)
@@ -279,35 +326,361 @@ def copy_attrs(src_obj, dest_obj, attr_list):
 def copy_attributes(src_obj, dest_obj):
     '''Copy attributes from src to dest'''
     src_type = src_obj.datatype()
-    types = {'xnat:projectData': PROJ_ATTRS,
-             'xnat:subjectData': SUBJ_ATTRS,
-             'xnat:mrSessionData': MR_EXP_ATTRS,
-             'xnat:petSessionData': PET_EXP_ATTRS,
-             'xnat:ctSessionData': CT_EXP_ATTRS,
-             'xnat:mrScanData': MR_SCAN_ATTRS,
-             'xnat:petScanData': PET_SCAN_ATTRS,
-             'xnat:ctScanData': CT_SCAN_ATTRS,
-             'xnat:scScanData': SC_SCAN_ATTRS,
-             'proc:genProcData': PROC_ATTRS,
-             'xnat:otherDicomScanData': OTHER_DICOM_SCAN_ATTRS}
-
     try:
-        copy_attrs(src_obj, dest_obj, types[src_type])
+        copy_attrs(src_obj, dest_obj, ATTRS_BY_TYPE[src_type])
     except KeyError:
         print('ERROR:cannot copy attributes, unsupported datatype:' + src_type)
 
 
+def _compile_path(attr):
+    '''Split an xpath attribute into namespaced tags, dropping predicates'''
+    prefix, path = attr.split(':', 1)
+    namespace = '{%s}' % NAMESPACES[prefix]
+    steps = [step.split('[', 1)[0] for step in path.split('/')[1:]]
+    return [(namespace + step, step) for step in steps]
+
+
+_COMPILED_PATHS = dict(
+    (attr, _compile_path(attr))
+    for attrs in ATTRS_BY_TYPE.values() for attr in attrs)
+
+
+def xml_attrs(elem, datatype):
+    '''
+    Read the attributes copied for datatype from an element of an XNAT xml
+    document. Each step is a child element or, for the last one, an xml
+    attribute (e.g. scanner/manufacturer, voxelRes/x). Missing values are
+    left out.'''
+    values = {}
+    for attr in ATTRS_BY_TYPE.get(datatype, []):
+        node = elem
+        value = None
+        steps = _COMPILED_PATHS[attr]
+        for i, (tag, name) in enumerate(steps):
+            child = node.find(tag)
+            if child is not None:
+                node = child
+                if i == len(steps) - 1:
+                    value = child.text
+            elif i == len(steps) - 1:
+                value = node.get(name)
+            else:
+                break
+        if value is not None and value.strip():
+            values[attr] = value.strip()
+    return values
+
+
+def session_metadata(sess_root):
+    '''
+    Datatype and attributes of a session and of all its scans, taken from
+    the session xml already downloaded for the upload, so no extra request
+    is made per scan. Returns (sess_meta, {scan_id: scan_meta}).'''
+    sess_type = sess_root.get(XSI_TYPE, '')
+    sess_meta = (sess_type, xml_attrs(sess_root, sess_type))
+    scans = {}
+    for scan in sess_root.iterfind('%s/%s' % (XNAT_SCANS, XNAT_SCAN)):
+        scan_type = scan.get(XSI_TYPE) or 'xnat:otherDicomScanData'
+        scans[scan.get('ID')] = (scan_type, xml_attrs(scan, scan_type))
+    return sess_meta, scans
+
+
+def create_with_attrs(dest_obj, datatype, attrs):
+    '''Create dest_obj and set its attributes in a single PUT'''
+    query = [('xsiType', datatype)] + sorted(attrs.items())
+    dest_obj._intf._exec('%s?%s' % (dest_obj._uri, urlencode(query)), 'PUT')
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class DiskBudget(object):
+    '''
+    Caps the bytes staged in the local cache at once. Transfers reserve
+    their size before downloading and block until enough is released.
+    '''
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.cond = threading.Condition()
+
+    def reserve(self, nbytes):
+        '''
+        Returns False if nbytes can never fit, or is unknown (None) while a
+        budget is set, so the caller can stream'''
+        if self.max_bytes is None:
+            return True
+        if nbytes is None or nbytes > self.max_bytes:
+            return False
+        with self.cond:
+            while self.used + nbytes > self.max_bytes:
+                self.cond.wait()
+            self.used += nbytes
+        return True
+
+    def release(self, nbytes):
+        if self.max_bytes is None:
+            return
+        with self.cond:
+            self.used -= nbytes
+            self.cond.notify_all()
+
+
+class TransferJournal(object):
+    '''
+    Persistent record of every file and resource transfer: size, md5
+    checksum and status (sent, then ok, partial or failed). Entries are appended as
+    JSON lines, so a run that dies halfway leaves a usable journal; on load
+    the last entry per key wins. Reruns skip keys already verified.
+    '''
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.run = {'ok': 0, 'skipped': 0, 'partial': 0, 'failed': 0}
+        self.run_bytes = 0
+        self.run_failures = []
+        self.lock = threading.Lock()
+        if path and op.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry['key']] = entry
+
+    @property
+    def resume(self):
+        return self.path is not None
+
+    def is_verified(self, key, size=None):
+        entry = self.entries.get(key)
+        if entry is None or entry['status'] != 'ok':
+            return False
+        return not size or entry.get('size') == size
+
+    def mark_verified(self, key, size):
+        '''
+        Note a file found complete at the destination, without a transfer.
+        It is journaled too, so the next resume skips it without a check'''
+        with self.lock:
+            if key in self.entries and self.entries[key]['status'] == 'ok':
+                return
+            self._append({'key': key, 'status': 'ok', 'size': size,
+                          'checksum': None, 'time': time.time()})
+
+    def sent(self, key, size, checksum):
+        '''
+        Journal an upload as soon as it returns, before the resource is
+        verified, so a crash midway through a large resource keeps it. The
+        entry does not count as verified and is not a run outcome.'''
+        with self.lock:
+            self._append({'key': key, 'status': 'sent', 'size': size,
+                          'checksum': checksum, 'time': time.time()})
+
+    def skip(self, key):
+        with self.lock:
+            self.run['skipped'] += 1
+        print('INFO:already verified, skipping:%s' % key)
+
+    def record(self, key, status, size=0, checksum=None, error=None):
+        entry = {'key': key, 'status': status, 'size': size,
+                 'checksum': checksum, 'time': time.time()}
+        if error:
+            entry['error'] = error
+        with self.lock:
+            self._append(entry)
+            self.run[status] += 1
+            if status == 'ok':
+                self.run_bytes += size
+            else:
+                self.run_failures.append({'key': key, 'status': status,
+                                          'error': error})
+
+    def _append(self, entry):
+        '''Store an entry and append it to the journal file; holds the lock'''
+        self.entries[entry['key']] = entry
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+
+    def summary(self):
+        with self.lock:
+            return dict(self.run, bytes=self.run_bytes,
+                        failures=list(self.run_failures))
+
+
+class TransferSettings(object):
+    '''How files move between the two XNATs; configured once in main'''
+    def __init__(self, stream=False, budget=None, buffer_chunks=8,
+                 journal=None):
+        self.stream = stream
+        self.budget = budget or DiskBudget()
+        self.buffer_chunks = buffer_chunks
+        self.journal = journal or TransferJournal()
+
+
+SETTINGS = TransferSettings()
+
+
+class BoundedPipe(object):
+    '''
+    Feeds a download into an upload through a bounded buffer of chunks. A
+    reader thread keeps downloading while the upload consumes, and blocks
+    once the buffer is full, so memory use is buffer_chunks * CHUNK_SIZE.
+    '''
+    def __init__(self, chunks, max_chunks=8):
+        self.buffer = queue.Queue(maxsize=max_chunks)
+        self.closed = threading.Event()
+        self.error = None
+        self.nbytes = 0
+        self.md5 = hashlib.md5()
+        self.thread = threading.Thread(target=self._fill, args=(chunks,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.closed.is_set():
+            try:
+                self.buffer.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _fill(self, chunks):
+        try:
+            for chunk in chunks:
+                if chunk:
+                    self._put(chunk)
+        except Exception as error:
+            self.error = error
+        finally:
+            self._put(None)
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self.buffer.get()
+                if chunk is None:
+                    break
+                self.nbytes += len(chunk)
+                self.md5.update(chunk)
+                yield chunk
+        finally:
+            self.closed.set()
+        if self.error is not None:
+            raise self.error
+
+
+def file_listing(xnat_r):
+    '''
+    {name: (size, digest)} for every file of a resource, from a single
+    /files listing. Sizes the server does not report and missing md5
+    digests are None; an unreadable listing is empty.'''
+    try:
+        rows = xnat_r._intf._get_json(xnat_r._uri + '/files?format=json')
+    except Exception:
+        return {}
+    listing = {}
+    for row in rows:
+        try:
+            size = int(row['Size']) if row.get('Size') else None
+        except ValueError:
+            size = None
+        listing[row['Name']] = (size, row.get('digest') or None)
+    return listing
+
+
+def _md5_file(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def verify_file(dest_file, nbytes, checksum, src_size=0):
+    '''
+    Check a copied file against what was sent and what the source declared.
+    dest_file is the (size, digest) entry of the destination listing.
+    Returns (status, error) for the journal.'''
+    if src_size and nbytes != src_size:
+        return 'partial', 'sent %d of %d bytes' % (nbytes, src_size)
+    if dest_file is None:
+        return 'partial', 'missing at destination'
+    dest_size, dest_digest = dest_file
+    if dest_size and dest_size != nbytes:
+        return 'partial', 'destination has %d of %d bytes' % (dest_size,
+                                                               nbytes)
+    if dest_digest and dest_digest != checksum:
+        return 'failed', 'checksum mismatch'
+    return 'ok', None
+
+
+def _stream(src_uri, src_intf, dest_uri, dest_intf):
+    '''
+    Pipe a GET on the source straight into a PUT on the destination.
+    Returns the number of bytes and the md5 of what was sent.'''
+    response = src_intf.get(src_uri, stream=True)
+    response.raise_for_status()
+    pipe = BoundedPipe(response.iter_content(CHUNK_SIZE),
+                       SETTINGS.buffer_chunks)
+    result = dest_intf.put(dest_uri, data=iter(pipe))
+    result.raise_for_status()
+    return pipe.nbytes, pipe.md5.hexdigest()
+
+
+def stream_file(src_f, dest_r):
+    '''Copy a file without staging it on local disk'''
+    f_label = src_f.label()
+    f_in_attrs = src_f.attributes()
+    params = [('inbody', 'true')]
+    for key, name in [('file_format', 'format'), ('file_content', 'content')]:
+        if f_in_attrs.get(key):
+            params.append((name, f_in_attrs.get(key)))
+    dest_uri = '%s/files/%s?%s' % (dest_r._uri, quote(f_label),
+                                   urlencode(params))
+    return _stream(src_f._uri, src_f._intf, dest_uri, dest_r._intf)
+
+
+def stream_res_zip(src_r, dest_r):
+    '''Copy a resource as one zip without staging it on local disk'''
+    src_uri = src_r._uri + '/files?format=zip'
+    dest_uri = '%s/files/%s.zip?extract=true&inbody=true' % (
+        dest_r._uri, quote(src_r.label()))
+    return _stream(src_uri, src_r._intf, dest_uri, dest_r._intf)
+
+
 def subj_compare(item1, item2):
     '''Compare sort of items'''
     return cmp(item1.label(), item2.label())
 
 
-def copy_file(src_f, dest_r, cache_d):
+def copy_file(src_f, dest_r, cache_d, src_size=None):
     '''
     Copy file from XNAT file source to XNAT resource destination,
-    using local cache in between'''
+    using local cache in between, or streaming if configured (or if the file
+    is larger than the whole cache budget, or its size is unknown while a
+    budget is set). src_size comes from the source resource listing. Returns (nbytes, md5) of what was sent, to be verified
+    against the destination listing, or None if skipped or failed'''
     f_label = src_f.label()
     loc_f = cache_d + '/' + f_label
+    journal = SETTINGS.journal
+    key = '%s/files/%s' % (dest_r._uri, f_label)
+
+    if journal.is_verified(key, src_size):
+        journal.skip(key)
+        return None
+
+    f_size = 0 if SETTINGS.stream else src_size
+    if SETTINGS.stream or not SETTINGS.budget.reserve(f_size):
+        try:
+            nbytes, checksum = stream_file(src_f, dest_r)
+            journal.sent(key, nbytes, checksum)
+            return nbytes, checksum
+        except Exception:
+            print("ERROR:failed to stream file:%s, error=%s"
+                  % (f_label, sys.exc_info()[0]))
+            journal.record(key, 'failed', error=str(sys.exc_info()[1]))
+        return None
 
     # Make subdirectories
     loc_d = op.dirname(loc_f)
@@ -315,9 +688,12 @@ def copy_file(src_f, dest_r, cache_d):
         os.makedirs(loc_d)
 
     try:
-        # Download file
-        if op.exists(loc_f) is False:
-            src_f.get(loc_f)
+        # Download file (a leftover copy may be partial, so fetch again)
+        if op.exists(loc_f):
+            os.remove(loc_f)
+        src_f.get(loc_f)
+        nbytes = op.getsize(loc_f)
+        checksum = _md5_file(loc_f)
 
         # Get File Attributes
         f_in_attrs = src_f.attributes()
@@ -335,18 +711,44 @@ def copy_file(src_f, dest_r, cache_d):
         else:                                             # none
             dest_r.file(f_label).put(loc_f)
 
+        journal.sent(key, nbytes, checksum)
+
         # Delete local copy
         os.remove(loc_f)
+        return nbytes, checksum
     except Exception:
         print("ERROR:failed to copy file:%s, error=%s"
               % (f_label, sys.exc_info()[0]))
+        journal.record(key, 'failed', error=str(sys.exc_info()[1]))
+        return None
+    finally:
+        SETTINGS.budget.release(f_size)
 
 
-def copy_res_zip(src_r, dest_r, cache_d):
+def copy_res_zip(src_r, dest_r, cache_d, src_files=None):
     '''
     Copy a resource from XNAT source to XNAT destination using local cache
-    in between
+    in between, or streaming if configured. The resource size is only
+    needed, and only listed, when the cache has a budget.
     '''
+    if SETTINGS.stream:
+        print('INFO:Streaming resource as zip...')
+        stream_res_zip(src_r, dest_r)
+        return
+
+    res_size = 0
+    if SETTINGS.budget.max_bytes is not None:
+        if src_files is None:
+            src_files = file_listing(src_r)
+        sizes = [size for size, _ in src_files.values()]
+        # A file of unknown size makes the whole zip unknown: stream it
+        res_size = None if None in sizes or not sizes else sum(sizes)
+    if not SETTINGS.budget.reserve(res_size):
+        print('INFO:Resource larger than cache budget, streaming as zip...')
+        stream_res_zip(src_r, dest_r)
+        return
+
+    cache_z = None
     try:
         # Download zip of resource
         print('INFO:Downloading resource as zip...')
@@ -362,6 +764,57 @@ def copy_res_zip(src_r, dest_r, cache_d):
     except IndexError:
         print('ERROR:failed to copy:%s:%s' % (cache_z, sys.exc_info()[0]))
         raise
+    finally:
+        SETTINGS.budget.release(res_size or 0)
+
+
+def file_matches(src_file, dest_file):
+    '''
+    Compare the (size, digest) listing entries of a source and destination
+    file: False if the destination is missing or differs in a size or digest
+    both sides report, None if there was nothing to compare, else True'''
+    if dest_file is None:
+        return False
+    compared = False
+    for src_value, dest_value in zip(src_file or (None, None), dest_file):
+        if src_value is not None and dest_value is not None:
+            if src_value != dest_value:
+                return False
+            compared = True
+    return True if compared else None
+
+
+def verify_resource(src_r, dest_r, src_files=None, sent=None):
+    '''
+    Compare the file listings (names, sizes and md5 digests) of a source and
+    destination resource, one listing each. Files in sent ({name: (nbytes,
+    md5)}) were just copied and are journaled with their verification
+    status; every other file that matches is journaled as verified.
+    Returns (status, error).'''
+    journal = SETTINGS.journal
+    if src_files is None:
+        src_files = file_listing(src_r)
+    dest_files = file_listing(dest_r)
+    sent = sent or {}
+    missing = []
+    for f_label, (src_size, src_digest) in sorted(src_files.items()):
+        key = '%s/files/%s' % (dest_r._uri, f_label)
+        if f_label in sent:
+            nbytes, checksum = sent[f_label]
+            status, error = verify_file(dest_files.get(f_label), nbytes,
+                                        checksum, src_size)
+            journal.record(key, status, nbytes, checksum, error)
+            if status != 'ok':
+                missing.append(f_label)
+            continue
+        if file_matches((src_size, src_digest),
+                        dest_files.get(f_label)) is False:
+            missing.append(f_label)
+            continue
+        journal.mark_verified(key, src_size)
+    if missing:
+        return 'partial', '%d files missing or incomplete' % len(missing)
+    return 'ok', None
 
 
 def is_empty_resource(_res):
@@ -436,20 +889,138 @@ def is_empty_resource(_res):
 #         copy_session(src_sess, dst_sess, sess_cache_dir)
 
 
-def copy_session(src_sess, dst_sess, sess_cache_dir):
-    '''Copy XNAT session from source to destination'''
+class TransferQueue(object):
+    '''
+    Runs scan and resource transfers on a bounded thread pool and reports
+    progress as each one finishes. With parallel=1 every transfer runs inline,
+    in submission order, exactly like the serial mirror.
+    '''
+    def __init__(self, parallel=1):
+        self.parallel = parallel
+        self.executor = None
+        if parallel > 1:
+            self.executor = futures.ThreadPoolExecutor(max_workers=parallel)
+        self.futures = []
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.finished = 0
+        self.failed = []
+
+    def submit(self, label, func, *args, **kwargs):
+        '''Queue a transfer; a task may itself submit dependent transfers'''
+        with self.lock:
+            self.submitted += 1
+        if self.executor is None:
+            self._run(label, func, args, kwargs)
+            return
+        future = self.executor.submit(self._run, label, func, args, kwargs)
+        with self.lock:
+            self.futures.append(future)
+
+    def _run(self, label, func, args, kwargs):
+        start = time.time()
+        try:
+            func(*args, **kwargs)
+            status = 'finished'
+        except Exception:
+            status = 'FAILED'
+            with self.lock:
+                self.failed.append(label)
+            print('ERROR:transfer failed:%s, error=%s'
+                  % (label, sys.exc_info()[1]))
+        with self.lock:
+            self.finished += 1
+            done, total = self.finished, self.submitted
+        print('INFO:[%d/%d] %s %s (%.1fs)'
+              % (done, total, status, label, time.time() - start))
+
+    def wait(self):
+        '''Block until every transfer, including ones queued later, is done'''
+        while True:
+            with self.lock:
+                pending = [f for f in self.futures if not f.done()]
+            if not pending:
+                break
+            futures.wait(pending)
+        if self.executor is not None:
+            self.executor.shutdown()
+        return len(self.failed)
+
+
+class HostLimiter(object):
+    '''
+    Caps the concurrent requests sent to each XNAT host. limit_connections
+    wraps the request methods of a pyxnat Interface; interfaces pointing at
+    the same host share one limit (File.put uploads through post). Nested
+    calls in a thread take a single slot. A streamed download holds its
+    slot only while the request is opened.
+    '''
+    _limiters = {}
+    _lock = threading.Lock()
+
+    def __init__(self, max_connections):
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.local = threading.local()
+
+    @classmethod
+    def for_host(cls, host, max_connections):
+        with cls._lock:
+            if host not in cls._limiters:
+                cls._limiters[host] = cls(max_connections)
+            return cls._limiters[host]
+
+    def wrap(self, func):
+        def limited(*args, **kwargs):
+            depth = getattr(self.local, 'depth', 0)
+            if depth == 0:
+                self.slots.acquire()
+            self.local.depth = depth + 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.local.depth = depth
+                if depth == 0:
+                    self.slots.release()
+        return limited
+
+
+def limit_connections(intf, max_connections):
+    '''Limit concurrent requests from intf to its host'''
+    if not max_connections:
+        return intf
+    host = urlparse(intf._server).netloc
+    limiter = HostLimiter.for_host(host, max_connections)
+    for name in ('_exec', 'get', 'put', 'post'):
+        if hasattr(intf, name):
+            setattr(intf, name, limiter.wrap(getattr(intf, name)))
+    return intf
+
+
+def copy_session(src_sess, dst_sess, sess_cache_dir, transfers=None):
+    '''
+    Copy XNAT session from source to destination. The session is created
+    before any scan is queued, and each scan is created before its resources
+    are queued, so those ordering constraints hold in parallel mode too.
+    '''
+    own_transfers = transfers is None
+    if own_transfers:
+        transfers = TransferQueue()
 
     print('INFO:uploading session attributes as xml')
     # Write xml to file
     if not op.exists(sess_cache_dir):
         os.makedirs(sess_cache_dir)
-    sess_xml = src_sess.get()
+    sess_root = ET.fromstring(src_sess.get())
+    (sess_type, sess_attrs), scan_meta = session_metadata(sess_root)
     xml_path = op.join(sess_cache_dir, 'sess.xml')
-    write_xml(sess_xml, xml_path)
+    write_xml(sess_root, xml_path)
 
-    sess_type = src_sess.datatype()
-    dst_sess.create(experiments=sess_type)
-    copy_attributes(src_sess, dst_sess)
+    if sess_type in ATTRS_BY_TYPE:
+        create_with_attrs(dst_sess, sess_type, sess_attrs)
+    else:
+        sess_type = src_sess.datatype()
+        dst_sess.create(experiments=sess_type)
+        copy_attributes(src_sess, dst_sess)
 
     # Process each scan of session
     for src_scan in src_sess.scans().fetchall('obj'):
@@ -458,7 +1029,9 @@ def copy_session(src_sess, dst_sess, sess_cache_dir):
         print('INFO:Processing scan:%s...' % scan_label)
         dst_scan = dst_sess.scan(scan_label)
         scan_cache_dir = op.join(sess_cache_dir, scan_label)
-        copy_scan(src_scan, dst_scan, scan_cache_dir)
+        transfers.submit('scan:%s' % scan_label, copy_scan,
+                         src_scan, dst_scan, scan_cache_dir, transfers,
+                         scan_meta.get(scan_label))
 
     # Process each assessor of session
     for src_assr in src_sess.assessors():
@@ -477,17 +1050,30 @@ def copy_session(src_sess, dst_sess, sess_cache_dir):
 
         res_cache_dir = op.join(sess_cache_dir, res_label)
 
-        copy_res(src_res, dst_res, res_cache_dir, use_zip=True)
+        transfers.submit('resource:%s' % res_label, copy_res,
+                         src_res, dst_res, res_cache_dir, use_zip=True)
 
+    if own_transfers:
+        transfers.wait()
 
-def copy_scan(src_scan, dst_scan, scan_cache_dir):
-    '''Copy scan from source XNAT to destination XNAT'''
 
-    scan_type = src_scan.datatype()
-    if scan_type == '':
-        scan_type = 'xnat:otherDicomScanData'
-    dst_scan.create(scans=scan_type)
-    copy_attributes(src_scan, dst_scan)
+def copy_scan(src_scan, dst_scan, scan_cache_dir, transfers=None,
+              meta=None):
+    '''
+    Copy scan from source XNAT to destination XNAT. meta is the scan's
+    (datatype, attributes) from session_metadata; without it they are
+    fetched from the source scan.'''
+    if transfers is None:
+        transfers = TransferQueue()
+
+    if meta is not None and meta[0] in ATTRS_BY_TYPE:
+        create_with_attrs(dst_scan, *meta)
+    else:
+        scan_type = src_scan.datatype()
+        if scan_type == '':
+            scan_type = 'xnat:otherDicomScanData'
+        dst_scan.create(scans=scan_type)
+        copy_attributes(src_scan, dst_scan)
 
     # Process each resource of scan
     for src_res in src_scan.resources().fetchall('obj'):
@@ -498,14 +1084,22 @@ def copy_scan(src_scan, dst_scan, scan_cache_dir):
         dst_res = dst_scan.resource(res_label)
 
         res_cache_dir = op.join(scan_cache_dir, res_label)
-        if res_label == 'SNAPSHOTS':
-            copy_res(src_res, dst_res, res_cache_dir)
-        else:
-            copy_res(src_res, dst_res, res_cache_dir, use_zip=True)
+        label = 'resource:%s/%s' % (src_scan.label(), res_label)
+        transfers.submit(label, copy_res, src_res, dst_res, res_cache_dir,
+                         use_zip=(res_label != 'SNAPSHOTS'))
 
 
 def copy_res(src_res, dst_res, res_cache_dir, use_zip=False):
-    '''Copy resource from source XNAT to destination XNAT'''
+    '''
+    Copy resource from source XNAT to destination XNAT. When resuming from
+    a journal, a non-empty destination is completed file by file instead
+    of being skipped.'''
+    journal = SETTINGS.journal
+    res_key = dst_res._uri
+    if journal.is_verified(res_key):
+        journal.skip(res_key)
+        return
+
     # Create cache dir
     if not op.exists(res_cache_dir):
         os.makedirs(res_cache_dir)
@@ -524,31 +1118,57 @@ def copy_res(src_res, dst_res, res_cache_dir, use_zip=False):
         print('WARN:empty resource, nothing to copy')
         return
 
-    if is_empty:
-        if use_zip:
+    if is_empty or journal.resume:
+        # One source listing gives every size and digest for this resource
+        src_files = file_listing(src_res)
+        if use_zip and is_empty:
             # Try to copy as zip
-            try:
-                print('INFO:Copying resource as zip: %s...' % src_res.label())
-                copy_res_zip(src_res, dst_res, res_cache_dir)
-                return
-            except Exception:
+            attempts = ['INFO:Copying resource as zip: %s...',
+                        'INFO: second attempt to copy resource as zip: %s...']
+            for attempt in attempts:
                 try:
-                    print('INFO: second attempt to copy resource as zip: %s...'
-                          % src_res.label())
-                    copy_res_zip(src_res, dst_res, res_cache_dir)
-                    return
+                    print(attempt % src_res.label())
+                    copy_res_zip(src_res, dst_res, res_cache_dir, src_files)
                 except Exception:
-                    msg = 'ERROR:failed twice to copy resource as zip, will'\
-                        'copy individual files'
-                    print(msg)
+                    continue
+                status, error = verify_resource(src_res, dst_res, src_files)
+                if status == 'ok':
+                    journal.record(res_key, status)
+                    return
+                print('WARN:resource incomplete after zip copy: %s' % error)
+                break
+            else:
+                msg = 'ERROR:failed twice to copy resource as zip, will'\
+                    'copy individual files'
+                print(msg)
+
+        # On resume, files already complete at the destination (same name,
+        # size and md5) are journaled and skipped instead of sent again
+        dest_files = {}
+        if journal.resume and not is_empty:
+            dest_files = file_listing(dst_res)
 
         copy_count = 0
+        sent = {}
         for f in src_res.files():
-            print('INFO:Copying file: %s...' % f.label())
+            f_label = f.label()
+            src_file = src_files.get(f_label)
+            if file_matches(src_file, dest_files.get(f_label)):
+                f_key = '%s/files/%s' % (dst_res._uri, f_label)
+                journal.mark_verified(f_key, src_file[0])
+                journal.skip(f_key)
+                continue
+            print('INFO:Copying file: %s...' % f_label)
             copy_count += 1
-            copy_file(f, dst_res, res_cache_dir)
+            result = copy_file(f, dst_res, res_cache_dir,
+                               (src_file or (None, None))[0])
+            if result is not None:
+                sent[f_label] = result
         print('INFO:Finished copying resource, %d files copied' % copy_count)
 
+        status, error = verify_resource(src_res, dst_res, src_files, sent)
+        journal.record(res_key, status, error=error)
+
 
 # def copy_assr(src_assr, dst_assr, assr_cache_dir):
 #     '''Copy assessor from source XNAT to destination XNAT'''
@@ -582,9 +1202,11 @@ def copy_res(src_res, dst_res, res_cache_dir, use_zip=False):
 #             copy_res(src_res, dst_res, res_cache_dir, use_zip=True)
 
 
-def write_xml(xml_str, file_path, clean_tags=True):
-    """Writing XML."""
-    root = ET.fromstring(xml_str)
+def write_xml(xml, file_path, clean_tags=True):
+    """
+    Writing XML. xml is a string or an already parsed root element, which
+    is modified in place when clean_tags is set."""
+    root = xml if ET.iselement(xml) else ET.fromstring(xml)
 
     # We only want the tags and attributes relevant to root, no children
     if clean_tags:
@@ -592,56 +1214,11 @@ def write_xml(xml_str, file_path, clean_tags=True):
         if 'ID' in root.attrib:
             del root.attrib['ID']
 
-        # Remove sharing tags
-        tag = '{http://nrg.wustl.edu/xnat}sharing'
-        for child in root.findall(tag):
-            root.remove(child)
-
-        # Remove out
-        for child in root.findall('{http://nrg.wustl.edu/xnat}out'):
-            root.remove(child)
-            break
-
-        # Remove session ID
-        tag = '{http://nrg.wustl.edu/xnat}imageSession_ID'
-        for child in root.findall(tag):
-            root.remove(child)
-
-        # Remove subject ID
-        for child in root.findall('{http://nrg.wustl.edu/xnat}subject_ID'):
-            root.remove(child)
-
-        # Remove _session ID
-        tag = '{http://nrg.wustl.edu/xnat}image_session_ID'
-        for child in root.findall(tag):
-            root.remove(child)
-
-        # Remove scans
-        for child in root.findall('{http://nrg.wustl.edu/xnat}scans'):
-            root.remove(child)
-            break
-
-        # Remove assessors
-        for child in root.findall('{http://nrg.wustl.edu/xnat}assessors'):
-            root.remove(child)
-            break
-
-        # Remove resources
-        for child in root.findall('{http://nrg.wustl.edu/xnat}resources'):
-            root.remove(child)
-            break
-
-        # Remove experiments
-        for child in root.findall('{http://nrg.wustl.edu/xnat}experiments'):
-            root.remove(child)
-            break
+        # Remove sharing, ids, scans, assessors, resources... in one pass
+        root[:] = [child for child in root if child.tag not in STRIPPED_TAGS]
 
     try:
         # Write to file
-        ET.register_namespace('xnat', 'http://nrg.wustl.edu/xnat')
-        ET.register_namespace('proc', 'http://nrg.wustl.edu/proc')
-        ET.register_namespace('prov', 'http://www.nbirn.net/prov')
-        ET.register_namespace('fs', 'http://nrg.wustl.edu/fs')
         ET.ElementTree(root).write(file_path)
     except IOError as error:
         print('ERROR:writing xml file: {}: {}'.format(file_path, str(error)))
@@ -661,12 +1238,48 @@ def create_parser():
     arg_parser.add_argument(
         '--h2', '--dest_config', dest='dest_config', required=True,
         help='Destination XNAT configuration file')
-    arg_parser.add_argument(
-        '-e', '--experiment_id', required=True,
-        help='Which resource to download? (Entity name/identifier)')
+    sources = arg_parser.add_mutually_exclusive_group(required=True)
+    sources.add_argument(
+        '-e', '--experiment_id', action='append',
+        help='Which resource to download? (Entity name/identifier)\n'
+             'May be repeated to mirror several sessions')
+    sources.add_argument(
+        '--experiments_file', dest='experiments_file',
+        help='File with one experiment id per line')
+    sources.add_argument(
+        '--source_project', dest='source_project',
+        help='Mirror every session of this source project')
     arg_parser.add_argument(
         '-p', '--project_id', dest='project_id', required=True,
         help='Which project to store the resource in')
+    arg_parser.add_argument(
+        '-j', '--parallel', dest='parallel', type=int, default=1,
+        help='Number of scans/resources to transfer concurrently '
+             '(default: 1, serial)')
+    arg_parser.add_argument(
+        '--sessions', dest='sessions', type=int, default=1,
+        help='Number of sessions mirrored concurrently (default: 1)')
+    arg_parser.add_argument(
+        '--host_connections', dest='host_connections', type=int,
+        default=None,
+        help='Maximum concurrent requests per XNAT host (default: no limit)')
+    arg_parser.add_argument(
+        '--cache_dir', dest='cache_dir', default=tempfile.gettempdir(),
+        help='Local directory used to stage downloads (default: system temp)')
+    arg_parser.add_argument(
+        '--cache_max_mb', dest='cache_max_mb', type=float, default=None,
+        help='Maximum MB staged in the cache at once; larger transfers are '
+             'streamed (default: no limit)')
+    arg_parser.add_argument(
+        '--stream', dest='stream', action='store_true', default=False,
+        help='Pipe downloads straight into uploads without local staging')
+    arg_parser.add_argument(
+        '--journal', dest='journal', default=None,
+        help='Transfer journal file; reruns skip verified files and retry '
+             'only failed or partial ones')
+    arg_parser.add_argument(
+        '--summary', dest='summary', default=None,
+        help='Write the JSON run summary to this file (always printed)')
     arg_parser.add_argument(
         '-v', '--verbose', dest='verbose', action='store_true', default=False,
         help='Display verbosal information (optional)', required=False)
@@ -674,26 +1287,132 @@ def create_parser():
     return arg_parser
 
 
-def main(args):
-    x1 = pyxnat.Interface(config=args.source_config)
-    x2 = pyxnat.Interface(config=args.dest_config)
+SESSION_COLUMNS = ['subject_label', 'label']
+
+
+def list_sessions(x1, args):
+    '''Source sessions to mirror: a whole project or a list of ids'''
+    if args.source_project:
+        return x1.array.experiments(project_id=args.source_project,
+                                    columns=SESSION_COLUMNS).data
+    experiment_ids = list(args.experiment_id or [])
+    if args.experiments_file:
+        with open(args.experiments_file) as f:
+            experiment_ids.extend(line.strip() for line in f if line.strip())
+    return [x1.array.experiments(experiment_id=experiment_id,
+                                 columns=SESSION_COLUMNS).data[0]
+            for experiment_id in experiment_ids]
+
+
+def existing_sessions(x2, project_id):
+    '''(subject, session) labels already in the destination, in one query'''
+    rows = x2.array.experiments(project_id=project_id,
+                                columns=SESSION_COLUMNS).data
+    return set((row['subject_label'], row['label']) for row in rows)
+
 
-    columns = ['subject_label', 'label']
-    e1 = x1.array.experiments(experiment_id=args.experiment_id,
-                              columns=columns).data[0]
+_SUBJECT_LOCK = threading.Lock()
+
+
+def mirror_session(x1, x2, e1, args):
+    '''Copy one listed session; returns the labels of failed transfers'''
     p = x2.select.project(args.project_id)
     s = p.subject(e1['subject_label'])
-    if not s.exists():
-        s.create()
+    # Sessions of the same subject may run concurrently
+    with _SUBJECT_LOCK:
+        if not s.exists():
+            s.create()
     e = s.experiment(e1['label'])
 
     src_sess = x1.select.project(e1['project']).subject(e1['subject_ID']).experiment(e1['ID'])
     dst_sess = e
 
-    copy_session(src_sess, dst_sess, '/tmp')
+    transfers = TransferQueue(args.parallel)
+    sess_cache_dir = op.join(args.cache_dir, e1['label'])
+    try:
+        copy_session(src_sess, dst_sess, sess_cache_dir, transfers)
+    finally:
+        transfers.wait()
+    if transfers.failed:
+        print('WARN:%s: %d transfers failed: %s'
+              % (e1['label'], len(transfers.failed),
+                 ', '.join(transfers.failed)))
+    return transfers.failed
+
+
+def mirror_sessions(x1, x2, sessions, args):
+    '''
+    Mirror sessions on a pool of args.sessions workers, each transferring
+    up to args.parallel scans/resources at once. Returns {label: status}.
+    '''
+    results = {}
+    lock = threading.Lock()
+
+    def run(e1):
+        label = e1['label']
+        try:
+            failed = mirror_session(x1, x2, e1, args)
+            status = 'partial' if failed else 'ok'
+        except Exception:
+            print('ERROR:session failed:%s, error=%s'
+                  % (label, sys.exc_info()[1]))
+            status = 'failed'
+        with lock:
+            results[label] = status
+            print('INFO:[%d/%d sessions] %s %s'
+                  % (len(results), len(sessions), status, label))
+
+    if args.sessions > 1 and len(sessions) > 1:
+        with futures.ThreadPoolExecutor(max_workers=args.sessions) as pool:
+            list(pool.map(run, sessions))
+    else:
+        for e1 in sessions:
+            run(e1)
+    return results
+
+
+def main(args):
+    x1 = limit_connections(pyxnat.Interface(config=args.source_config),
+                           args.host_connections)
+    x2 = limit_connections(pyxnat.Interface(config=args.dest_config),
+                           args.host_connections)
+
+    sessions = list_sessions(x1, args)
+    # With a journal, existing sessions may be partial and are completed
+    if args.journal is None:
+        existing = existing_sessions(x2, args.project_id)
+        skipped = [e1['label'] for e1 in sessions
+                   if (e1['subject_label'], e1['label']) in existing]
+        if skipped:
+            print('INFO:skipping %d sessions already in %s'
+                  % (len(skipped), args.project_id))
+        sessions = [e1 for e1 in sessions
+                    if (e1['subject_label'], e1['label']) not in existing]
+    else:
+        skipped = []
+
+    max_bytes = None
+    if args.cache_max_mb is not None:
+        max_bytes = int(args.cache_max_mb * 1024 * 1024)
+    SETTINGS.stream = args.stream
+    SETTINGS.budget = DiskBudget(max_bytes)
+    SETTINGS.journal = TransferJournal(args.journal)
+
+    results = mirror_sessions(x1, x2, sessions, args)
+
+    summary = SETTINGS.journal.summary()
+    summary['sessions'] = results
+    summary['sessions_skipped'] = skipped
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+    print(json.dumps(summary))
+    session_failed = any(status != 'ok' for status in results.values())
+    return 1 if session_failed or summary['failed'] or summary['partial'] \
+        else 0
 
 
 if __name__ == '__main__':
     parser = create_parser()
     arguments = parser.parse_args()
-    main(arguments)
+    sys.exit(main(arguments))
@@ -0,0 +1,298 @@
+"""
+Script para dividir o índice em shards por tenant e documento.
+
+Cada grupo (`tenant` ou `tenant/documento`) tem uma lista de shards de no
+máximo `shard_max_chunks` chunks: quando o shard atual enche, a ingestão abre
+o próximo. Assim o custo de busca e de reconstrução de cada shard fica
+limitado, qualquer que seja o tamanho total do corpus. Os shards são chunk
+stores locais (um índice TF-IDF por shard, carregado sob demanda e mantido num
+LRU) ou classes separadas no Weaviate. O `manifest.json` na raiz registra os
+grupos e o tamanho de cada shard.
+
+Uma consulta é enviada a todos os shards selecionados ao mesmo tempo, num
+pool de threads, e os top-k de cada um são combinados num top-k global. Com
+shards locais esse top-k é aproximado: os scores TF-IDF de shards diferentes
+vêm de vocabulários diferentes.
+
+    python shards.py ingest --tenant acme --document cosmos --input data/cosmos_data_for_weaviate.json
+    python shards.py query "vida baseada em silício" --tenant acme -k 5
+"""
+import argparse
+import heapq
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+
+from rag_config import get_config
+
+SHARD_ROOT = 'data/shards'
+MANIFEST_FILE = 'manifest.json'
+
+_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]*$')
+_EMPTY_CHAPTER_INDEX = {'chapters': [], 'pages': {}}
+
+
+def group_key(tenant, document=None):
+    for value in (tenant, document):
+        if value is not None and not _NAME.match(value):
+            raise ValueError('nome inválido para tenant/documento: %r' % value)
+    return tenant if document is None else '%s/%s' % (tenant, document)
+
+
+class LocalShards:
+    """Shards como chunk stores em `root/<tenant>/<documento>/shard-NNNN`."""
+
+    def __init__(self, root, chapter_index=None, cache_size=None):
+        self.root = root
+        self.chapter_index = chapter_index or _EMPTY_CHAPTER_INDEX
+        self.cache_size = cache_size or get_config().tunables.shard_cache_size
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self._building = {}
+
+    def shard_name(self, tenant, document, number):
+        return os.path.join(tenant, document or '_all', 'shard-%04d' % number)
+
+    def write(self, name, chunks):
+        from chunk_store import append_chunks
+        count = append_chunks(os.path.join(self.root, name), chunks)
+        with self._lock:
+            self._indexes.pop(name, None)
+        return count
+
+    def _index(self, name):
+        with self._lock:
+            if name in self._indexes:
+                self._indexes.move_to_end(name)
+                return self._indexes[name]
+            building = self._building.setdefault(name, threading.Lock())
+        # Um shard é montado uma vez só, mesmo com várias consultas chegando juntas
+        with building:
+            with self._lock:
+                if name in self._indexes:
+                    return self._indexes[name]
+            from chunk_store import read_chunks, to_records
+            from retrieve_text import build_partitions
+            records = to_records(read_chunks(os.path.join(self.root, name),
+                                             columns=['text', 'page_start', 'chunk_index']))
+            index = build_partitions(records, self.chapter_index)
+            with self._lock:
+                self._indexes[name] = index
+                while len(self._indexes) > self.cache_size:
+                    self._indexes.popitem(last=False)
+        return index
+
+    def search(self, name, query, k, chapter=None):
+        from retrieve_text import retrieve_text
+        return retrieve_text(query, self._index(name), chapter=chapter, k=k)
+
+
+class WeaviateShards:
+    """Shards como classes `<Classe>__<tenant>__<documento>_<N>` no Weaviate."""
+
+    def __init__(self, client=None, chapter_index=None):
+        self._client = client
+        self._lock = threading.Lock()
+        self.chapter_index = chapter_index or _EMPTY_CHAPTER_INDEX
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from query_weaviate import weaviate_client
+                self._client = weaviate_client()
+            return self._client
+
+    def shard_name(self, tenant, document, number):
+        # Classes só aceitam [A-Za-z0-9_]: `_` vira `_u` e `-` vira `_h`, e as
+        # partes são separadas por `__`, que o escape nunca produz. Assim
+        # `a-b` e `a`/`b` não caem na mesma classe.
+        parts = [tenant] + ([document] if document else [])
+        escaped = [part.replace('_', '_u').replace('-', '_h') for part in parts]
+        return '%s__%s_%d' % (get_config().weaviate.class_name, '__'.join(escaped), number)
+
+    def write(self, name, chunks):
+        from ingest_data import chunk_properties, class_obj
+        client = self.client()
+        if not client.schema.exists(name):
+            client.schema.create_class(dict(class_obj(), **{'class': name}))
+        client.batch.configure(batch_size=get_config().tunables.ingest_batch_size)
+        count = 0
+        with client.batch as batch:
+            for chunk in chunks:
+                properties = chunk_properties(chunk['text'], chunk['page_start'],
+                                              chunk['chunk_index'], self.chapter_index)
+                batch.add_data_object(properties, name, vector=chunk.get('embedding'))
+                count += 1
+        return count
+
+    def search(self, name, query, k, chapter=None):
+        from query_weaviate import query_weaviate
+        response = query_weaviate(query, client=self.client(), chapter=chapter, limit=k,
+                                  class_name=name, with_distance=True)
+        results = []
+        for item in response['data']['Get'][name]:
+            metadata = json.loads(item['metadata'])
+            results.append({'text': item['content'],
+                            'metadata': {'page': metadata['page'],
+                                         'chunk_index': metadata.get('chunk_index', 0)},
+                            'score': 1.0 - item['_additional']['distance']})
+        return results
+
+
+class ShardRouter:
+    """Roteia ingestão e consultas para os shards de cada tenant/documento."""
+
+    def __init__(self, root=SHARD_ROOT, backend=None, max_chunks=None, workers=None):
+        tunables = get_config().tunables
+        self.root = root
+        self.backend = backend or LocalShards(root)
+        self.max_chunks = max_chunks or tunables.shard_max_chunks
+        self.executor = ThreadPoolExecutor(max_workers=workers or tunables.shard_workers,
+                                           thread_name_prefix='shard')
+        self._lock = threading.Lock()  # uma ingestão por vez
+        self._manifest_lock = threading.Lock()  # leituras e mudanças do manifest
+        self.manifest = self._load_manifest()
+
+    def _manifest_path(self):
+        return os.path.join(self.root, MANIFEST_FILE)
+
+    def _load_manifest(self):
+        if not os.path.exists(self._manifest_path()):
+            return {'groups': {}}
+        with open(self._manifest_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_manifest(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self._manifest_path() + '.tmp'
+        with self._manifest_lock:
+            text = json.dumps(self.manifest, indent=2)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, self._manifest_path())
+
+    def _open_shard(self, tenant, document):
+        """O último shard do grupo, ou um novo se ele estiver cheio."""
+        with self._manifest_lock:
+            group = self.manifest['groups'].setdefault(
+                group_key(tenant, document), {'tenant': tenant, 'document': document,
+                                              'shards': []})
+            shards = group['shards']
+            if not shards or shards[-1]['rows'] >= self.max_chunks:
+                shards.append({'name': self.backend.shard_name(tenant, document, len(shards)),
+                               'rows': 0})
+            return shards[-1]
+
+    def ingest(self, tenant, chunks, document=None):
+        """Grava `chunks` nos shards do grupo, abrindo shards novos quando enchem."""
+        group_key(tenant, document)
+        chunks = iter(chunks)
+        total = 0
+        with self._lock:
+            while True:
+                first = next(chunks, None)
+                if first is None:
+                    break
+                shard = self._open_shard(tenant, document)
+                room = self.max_chunks - shard['rows']
+                written = self.backend.write(shard['name'],
+                                             chain([first], islice(chunks, room - 1)))
+                with self._manifest_lock:
+                    shard['rows'] += written
+                total += written
+                self._save_manifest()
+        return total
+
+    def shards(self, tenants=None, documents=None):
+        """(grupo, shard) de todos os shards dos tenants/documentos pedidos.
+
+        Devolve cópias tiradas sob o lock do manifest, que uma ingestão em
+        andamento pode estar alterando.
+        """
+        selected = []
+        with self._manifest_lock:
+            for group in self.manifest['groups'].values():
+                if tenants and group['tenant'] not in tenants:
+                    continue
+                if documents and group['document'] not in documents:
+                    continue
+                info = {'tenant': group['tenant'], 'document': group['document']}
+                selected.extend((info, dict(shard)) for shard in group['shards']
+                                if shard['rows'])
+        return selected
+
+    def _search_shard(self, group, shard, query, k, chapter):
+        return [dict(result, tenant=group['tenant'], document=group['document'],
+                     shard=shard['name'])
+                for result in self.backend.search(shard['name'], query, k, chapter)]
+
+    def search(self, query, k=3, tenants=None, documents=None, chapter=None):
+        """Consulta os shards em paralelo e devolve o top-k combinado.
+
+        O ranking entre shards é aproximado: cada shard local tem o próprio
+        vocabulário e IDF, então a mesma passagem teria scores TF-IDF um
+        pouco diferentes em outro shard; os scores são comparados como vêm.
+        """
+        futures = [self.executor.submit(self._search_shard, group, shard, query, k, chapter)
+                   for group, shard in self.shards(tenants, documents)]
+        results = chain.from_iterable(future.result() for future in futures)
+        return heapq.nlargest(k, results, key=lambda result: result['score'])
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def open_router(root=SHARD_ROOT, backend='local', chapter_index=None):
+    if backend == 'weaviate':
+        return ShardRouter(root, WeaviateShards(chapter_index=chapter_index))
+    return ShardRouter(root, LocalShards(root, chapter_index))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Sharded ingestion and fan-out queries.')
+    parser.add_argument('--root', default=SHARD_ROOT)
+    parser.add_argument('--backend', choices=('local', 'weaviate'), default='local')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    ingest = commands.add_parser('ingest', help='Route a JSON corpus to a tenant')
+    ingest.add_argument('--tenant', required=True)
+    ingest.add_argument('--document', default=None)
+    ingest.add_argument('--input', required=True,
+                        help='JSON array or JSON Lines in the cosmos_data_for_weaviate format')
+
+    query = commands.add_parser('query', help='Search the shards of some tenants')
+    query.add_argument('question')
+    query.add_argument('--tenant', action='append', default=None)
+    query.add_argument('--document', action='append', default=None)
+    query.add_argument('-k', type=int, default=3)
+
+    commands.add_parser('list', help='Show groups and shard sizes')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    router = open_router(args.root, args.backend)
+    try:
+        if args.command == 'ingest':
+            from chunk_store import import_records
+            from json_stream import iter_records
+            count = router.ingest(args.tenant, import_records(iter_records(args.input)),
+                                  args.document)
+            print('%d chunks ingested into %s' % (count, group_key(args.tenant, args.document)))
+        elif args.command == 'query':
+            for result in router.search(args.question, args.k, args.tenant, args.document):
+                print('%.3f %s p.%s %s' % (result['score'],
+                                           group_key(result['tenant'], result['document']),
+                                           result['metadata']['page'], result['text'][:80]))
+        else:
+            for key, group in sorted(router.manifest['groups'].items()):
+                rows = [shard['rows'] for shard in group['shards']]
+                print('%-30s %3d shards %8d chunks' % (key, len(rows), sum(rows)))
+    finally:
+        router.close()
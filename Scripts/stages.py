@@ -0,0 +1,216 @@
+"""
+Script com estágios de streaming ligados por filas limitadas.
+
+Cada estágio roda numa thread coordenadora e pode distribuir o trabalho num
+pool de threads (chamadas de API, I/O) ou de processos (parsing pesado de
+CPU). As filas entre estágios são limitadas e cada estágio mantém no máximo
+`2 * workers` tarefas em andamento, então um estágio lento segura os
+anteriores (backpressure) e a memória não cresce com o tamanho do corpus.
+"""
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from json_stream import batched
+
+QUEUE_SIZE = 64
+
+_END = object()
+_POLL_SECONDS = 0.1
+_EXECUTORS = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+
+
+class Cancelled(Exception):
+    """O pipeline foi cancelado por erro em outro estágio ou pelo consumidor."""
+
+
+class Stage:
+    """
+    Um estágio do pipeline.
+
+    kind='stream': `fn(iterador) -> iterador`, roda numa única thread
+    (estágios com estado, como um lote aberto no Weaviate).
+    kind='thread' ou 'process': `fn(item) -> resultado`, aplicado em paralelo
+    por `workers`; com `batch_size`, `fn(lista) -> lista` e o resultado é
+    achatado. A ordem de saída é sempre a ordem de entrada.
+    `source` fornece a entrada de um estágio sem predecessor.
+    """
+
+    def __init__(self, fn, workers=1, kind='stream', batch_size=None, source=None,
+                 name=None):
+        if kind != 'stream' and kind not in _EXECUTORS:
+            raise ValueError('tipo de estágio desconhecido: %s' % kind)
+        self.fn = fn
+        self.workers = workers
+        self.kind = kind
+        self.batch_size = batch_size
+        self.source = source
+        self.name = name or getattr(fn, '__name__', kind)
+
+
+def get(box, cancel):
+    while not cancel.is_set():
+        try:
+            return box.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            continue
+    raise Cancelled()
+
+
+def put(box, item, cancel):
+    # put com timeout para que um estágio bloqueado perceba o cancelamento
+    while not cancel.is_set():
+        try:
+            box.put(item, timeout=_POLL_SECONDS)
+            return
+        except queue.Full:
+            continue
+    raise Cancelled()
+
+
+class StageRunner:
+    """Executa um `Stage` numa thread, lendo de `inbox` e escrevendo em `outboxes`."""
+
+    def __init__(self, stage, inbox, outboxes, cancel, name=None):
+        self.stage = stage
+        self.name = name or stage.name
+        self.inbox = inbox
+        self.outboxes = outboxes
+        self.cancel = cancel
+        self.items_in = 0
+        self.items_out = 0
+        self.seconds = 0.0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def join(self):
+        self.thread.join()
+
+    def stats(self):
+        return {
+            'items_in': self.items_in,
+            'items_out': self.items_out,
+            'seconds': self.seconds,
+            'items_per_second': self.items_out / self.seconds if self.seconds else 0.0,
+        }
+
+    def _inputs(self):
+        if self.inbox is None:
+            for item in self.stage.source or ():
+                if self.cancel.is_set():
+                    raise Cancelled()
+                self.items_in += 1
+                yield item
+            return
+        while True:
+            item = get(self.inbox, self.cancel)
+            if item is _END:
+                return
+            self.items_in += 1
+            yield item
+
+    def _emit(self, item):
+        self.items_out += 1
+        for box in self.outboxes:
+            put(box, item, self.cancel)
+
+    def _emit_result(self, result):
+        if self.stage.batch_size:
+            for item in result:
+                self._emit(item)
+        else:
+            self._emit(result)
+
+    def _run_pool(self, inputs):
+        stage = self.stage
+        items = batched(inputs, stage.batch_size) if stage.batch_size else inputs
+        pool = _EXECUTORS[stage.kind](max_workers=stage.workers)
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(pool.submit(stage.fn, item))
+                if len(pending) >= 2 * stage.workers:
+                    self._emit_result(pending.popleft().result())
+                # Resultados prontos saem já, sem esperar a janela encher:
+                # com uma entrada lenta a saída continua incremental e em ordem
+                while pending and pending[0].done():
+                    self._emit_result(pending.popleft().result())
+            while pending:
+                self._emit_result(pending.popleft().result())
+        finally:
+            pool.shutdown(wait=not self.cancel.is_set(), cancel_futures=True)
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            if self.stage.kind == 'stream':
+                for item in self.stage.fn(self._inputs()):
+                    self._emit(item)
+            else:
+                self._run_pool(self._inputs())
+            for box in self.outboxes:
+                put(box, _END, self.cancel)
+        except Cancelled:
+            pass
+        except BaseException as e:
+            self.error = e
+            self.cancel.set()
+        finally:
+            self.seconds = time.perf_counter() - start
+
+
+def raise_first_error(runners):
+    for runner in runners:
+        if runner.error is not None:
+            raise RuntimeError('falha no estágio %s' % runner.name) from runner.error
+
+
+class Pipeline:
+    """
+    Encadeia estágios linearmente. Iterar sobre o pipeline devolve as saídas
+    do último estágio; parar de iterar cancela os estágios anteriores.
+    """
+
+    def __init__(self, stages, queue_size=QUEUE_SIZE):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.runners = []
+
+    def __iter__(self):
+        cancel = threading.Event()
+        boxes = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        self.runners = [
+            StageRunner(stage, boxes[i - 1] if i else None, [boxes[i]], cancel)
+            for i, stage in enumerate(self.stages)
+        ]
+        for runner in self.runners:
+            runner.start()
+        finished = False
+        try:
+            while True:
+                try:
+                    item = get(boxes[-1], cancel)
+                except Cancelled:
+                    break
+                if item is _END:
+                    finished = True
+                    break
+                yield item
+        finally:
+            if not finished:
+                cancel.set()
+            for runner in self.runners:
+                runner.join()
+        raise_first_error(self.runners)
+
+    def run(self):
+        """Consome o pipeline inteiro e devolve o número de itens produzidos."""
+        return sum(1 for _ in self)
+
+    def stats(self):
+        return {runner.name: runner.stats() for runner in self.runners}
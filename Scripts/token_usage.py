@@ -0,0 +1,350 @@
+"""
+Script para contabilizar os tokens gastos nas chamadas à API OpenAI.
+
+Cada chamada de `generate_embeddings`, `classify_query` e
+`generate_response` passa por `TokenLedger.call`, que mede o tempo e guarda
+os campos `usage` da resposta (tokens de entrada e de saída) com o estágio, o
+modelo e a consulta a que pertence (ver `query_scope`). A partir desses
+eventos o ledger calcula, em janelas deslizantes, tokens por segundo, custo
+em dólares e custo por consulta; o `/metrics` do `query_service.py` publica
+esse resumo.
+
+Os eventos também vão, em lotes, para um arquivo SQLite
+(`COSMOS_RAG_USAGE_DB`, padrão `data/token_usage.sqlite`) para consultas
+históricas:
+
+    python token_usage.py --since 24h --by stage,model
+
+Orçamentos por estágio, em tokens por minuto, vêm de
+`COSMOS_RAG_TOKEN_BUDGETS` (`generate_response=20000,classify_query=5000`):
+uma chamada de um estágio que já gastou o orçamento no último minuto levanta
+`BudgetExceeded` antes de chegar à API.
+"""
+import argparse
+import atexit
+import contextvars
+import os
+import pathlib
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+
+USAGE_DB_PATH = 'data/token_usage.sqlite'
+WINDOWS = (60, 300, 3600)
+BUDGET_WINDOW = 60
+
+# US$ por 1K tokens (entrada, saída); modelos com data no nome casam pelo prefixo
+PRICES = {
+    'text-embedding-ada-002': (0.0001, 0.0),
+    'text-embedding-3-small': (0.00002, 0.0),
+    'text-embedding-3-large': (0.00013, 0.0),
+    'text-davinci-003': (0.02, 0.02),
+    'gpt-3.5-turbo': (0.0005, 0.0015),
+    'gpt-4o-mini': (0.00015, 0.0006),
+    'gpt-4o': (0.0025, 0.01),
+    'gpt-4-turbo': (0.01, 0.03),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_usage (
+    timestamp REAL NOT NULL,
+    stage TEXT NOT NULL,
+    model TEXT NOT NULL,
+    query_id TEXT,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    cost_usd REAL
+);
+CREATE INDEX IF NOT EXISTS token_usage_timestamp ON token_usage (timestamp);
+"""
+
+_query_id = contextvars.ContextVar('cosmos_rag_query_id', default=None)
+
+
+class BudgetExceeded(RuntimeError):
+    """O estágio já gastou o orçamento de tokens da janela atual."""
+
+
+class query_scope:
+    """Associa as chamadas feitas dentro do bloco a uma consulta."""
+
+    def __init__(self, query_id=None):
+        self.query_id = query_id or uuid.uuid4().hex
+        self._token = None
+
+    def __enter__(self):
+        self._token = _query_id.set(self.query_id)
+        return self.query_id
+
+    def __exit__(self, *exc):
+        _query_id.reset(self._token)
+
+
+def _field(obj, name):
+    # Respostas da biblioteca openai 1.x têm atributos; as da 0.x são dicts
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def usage_counts(response):
+    """(tokens de entrada, tokens de saída) do campo `usage` da resposta."""
+    usage = _field(response, 'usage')
+    return (_field(usage, 'prompt_tokens') or 0), (_field(usage, 'completion_tokens') or 0)
+
+
+def price(model):
+    matches = [name for name in PRICES if model == name or model.startswith(name + '-')]
+    return PRICES[max(matches, key=len)] if matches else None
+
+
+def cost(model, prompt_tokens, completion_tokens):
+    """Custo em US$, ou `None` para modelos sem preço conhecido."""
+    rates = price(model)
+    if rates is None:
+        return None
+    return (prompt_tokens * rates[0] + completion_tokens * rates[1]) / 1000.0
+
+
+def parse_budgets(text):
+    """`estágio=tokens,...` -> {estágio: tokens por minuto}."""
+    budgets = {}
+    for item in filter(None, (part.strip() for part in (text or '').split(','))):
+        stage, _, value = item.partition('=')
+        try:
+            budgets[stage.strip()] = int(value)
+        except ValueError:
+            raise ValueError('orçamento inválido: %r (use estágio=tokens)' % item)
+    return budgets
+
+
+class TokenLedger:
+    """Eventos de uso de tokens: janelas em memória e histórico em SQLite."""
+
+    def __init__(self, db_path=None, budgets=None, flush_every=64, horizon=max(WINDOWS)):
+        self.db_path = db_path
+        self.budgets = dict(budgets or {})
+        self.flush_every = flush_every
+        self.horizon = horizon
+        self.started = time.time()
+        self.events = deque()
+        self.totals = {}
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def _expire(self, now):
+        while self.events and self.events[0][0] < now - self.horizon:
+            self.events.popleft()
+
+    def _window_tokens(self, stage, seconds, now):
+        return sum(event[4] + event[5] for event in self.events
+                   if event[1] == stage and event[0] >= now - seconds)
+
+    def check(self, stage):
+        budget = self.budgets.get(stage)
+        if budget is None:
+            return
+        with self._lock:
+            used = self._window_tokens(stage, BUDGET_WINDOW, time.time())
+        if used >= budget:
+            raise BudgetExceeded('%s: %d de %d tokens usados no último minuto'
+                                 % (stage, used, budget))
+
+    def record(self, stage, model, prompt_tokens, completion_tokens, seconds, query_id=None):
+        now = time.time()
+        query_id = query_id or _query_id.get()
+        event = (now, stage, model, query_id, prompt_tokens, completion_tokens, seconds,
+                 cost(model, prompt_tokens, completion_tokens))
+        with self._lock:
+            self.events.append(event)
+            self._expire(now)
+            totals = self.totals.setdefault((stage, model), [0, 0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += prompt_tokens
+            totals[2] += completion_tokens
+            totals[3] += event[7] or 0.0
+            if self.db_path:
+                self._pending.append(event)
+            flush = len(self._pending) >= self.flush_every
+        if flush:
+            self.flush()
+        return event
+
+    def call(self, stage, model, create, **kwargs):
+        """Chama `create(model=model, **kwargs)` e registra o uso da resposta."""
+        self.check(stage)
+        start = time.perf_counter()
+        response = create(model=model, **kwargs)
+        self.record(stage, model, *usage_counts(response),
+                    seconds=time.perf_counter() - start)
+        return response
+
+    def snapshot(self, windows=WINDOWS):
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            events = list(self.events)
+            totals = {'%s/%s' % key: {'calls': value[0], 'prompt_tokens': value[1],
+                                      'completion_tokens': value[2], 'cost_usd': value[3]}
+                      for key, value in self.totals.items()}
+        result = {'totals': totals, 'windows': {}}
+        for seconds in windows:
+            span = min(seconds, max(now - self.started, 1e-9))
+            result['windows']['%ds' % seconds] = _aggregate(
+                [event for event in events if event[0] >= now - seconds], span)
+        result['budgets'] = {
+            stage: {'tokens_per_minute': budget,
+                    'used': sum(e[4] + e[5] for e in events
+                                if e[1] == stage and e[0] >= now - BUDGET_WINDOW)}
+            for stage, budget in self.budgets.items()}
+        return result
+
+    def flush(self):
+        if not self.db_path:
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with sqlite3.connect(self.db_path) as db:
+                db.executescript(_SCHEMA)
+                db.executemany('INSERT INTO token_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                               pending)
+            db.close()
+        return len(pending)
+
+
+def _aggregate(events, span):
+    """Resumo por estágio e modelo de uma janela de `span` segundos."""
+    stages = {}
+    for _, stage, model, query_id, prompt, completion, seconds, price_usd in events:
+        stats = stages.setdefault(stage, {}).setdefault(model, {
+            'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'seconds': 0.0,
+            'cost_usd': 0.0, 'queries': set()})
+        stats['calls'] += 1
+        stats['prompt_tokens'] += prompt
+        stats['completion_tokens'] += completion
+        stats['seconds'] += seconds
+        stats['cost_usd'] += price_usd or 0.0
+        if query_id:
+            stats['queries'].add(query_id)
+    for models in stages.values():
+        for stats in models.values():
+            queries = len(stats.pop('queries'))
+            tokens = stats['prompt_tokens'] + stats['completion_tokens']
+            stats['tokens_per_second'] = tokens / span
+            stats['mean_seconds'] = stats.pop('seconds') / stats['calls']
+            stats['queries'] = queries
+            stats['cost_per_query_usd'] = stats['cost_usd'] / queries if queries else None
+    return stages
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    """O ledger do processo, configurado pelos tunables na primeira chamada."""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            from rag_config import get_config
+            tunables = get_config().tunables
+            _ledger = TokenLedger(tunables.usage_db, parse_budgets(tunables.token_budgets))
+            atexit.register(_ledger.flush)
+        return _ledger
+
+
+_GROUPS = {'stage': 'stage', 'model': 'model',
+           'hour': "strftime('%Y-%m-%d %H:00', timestamp, 'unixepoch')",
+           'day': "strftime('%Y-%m-%d', timestamp, 'unixepoch')"}
+
+
+def history(db_path=USAGE_DB_PATH, since=None, by=('stage', 'model')):
+    """Totais históricos do SQLite, agrupados por `by` (stage, model, hour, day).
+
+    O banco é aberto só para leitura: um caminho inexistente levanta
+    `FileNotFoundError` em vez de criar um arquivo vazio.
+    """
+    unknown = [name for name in by if name not in _GROUPS]
+    if unknown:
+        raise ValueError('agrupamento desconhecido: %s' % ', '.join(unknown))
+    columns = [_GROUPS[name] for name in by]
+    sql = ('SELECT %s, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), '
+           'SUM(seconds), SUM(cost_usd), COUNT(DISTINCT query_id), MIN(timestamp), '
+           'MAX(timestamp) FROM token_usage '
+           'WHERE timestamp >= ? GROUP BY %s ORDER BY %s'
+           % (', '.join(columns), ', '.join(columns), ', '.join(columns)))
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError('nenhum uso de tokens registrado em %s' % db_path)
+    db = sqlite3.connect('%s?mode=ro' % pathlib.Path(db_path).resolve().as_uri(), uri=True)
+    try:
+        if not db.execute("SELECT 1 FROM sqlite_master WHERE name = 'token_usage'").fetchone():
+            return []
+        rows = db.execute(sql, (time.time() - since if since else 0,)).fetchall()
+    finally:
+        db.close()
+    keys = list(by) + ['calls', 'prompt_tokens', 'completion_tokens', 'seconds', 'cost_usd',
+                       'queries', 'first', 'last']
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def parse_duration(text):
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if text[-1:] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def throughput(row):
+    """Tokens por segundo entre a primeira e a última chamada do grupo, ou
+    `None` se todas caíram no mesmo instante."""
+    span = row['last'] - row['first']
+    return (row['prompt_tokens'] + row['completion_tokens']) / span if span > 0 else None
+
+
+def print_history(rows, by, out=sys.stdout):
+    width = max([len(str(row[name])) for row in rows for name in by] + [8])
+    out.write('  '.join('%-*s' % (width, name) for name in by))
+    out.write('%8s %12s %12s %10s %10s %10s\n' % ('calls', 'prompt', 'completion', 'cost $',
+                                                 'mean s', 'tok/s'))
+    for row in rows:
+        out.write('  '.join('%-*s' % (width, row[name]) for name in by))
+        rate = throughput(row)
+        out.write('%8d %12d %12d %10.4f %10.3f %10s\n' % (
+            row['calls'], row['prompt_tokens'], row['completion_tokens'],
+            row['cost_usd'] or 0.0, row['seconds'] / row['calls'],
+            '-' if rate is None else '%.1f' % rate))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Report token usage from the SQLite log.')
+    parser.add_argument('--db', default=None, help='Default: COSMOS_RAG_USAGE_DB')
+    parser.add_argument('--since', default=None, help='e.g. 90m, 24h, 7d (default: all)')
+    parser.add_argument('--by', default='stage,model',
+                        help='Comma-separated: stage, model, hour, day')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.db is None:
+        from rag_config import get_config
+        args.db = get_config().tunables.usage_db or USAGE_DB_PATH
+    by = [name.strip() for name in args.by.split(',')]
+    try:
+        rows = history(args.db, args.since and parse_duration(args.since), by)
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+    print_history(rows, by)
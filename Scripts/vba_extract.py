@@ -8,71 +8,192 @@
 # SPDX-License-Identifier: BSD-2-Clause
 # Copyright 2013-2024, John McNamara, jmcnamara@cpan.org
 #
+import json
+import os
+import shutil
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from zipfile import ZipFile
 from zipfile import BadZipFile
 
 
-def extract_file(xlsm_zip, filename):
-    # Extract a single file from an Excel xlsm macro file.
-    data = xlsm_zip.read("xl/" + filename)
-
-    # Write the data to a local file.
-    file = open(filename, "wb")
-    file.write(data)
-    file.close()
-
-
 # The VBA project file and project signature file we want to extract.
 vba_filename = "vbaProject.bin"
 vba_signature_filename = "vbaProjectSignature.bin"
 
-# Get the xlsm file name from the commandline.
-if len(sys.argv) > 1:
-    xlsm_file = sys.argv[1]
-else:
-    print(
-        "\nUtility to extract a vbaProject.bin binary from an Excel 2007+ "
-        "xlsm macro file for insertion into an XlsxWriter file.\n"
-        "If the macros are digitally signed, extracts also a vbaProjectSignature.bin "
-        "file.\n"
-        "\n"
-        "See: https://xlsxwriter.readthedocs.io/working_with_macros.html\n"
-        "\n"
-        "Usage: vba_extract file.xlsm\n"
-    )
-    exit()
-
-try:
-    # Open the Excel xlsm file as a zip file.
-    xlsm_zip = ZipFile(xlsm_file, "r")
-
-    # Read the xl/vbaProject.bin file.
-    extract_file(xlsm_zip, vba_filename)
-    print("Extracted: %s" % vba_filename)
-
-    if "xl/" + vba_signature_filename in xlsm_zip.namelist():
-        extract_file(xlsm_zip, vba_signature_filename)
-        print("Extracted: %s" % vba_signature_filename)
-
-
-except IOError as e:
-    print("File error: %s" % str(e))
-    exit()
-
-except KeyError as e:
-    # Usually when there isn't a xl/vbaProject.bin member in the file.
-    print("File error: %s" % str(e))
-    print("File may not be an Excel xlsm macro file: '%s'" % xlsm_file)
-    exit()
-
-except BadZipFile as e:
-    # Usually if the file is an xls file and not an xlsm file.
-    print("File error: %s: '%s'" % (str(e), xlsm_file))
-    print("File may not be an Excel xlsm macro file.")
-    exit()
-
-except Exception as e:
-    # Catch any other exceptions.
-    print("File error: %s" % str(e))
-    exit()
+# Macro enabled workbook, template and add-in files found in directories.
+macro_extensions = (".xlsm", ".xltm", ".xlam")
+
+usage = (
+    "\nUtility to extract a vbaProject.bin binary from an Excel 2007+ "
+    "xlsm macro file for insertion into an XlsxWriter file.\n"
+    "If the macros are digitally signed, extracts also a vbaProjectSignature.bin "
+    "file.\n"
+    "\n"
+    "See: https://xlsxwriter.readthedocs.io/working_with_macros.html\n"
+    "\n"
+    "Usage: vba_extract file.xlsm\n"
+    "       vba_extract [-o outdir] [-j jobs] [--manifest file] "
+    "file.xlsm|dir ...\n"
+    "\n"
+    "With several files or a directory each workbook's files are written to\n"
+    "outdir/<workbook name>/ and a JSON manifest is written to\n"
+    "outdir/manifest.json.\n"
+)
+
+
+def extract_file(xlsm_zip, filename, dest_dir="."):
+    # Extract a single file from an Excel xlsm macro file, streaming the
+    # zip member to disk rather than reading it into memory.
+    path = os.path.join(dest_dir, filename)
+    with xlsm_zip.open("xl/" + filename) as src, open(path, "wb") as dest:
+        shutil.copyfileobj(src, dest)
+    return path
+
+
+def extract_workbook(xlsm_file, dest_dir="."):
+    # Extract the VBA project (and signature) of one workbook. Returns a
+    # manifest entry instead of raising, so one bad file does not stop a
+    # batch.
+    entry = {"workbook": xlsm_file, "output": dest_dir, "files": []}
+    try:
+        # Open the Excel xlsm file as a zip file.
+        with ZipFile(xlsm_file, "r") as xlsm_zip:
+            # Raises KeyError before any output is created for the file.
+            xlsm_zip.getinfo("xl/" + vba_filename)
+            if not os.path.isdir(dest_dir):
+                os.makedirs(dest_dir)
+
+            # Read the xl/vbaProject.bin file.
+            entry["files"].append(extract_file(xlsm_zip, vba_filename,
+                                               dest_dir))
+
+            if "xl/" + vba_signature_filename in xlsm_zip.namelist():
+                entry["files"].append(
+                    extract_file(xlsm_zip, vba_signature_filename, dest_dir))
+        entry["status"] = "ok"
+        entry["signed"] = len(entry["files"]) > 1
+        entry["bytes"] = sum(os.path.getsize(f) for f in entry["files"])
+
+    except IOError as e:
+        entry.update(status="error", error="File error: %s" % str(e))
+
+    except KeyError as e:
+        # Usually when there isn't a xl/vbaProject.bin member in the file.
+        entry.update(status="not-macro",
+                     error="File may not be an Excel xlsm macro file: %s"
+                     % str(e))
+
+    except BadZipFile as e:
+        # Usually if the file is an xls file and not an xlsm file.
+        entry.update(status="not-macro",
+                     error="File error: %s. File may not be an Excel xlsm "
+                     "macro file." % str(e))
+
+    except Exception as e:
+        # Catch any other exceptions.
+        entry.update(status="error", error="File error: %s" % str(e))
+
+    return entry
+
+
+def find_workbooks(paths):
+    # Expand directories (recursively) into the macro files they contain.
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(macro_extensions):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def output_dirs(workbooks, out_dir):
+    # One output directory per workbook, named after it. Every workbook's
+    # own name is reserved first; later workbooks with a name already used
+    # get the first numeric suffix that is still free, so in/a.xlsm,
+    # in/sub/a.xlsm and in/a-1.xlsm map to a, a-2 and a-1.
+    names = [os.path.splitext(os.path.basename(w))[0] for w in workbooks]
+    taken = set(names)
+    seen = set()
+    dirs = []
+    for name in names:
+        unique = name
+        if name in seen:
+            count = 1
+            while "%s-%d" % (name, count) in taken:
+                count += 1
+            unique = "%s-%d" % (name, count)
+            taken.add(unique)
+        seen.add(name)
+        dirs.append(os.path.join(out_dir, unique))
+    return dirs
+
+
+def extract_batch(workbooks, out_dir, jobs=None, manifest=None):
+    # Extract many workbooks on a process pool and write a JSON manifest.
+    workbooks = list(workbooks)
+    dest_dirs = output_dirs(workbooks, out_dir)
+    if jobs == 1 or len(workbooks) < 2:
+        entries = list(map(extract_workbook, workbooks, dest_dirs))
+    else:
+        workers = jobs or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(workbooks) // (4 * workers))
+            entries = list(pool.map(extract_workbook, workbooks, dest_dirs,
+                                    chunksize=chunksize))
+
+    summary = {"workbooks": len(entries)}
+    for entry in entries:
+        summary[entry["status"]] = summary.get(entry["status"], 0) + 1
+    summary["signed"] = sum(1 for e in entries if e.get("signed"))
+    summary["bytes"] = sum(e.get("bytes", 0) for e in entries)
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    manifest = manifest or os.path.join(out_dir, "manifest.json")
+    with open(manifest, "w") as f:
+        json.dump({"summary": summary, "workbooks": entries}, f, indent=2)
+    return summary, manifest
+
+
+def main(argv):
+    import argparse
+
+    if not argv:
+        print(usage)
+        return 0
+
+    parser = argparse.ArgumentParser(prog="vba_extract", usage=usage)
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("-o", "--outdir", default=None)
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    parser.add_argument("--manifest", default=None)
+    args = parser.parse_args(argv)
+
+    batch = (len(args.paths) > 1 or os.path.isdir(args.paths[0]) or
+             args.outdir or args.manifest)
+    if not batch:
+        # Single workbook: extract to the current directory, as before.
+        xlsm_file = args.paths[0]
+        entry = extract_workbook(xlsm_file)
+        if entry["status"] != "ok":
+            print(entry["error"])
+            return 1
+        for path in entry["files"]:
+            print("Extracted: %s" % os.path.basename(path))
+        return 0
+
+    out_dir = args.outdir or "."
+    summary, manifest = extract_batch(find_workbooks(args.paths), out_dir,
+                                      args.jobs, args.manifest)
+    print("Extracted %d of %d workbooks (%d signed), manifest: %s"
+          % (summary.get("ok", 0), summary["workbooks"], summary["signed"],
+             manifest))
+    return 0 if summary.get("ok", 0) == summary["workbooks"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
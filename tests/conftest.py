@@ -0,0 +1,49 @@
+"""
+Os scripts do projeto importam uns aos outros pelo nome (`from json_stream
+import ...`), então os testes rodam com `Scripts/` no caminho de importação.
+"""
+import os
+import sys
+
+import pytest
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Scripts')
+if SCRIPTS not in sys.path:
+    sys.path.insert(0, SCRIPTS)
+
+
+@pytest.fixture
+def fresh_config(monkeypatch):
+    """Relê a configuração e descarta o ledger e o cliente compartilhados,
+    antes e depois do teste, para que as variáveis de ambiente valham."""
+    import chat_client
+    import rag_config
+    import token_usage
+
+    def reset():
+        rag_config.reload_config()
+        chat_client.client.cache_clear()
+        token_usage._ledger = None
+
+    monkeypatch.setenv('COSMOS_RAG_USAGE_DB', '')
+    monkeypatch.delenv('COSMOS_RAG_TOKEN_BUDGETS', raising=False)
+    yield reset
+    monkeypatch.undo()
+    reset()
+
+
+@pytest.fixture(scope='session')
+def stub_server():
+    from openai_stub import start_stub
+    server, base_url = start_stub(dim=8)
+    yield base_url
+    server.shutdown()
+
+
+@pytest.fixture
+def stub(stub_server, monkeypatch, fresh_config):
+    """A API da OpenAI apontada para o `openai_stub.py` local."""
+    monkeypatch.setenv('COSMOS_RAG_OPENAI_BASE_URL', stub_server)
+    monkeypatch.setenv('COSMOS_RAG_OPENAI_API_KEY', 'stub')
+    fresh_config()
+    return stub_server
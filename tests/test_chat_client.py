@@ -0,0 +1,126 @@
+import json
+import time
+
+import pytest
+
+import chat_client
+from json_stream import JsonWriter, iter_records
+
+
+def test_chat(stub):
+    assert chat_client.chat('olá cosmos') == 'stub: olá cosmos'
+    assert chat_client.chat({'messages': [{'role': 'user', 'content': 'vida'}]}) == 'stub: vida'
+
+
+def test_chat_records_usage(stub):
+    from token_usage import get_ledger
+    chat_client.chat('uma pergunta', stage='teste')
+    totals = get_ledger().snapshot()['totals']
+    key = 'teste/gpt-4o-mini'
+    assert totals[key]['calls'] == 1
+    assert totals[key]['prompt_tokens'] > 0
+
+
+def test_generate_embeddings(stub):
+    from generate_embeddings import embed_batch, generate_embeddings
+    vector = generate_embeddings('silício', 'stub')
+    assert len(vector) == 8
+    assert generate_embeddings('silício', 'stub') == vector
+    records = embed_batch([{'text': 'a'}, {'text': 'silício'}], 'stub')
+    assert [record['text'] for record in records] == ['a', 'silício']
+    assert records[1]['embedding'] == vector
+
+
+def test_bulk_chat_keeps_input_order(stub):
+    requests = [{'id': 'q%d' % i, 'prompt': 'pergunta %d' % i} for i in range(40)]
+    results = chat_client.chat_many(requests, concurrency=8)
+    assert [result['id'] for result in results] == ['q%d' % i for i in range(40)]
+    assert [result['answer'] for result in results] == ['stub: pergunta %d' % i
+                                                        for i in range(40)]
+    assert all(result['usage']['prompt_tokens'] > 0 for result in results)
+
+
+def test_bulk_chat_reports_errors_per_item(stub):
+    requests = [{'id': 'ok', 'prompt': 'a'}, {'id': 'bad'}, 42, 'texto solto']
+    results = chat_client.chat_many(requests, concurrency=2)
+    assert [result['id'] for result in results] == ['ok', 'bad', 2, 3]
+    assert results[0]['answer'] == 'stub: a'
+    assert results[1]['answer'] is None and results[1]['error'].startswith('ValueError')
+    assert results[2]['answer'] is None and results[2]['error'].startswith('ValueError')
+    assert results[3]['answer'] == 'stub: texto solto'
+
+
+def test_bulk_jsonl(stub, tmp_path):
+    source = tmp_path / 'pedidos.jsonl'
+    source.write_text('{"id": 1, "prompt": "a b"}\n[1, 2]\n{"id": "bad"}\n'
+                      '{"id": 4, "query": "vida", "passages": ["carbono"]}\n')
+    count, errors = chat_client.bulk_jsonl(str(source), str(tmp_path / 'respostas.jsonl'))
+    assert (count, errors) == (4, 2)
+    results = list(iter_records(str(tmp_path / 'respostas.jsonl')))
+    assert [result['id'] for result in results] == [1, 1, 'bad', 4]
+    assert [result['answer'] is None for result in results] == [False, True, True, False]
+
+
+def test_rate_limiter_paces_requests():
+    limiter = chat_client.RateLimiter(requests_per_minute=1200)  # 20 por segundo
+    limiter.buckets['requests'][1] = 0.0  # balde vazio: sem rajada inicial
+
+    async def acquire_all():
+        for _ in range(5):
+            await limiter.acquire()
+
+    import asyncio
+    start = time.perf_counter()
+    asyncio.run(acquire_all())
+    elapsed = time.perf_counter() - start
+    assert 0.2 <= elapsed < 0.6
+
+
+def test_rate_limiter_counts_tokens():
+    limiter = chat_client.RateLimiter(tokens_per_minute=600)
+    assert limiter._reserve(600) == 0.0
+    # Sem saldo: 10 tokens por segundo, então 300 tokens esperam ~30 s
+    assert limiter._reserve(300) == pytest.approx(30.0, rel=0.01)
+
+
+def test_write_batch_file_skips_invalid_requests(fresh_config, tmp_path):
+    fresh_config()
+    source = tmp_path / 'pedidos.jsonl'
+    source.write_text('{"id": "a", "prompt": "x"}\n"texto"\n7\n{"id": "bad"}\n')
+    with JsonWriter(str(tmp_path / 'erros.jsonl'), lines=True) as errors:
+        count, invalid = chat_client.write_batch_file(str(source), str(tmp_path / 'lote.jsonl'),
+                                                      errors, model='gpt-4o-mini')
+    assert (count, invalid) == (2, 2)
+    lines = list(iter_records(str(tmp_path / 'lote.jsonl')))
+    assert [line['custom_id'] for line in lines] == ['a', '1']
+    assert lines[0]['url'] == chat_client.CHAT_ENDPOINT
+    assert lines[0]['body']['messages'] == [{'role': 'user', 'content': 'x'}]
+    assert [error['id'] for error in iter_records(str(tmp_path / 'erros.jsonl'))] == [2, 'bad']
+
+
+def test_read_batch_output(fresh_config, tmp_path):
+    fresh_config()
+    usage = {'prompt_tokens': 12, 'completion_tokens': 3, 'total_tokens': 15}
+    lines = [
+        {'custom_id': 'a', 'error': None,
+         'response': {'status_code': 200, 'body': {
+             'model': 'gpt-4o-mini-2024-07-18', 'usage': usage,
+             'choices': [{'message': {'role': 'assistant', 'content': ' resposta '}}]}}},
+        {'custom_id': 'b', 'error': None,
+         'response': {'status_code': 400, 'body': {'error': {'message': 'ruim'}}}},
+        {'custom_id': 'c', 'response': None,
+         'error': {'code': 'batch_expired', 'message': 'expirou'}},
+    ]
+    output = str(tmp_path / 'respostas.jsonl')
+    text = '\n'.join(json.dumps(line) for line in lines) + '\n\n'
+    assert chat_client.read_batch_output(text.splitlines(), output, stage='lote') == (3, 2)
+
+    results = list(iter_records(output))
+    assert results[0] == {'id': 'a', 'answer': 'resposta',
+                          'usage': {'prompt_tokens': 12, 'completion_tokens': 3}}
+    assert results[1]['answer'] is None and 'ruim' in results[1]['error']
+    assert results[2]['answer'] is None and 'batch_expired' in results[2]['error']
+
+    from token_usage import get_ledger
+    totals = get_ledger().snapshot()['totals']
+    assert totals['lote/gpt-4o-mini-2024-07-18']['prompt_tokens'] == 12
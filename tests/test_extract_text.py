@@ -0,0 +1,51 @@
+from extract_text import reading_order
+
+WIDTH = 600
+
+
+def block(x0, y0, x1, y1, text):
+    # O formato de get_text("blocks"): (x0, y0, x1, y1, texto, número, tipo)
+    return (x0, y0, x1, y1, text, 0, 0)
+
+
+def texts(blocks):
+    return [b[4] for b in reading_order(blocks, WIDTH)]
+
+
+def test_two_columns_left_then_right():
+    blocks = [
+        block(320, 100, 560, 200, 'direita 1'),
+        block(40, 300, 280, 400, 'esquerda 2'),
+        block(40, 100, 280, 200, 'esquerda 1'),
+        block(320, 300, 560, 400, 'direita 2'),
+    ]
+    assert texts(blocks) == ['esquerda 1', 'esquerda 2', 'direita 1', 'direita 2']
+
+
+def test_wide_blocks_separate_sections():
+    blocks = [
+        block(320, 120, 560, 300, 'direita a'),
+        block(40, 40, 560, 80, 'título'),
+        block(40, 120, 280, 300, 'esquerda a'),
+        block(40, 340, 560, 380, 'subtítulo'),
+        block(320, 420, 560, 600, 'direita b'),
+        block(40, 420, 280, 600, 'esquerda b'),
+        block(40, 640, 560, 700, 'rodapé'),
+    ]
+    assert texts(blocks) == ['título', 'esquerda a', 'direita a', 'subtítulo',
+                             'esquerda b', 'direita b', 'rodapé']
+
+
+def test_single_column_keeps_top_to_bottom():
+    blocks = [block(60, y, 540, y + 40, 'parágrafo %d' % i)
+              for i, y in reversed(list(enumerate(range(50, 500, 50))))]
+    assert texts(blocks) == ['parágrafo %d' % i for i in range(9)]
+
+
+def test_blocks_on_the_same_line_go_left_to_right():
+    blocks = [block(150, 100, 250, 120, 'b'), block(40, 100, 140, 120, 'a')]
+    assert texts(blocks) == ['a', 'b']
+
+
+def test_empty_page():
+    assert reading_order([], WIDTH) == []
@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+import token_usage
+from token_usage import BudgetExceeded, TokenLedger, query_scope
+
+
+def test_record_totals_and_cost():
+    ledger = TokenLedger()
+    event = ledger.record('generate_response', 'gpt-4o-mini', 1000, 500, 0.5)
+    assert event[7] == pytest.approx((1000 * 0.00015 + 500 * 0.0006) / 1000)
+    ledger.record('generate_response', 'gpt-4o-mini', 10, 5, 0.1)
+    totals = ledger.snapshot()['totals']['generate_response/gpt-4o-mini']
+    assert totals['calls'] == 2
+    assert (totals['prompt_tokens'], totals['completion_tokens']) == (1010, 505)
+
+
+def test_record_unknown_model_has_no_cost():
+    ledger = TokenLedger()
+    assert ledger.record('x', 'modelo-local', 10, 10, 0.1)[7] is None
+    assert token_usage.cost('gpt-4o-mini-2024-07-18', 1000, 0) == pytest.approx(0.00015)
+
+
+def test_snapshot_windows_and_queries():
+    ledger = TokenLedger()
+    with query_scope('q1'):
+        ledger.record('classify_query', 'gpt-4o-mini', 100, 10, 0.2)
+        ledger.record('generate_response', 'gpt-4o-mini', 300, 50, 0.4)
+    with query_scope('q2'):
+        ledger.record('generate_response', 'gpt-4o-mini', 100, 50, 0.6)
+    window = ledger.snapshot()['windows']['60s']
+    stats = window['generate_response']['gpt-4o-mini']
+    assert stats['calls'] == 2
+    assert stats['queries'] == 2
+    assert stats['mean_seconds'] == pytest.approx(0.5)
+    assert stats['tokens_per_second'] > 0
+    assert stats['cost_per_query_usd'] == pytest.approx(stats['cost_usd'] / 2)
+    assert set(window) == {'classify_query', 'generate_response'}
+
+
+def test_snapshot_forgets_events_outside_the_horizon(monkeypatch):
+    ledger = TokenLedger(horizon=60)
+    now = [1000.0]
+    monkeypatch.setattr(token_usage.time, 'time', lambda: now[0])
+    ledger.record('s', 'gpt-4o-mini', 10, 0, 0.1)
+    now[0] += 120
+    snapshot = ledger.snapshot(windows=(60,))
+    assert snapshot['windows']['60s'] == {}
+    assert snapshot['totals']['s/gpt-4o-mini']['calls'] == 1
+
+
+def test_check_enforces_budget_per_stage(monkeypatch):
+    ledger = TokenLedger(budgets={'generate_response': 100})
+    now = [1000.0]
+    monkeypatch.setattr(token_usage.time, 'time', lambda: now[0])
+    ledger.check('generate_response')
+    ledger.record('generate_response', 'gpt-4o-mini', 80, 30, 0.1)
+    with pytest.raises(BudgetExceeded):
+        ledger.check('generate_response')
+    ledger.check('classify_query')  # sem orçamento
+    now[0] += token_usage.BUDGET_WINDOW + 1
+    ledger.check('generate_response')
+    assert ledger.snapshot()['budgets']['generate_response']['used'] == 0
+
+
+def test_call_checks_and_records():
+    class Response:
+        usage = {'prompt_tokens': 7, 'completion_tokens': 3}
+
+    calls = []
+    ledger = TokenLedger(budgets={'s': 5})
+    response = ledger.call('s', 'gpt-4o-mini', lambda **kw: calls.append(kw) or Response(),
+                           messages=[])
+    assert isinstance(response, Response)
+    assert calls == [{'model': 'gpt-4o-mini', 'messages': []}]
+    with pytest.raises(BudgetExceeded):
+        ledger.call('s', 'gpt-4o-mini', lambda **kw: calls.append(kw))
+    assert len(calls) == 1
+
+
+def test_parse_budgets():
+    assert token_usage.parse_budgets('a=10, b=20') == {'a': 10, 'b': 20}
+    assert token_usage.parse_budgets(None) == {}
+    with pytest.raises(ValueError):
+        token_usage.parse_budgets('a=dez')
+
+
+def test_flush_and_history(tmp_path):
+    db_path = str(tmp_path / 'uso' / 'tokens.sqlite')
+    ledger = TokenLedger(db_path, flush_every=2)
+    ledger.record('embed', 'text-embedding-3-small', 100, 0, 0.1)
+    assert not os.path.exists(db_path)
+    ledger.record('embed', 'text-embedding-3-small', 50, 0, 0.1)  # lote cheio: grava
+    ledger.record('chat', 'gpt-4o-mini', 10, 20, 0.3)
+    assert ledger.flush() == 1
+    assert ledger.flush() == 0
+
+    rows = token_usage.history(db_path, by=['stage'])
+    assert [(row['stage'], row['calls'], row['prompt_tokens']) for row in rows] == [
+        ('chat', 1, 10), ('embed', 2, 150)]
+    assert token_usage.history(db_path, since=3600, by=['model'])[0]['model'] == 'gpt-4o-mini'
+
+
+def test_history_does_not_create_missing_db(tmp_path):
+    db_path = str(tmp_path / 'nada.sqlite')
+    with pytest.raises(FileNotFoundError):
+        token_usage.history(db_path)
+    assert not os.path.exists(db_path)
+    open(db_path, 'w').close()
+    assert token_usage.history(db_path) == []
+
+
+def test_throughput_uses_time_span():
+    row = {'prompt_tokens': 600, 'completion_tokens': 400, 'first': 100.0, 'last': 110.0}
+    assert token_usage.throughput(row) == 100.0
+    assert token_usage.throughput(dict(row, last=100.0)) is None